@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Peak memory of the ML anomaly stage on a customer with a huge merchant tail.
+
+Runs the IsolationForest stage on the same synthetic customer twice, each
+time in a fresh process so the peak RSS of one does not hide the other:
+once with the dense pd.get_dummies encoding the stage used to build (one
+column per distinct merchant and category), once with the sparse
+TransactionFeatureEncoder it uses now. Each child runs under an address
+space limit, so an encoding that does not fit is reported instead of
+taking the machine down.
+
+Usage:
+    python benchmark_anomaly_features.py [--transactions 100000] [--merchants 50000]
+        [--memory-limit-mb 4096]
+"""
+import sys
+import time
+import resource
+import argparse
+import multiprocessing
+
+import pandas as pd
+
+ENCODINGS = ['dense', 'sparse']
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _dense_stage(detector, df: pd.DataFrame):
+    """The ML stage as it was before the sparse encoder"""
+    from sklearn.preprocessing import StandardScaler
+
+    features = df[['amount', 'hour', 'day_of_week', 'day_of_month', 'month']].copy()
+    merchant_encoded = pd.get_dummies(df['merchant'], prefix='merchant')
+    category_encoded = pd.get_dummies(df['category'], prefix='category')
+    features = pd.concat([features, merchant_encoded, category_encoded], axis=1)
+
+    features_scaled = StandardScaler().fit_transform(features)
+    predictions = detector.isolation_forest.fit_predict(features_scaled)
+    detector.isolation_forest.score_samples(features_scaled)
+    return features.shape[1], int((predictions == -1).sum())
+
+
+def _sparse_stage(detector, df: pd.DataFrame):
+    from services.anomaly_features import TransactionFeatureEncoder
+
+    found = detector._detect_ml_anomalies(df)
+    return TransactionFeatureEncoder().n_features, len(found['positions'])
+
+
+def _run(encoding: str, args, results):
+    """Child process: build the customer, run one encoding, report its peak RSS"""
+    if args.memory_limit_mb:
+        limit = args.memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    from benchmark_anomalies import synthetic_history
+    from services.anomaly_detector import AnomalyDetector
+
+    detector = AnomalyDetector()
+    history = synthetic_history(args.transactions, args.merchants, args.seed)
+    df = detector._prepare_frame(history.assign(id=range(1, len(history) + 1)))
+    baseline_mb = _peak_rss_mb()
+
+    started = time.perf_counter()
+    try:
+        stage = _dense_stage if encoding == 'dense' else _sparse_stage
+        width, flagged = stage(detector, df)
+    except MemoryError:
+        results.put((encoding, None))
+        return
+    results.put((encoding, {
+        'distinct_merchants': int(df['merchant'].nunique()),
+        'width': width,
+        'flagged': flagged,
+        'seconds': time.perf_counter() - started,
+        'baseline_mb': baseline_mb,
+        'peak_mb': _peak_rss_mb()
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS of the ML anomaly stage, dense versus sparse features")
+    parser.add_argument("--transactions", type=int, default=100000)
+    parser.add_argument("--merchants", type=int, default=50000)
+    parser.add_argument("--memory-limit-mb", type=int, default=4096,
+                        help="Address space limit per run; 0 for none")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # Fresh interpreters: a forked child would start with the parent's memory
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    reports = {}
+    for encoding in ENCODINGS:
+        child = context.Process(target=_run, args=(encoding, args, results))
+        child.start()
+        child.join()
+        reports[encoding] = results.get() if child.exitcode == 0 else (encoding, None)
+
+    print("\n" + "=" * 50)
+    print(f"ML anomaly stage, {args.transactions} transactions over {args.merchants} merchants")
+    print("=" * 50)
+    for encoding in ENCODINGS:
+        _, report = reports[encoding]
+        if report is None:
+            print(f"{encoding:<7} did not fit in {args.memory_limit_mb} MB")
+            continue
+        print(f"{encoding:<7} {report['width']:7d} columns  peak RSS {report['peak_mb']:8.0f} MB "
+              f"(+{report['peak_mb'] - report['baseline_mb']:.0f} MB for the stage)  "
+              f"{report['seconds']:6.1f} s  {report['flagged']} flagged")
+    _, sparse_report = reports['sparse']
+    if sparse_report is not None:
+        print(f"\n{sparse_report['distinct_merchants']} distinct merchants in the history")
+    return 0 if sparse_report is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
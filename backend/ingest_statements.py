@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Bulk statement ingestion for back-filling a customer's historical PDFs.
+
+Walks a directory tree, parses the statements in parallel across cores,
+deduplicates and saves the transactions exactly like /upload-pdf, commits
+in large batches and records finished files in a checkpoint so an
+interrupted run can be resumed.
+
+Usage:
+    python ingest_statements.py <directory> --customer-id 1 [--workers 4]
+        [--batch-size 1000] [--checkpoint path] [--restart]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from database import SessionLocal, engine
+from models import Customer
+from migrations import run_migrations
+from services.pdf_parser import PDFParser
+from services.password_search import PasswordSearchEngine
+from services.password_store import PasswordStore
+from services.ocr_engine import OCREngine
+from services.statement_ingestion import StatementIngestionService
+from services.recurring_detector import RecurringChargeDetector
+
+# Per-worker parser and customer, created once by _init_worker
+_worker_parser = None
+_worker_customer = None
+
+
+def _init_worker(customer_id):
+    global _worker_parser, _worker_customer
+    engine.dispose(close=False)
+
+    # The files are already spread across processes, so each parser stays single-process
+    _worker_parser = PDFParser(password_store=PasswordStore())
+    _worker_parser.ocr_engine = OCREngine(max_workers=1)
+    _worker_parser.password_search = PasswordSearchEngine(max_workers=1)
+
+    db = SessionLocal()
+    try:
+        _worker_customer = db.query(Customer).filter(Customer.id == customer_id).first()
+        # Load the cards now so the customer stays usable after the session closes
+        list(_worker_customer.credit_cards)
+    finally:
+        db.close()
+
+
+def _parse_file(path):
+    """Parse one statement in a worker and return its result with stage timings"""
+    timings = {}
+    try:
+        # The parser opens the file directly, so the statement is never copied into memory
+        started = time.perf_counter()
+        text_content, page_extraction, _ = _worker_parser.extract_text(path, _worker_customer)
+        timings['extract'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        parsed_data = _worker_parser.process_extracted_text(text_content, page_extraction)
+        timings['parse'] = time.perf_counter() - started
+
+        return path, parsed_data, timings, None
+    except Exception as e:
+        error = getattr(e, 'detail', None) or str(e)
+        return path, None, timings, error
+
+
+def find_statements(directory):
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith('.pdf'):
+                paths.append(os.path.abspath(os.path.join(root, name)))
+    return paths
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'completed': []}
+
+
+def save_checkpoint(path, checkpoint):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def print_summary(stats, elapsed):
+    files_done = stats['files_ingested']
+    print("\n" + "=" * 50)
+    print("Ingestion Summary")
+    print("=" * 50)
+    print(f"Files ingested: {files_done}")
+    print(f"Files skipped (checkpoint): {stats['files_skipped']}")
+    print(f"Files failed: {stats['files_failed']}")
+    print(f"Transactions parsed: {stats['transactions_parsed']}")
+    print(f"Transactions saved: {stats['transactions_saved']}")
+    print(f"Duplicates removed: {stats['duplicates_removed']}")
+    print(f"Batches committed: {stats['commits']}")
+    print(f"Elapsed: {elapsed:.2f}s")
+    if elapsed > 0:
+        print(f"Throughput: {files_done / elapsed:.2f} files/s, "
+              f"{stats['transactions_parsed'] / elapsed:.1f} transactions/s")
+
+    print("\nStage timings (total seconds, worker stages summed across processes):")
+    for stage, seconds in stats['timings'].items():
+        average = seconds / files_done if files_done else 0.0
+        print(f"  {stage:<8} {seconds:8.2f}s  ({average * 1000:.1f} ms/file)")
+
+
+def ingest(directory, customer_id, workers, batch_size, checkpoint_path, restart=False):
+    run_migrations(engine)
+
+    db = SessionLocal()
+    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    if not customer:
+        db.close()
+        print(f"Customer {customer_id} not found")
+        return 1
+
+    checkpoint = {'completed': []} if restart else load_checkpoint(checkpoint_path)
+    completed = set(checkpoint['completed'])
+
+    paths = find_statements(directory)
+    pending = [path for path in paths if path not in completed]
+
+    stats = {
+        'files_ingested': 0,
+        'files_skipped': len(paths) - len(pending),
+        'files_failed': 0,
+        'transactions_parsed': 0,
+        'transactions_saved': 0,
+        'duplicates_removed': 0,
+        'commits': 0,
+        'timings': {'extract': 0.0, 'parse': 0.0, 'save': 0.0, 'commit': 0.0, 'recurring': 0.0}
+    }
+
+    print(f"Found {len(paths)} statements, {len(pending)} to ingest with {workers} workers")
+
+    ingestion = StatementIngestionService()
+    uncommitted_files = []
+    uncommitted_transactions = 0
+
+    def commit_batch():
+        nonlocal uncommitted_files, uncommitted_transactions
+        started = time.perf_counter()
+        db.commit()
+        # Only files whose rows are committed are marked done
+        checkpoint['completed'].extend(uncommitted_files)
+        save_checkpoint(checkpoint_path, checkpoint)
+        stats['timings']['commit'] += time.perf_counter() - started
+        stats['commits'] += 1
+        uncommitted_files = []
+        uncommitted_transactions = 0
+
+    started_at = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(customer_id,)) as executor:
+            futures = [executor.submit(_parse_file, path) for path in pending]
+
+            for future in as_completed(futures):
+                path, parsed_data, timings, error = future.result()
+                for stage, seconds in timings.items():
+                    stats['timings'][stage] += seconds
+
+                if error:
+                    stats['files_failed'] += 1
+                    print(f"WARNING - Failed to ingest {path}: {error}")
+                    continue
+
+                started = time.perf_counter()
+                result = ingestion.save_pdf_statement(db, customer_id, parsed_data, commit=False)
+                # Make this file's rows visible to the duplicate check of the next file
+                db.flush()
+                stats['timings']['save'] += time.perf_counter() - started
+
+                stats['files_ingested'] += 1
+                stats['transactions_parsed'] += result['original_transaction_count']
+                stats['transactions_saved'] += result['transactions_saved']
+                stats['duplicates_removed'] += result['duplicates_removed']
+                uncommitted_files.append(path)
+                uncommitted_transactions += result['transactions_saved']
+
+                print(f"DEBUG - {os.path.basename(path)}: {result['transactions_saved']} saved, "
+                      f"{result['duplicates_removed']} duplicates")
+
+                if uncommitted_transactions >= batch_size:
+                    commit_batch()
+
+        if uncommitted_files:
+            commit_batch()
+
+        # One pass over the whole history instead of one per statement
+        started = time.perf_counter()
+        recurring = RecurringChargeDetector().update_customer(db, customer_id)
+        stats['timings']['recurring'] = time.perf_counter() - started
+        print(f"DEBUG - Recurring charges: {recurring['recurring_series']} series, "
+              f"{recurring['flagged']} transactions flagged, {recurring['cleared']} cleared")
+    except KeyboardInterrupt:
+        db.rollback()
+        print("\nInterrupted, uncommitted files will be ingested again on resume")
+    finally:
+        db.close()
+
+    print_summary(stats, time.perf_counter() - started_at)
+    return 0 if stats['files_failed'] == 0 else 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest historical statement PDFs for a customer")
+    parser.add_argument("directory", help="Directory tree containing statement PDFs")
+    parser.add_argument("--customer-id", type=int, required=True, help="Customer the statements belong to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Parallel parser processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="Saved transactions per database commit (default: 1000)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file (default: .ingest_checkpoint_<customer_id>.json in the directory)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the existing checkpoint")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"Not a directory: {args.directory}")
+        return 1
+
+    checkpoint_path = args.checkpoint or os.path.join(
+        args.directory, f".ingest_checkpoint_{args.customer_id}.json"
+    )
+
+    return ingest(
+        args.directory,
+        args.customer_id,
+        max(1, args.workers),
+        max(1, args.batch_size),
+        checkpoint_path,
+        restart=args.restart
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
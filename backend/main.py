@@ -1,31 +1,49 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
+import os
 import uvicorn
 from pydantic import BaseModel
 
 
 
-from database import SessionLocal, engine, Base
-from models import Customer, Transaction, CreditCard
+from database import SessionLocal, engine
+from models import Customer, Transaction, CreditCard, CategoryRule
+from migrations import run_migrations
 from services.pdf_parser import PDFParser
 from services.email_parser import EmailParser
 from services.sms_parser import SMSParser
 from services.transaction_extractor import TransactionExtractor
 from services.categorizer import TransactionCategorizer
 from services.anomaly_detector import AnomalyDetector
+from services.anomaly_model_store import AnomalyModelStore
+from services.baseline_store import OnlineBaselineStore
 from services.reminder_service import ReminderService
 from services.reward_analyzer import RewardAnalyzer
 from services.transaction_deduplicator import TransactionDeduplicator
+from services.password_store import PasswordStore
+from services.parse_cache import ParseCache
+from services.parse_executor import ParseExecutor
+from services.statement_ingestion import StatementIngestionService
+from services.ingestion_jobs import IngestionJobQueue
+from services.pdf_source import SpooledUpload, UploadSizeLimitMiddleware
+from services.registry import ServiceRegistry
+from services.merchant_memo import MerchantCategoryMemo
+from services.category_model import load_category_model
+from services.recurring_detector import RecurringChargeDetector
 from schemas import (
     CustomerCreate, CustomerResponse, TransactionResponse, CreditCardResponse, 
     CreditCardCreate, SMSParseRequest, SMSParseResponse, SMSBatchParseRequest, SMSBatchParseResponse,
-    EmailProcessRequest, ChatRequest
+    EmailProcessRequest, ChatRequest, CategoryRuleCreate, CategoryRuleResponse
 )
 
-Base.metadata.create_all(bind=engine)
+# Every worker migrates at import, taking turns on a lock; deployments that run
+# `python migrations.py` as a release step can turn this off
+if os.getenv("RUN_MIGRATIONS_ON_STARTUP", "1") != "0":
+    run_migrations(engine)
 
 app = FastAPI(
     title="Credit Card Management API",
@@ -33,6 +51,10 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Oversized uploads are refused while they stream in, before the multipart parser
+# spools them. Added first, so the CORS middleware still wraps the 413
+app.add_middleware(UploadSizeLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -41,6 +63,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Learned statement passwords and parsed statements are shared across requests
+password_store = PasswordStore()
+parse_cache = ParseCache()
+
+# CPU-bound document parsing runs here, never on the event loop thread
+parse_executor = ParseExecutor()
+
+# Oversized uploads and a full parse queue reach the client as-is rather than as a 500
+PASS_THROUGH_STATUS_CODES = (413, 503)
+
+# Background ingestion: jobs are stored in the database and run in a process pool
+ingestion_jobs = IngestionJobQueue()
+
+# Services are built once per process (warmed up at startup, or lazily on first
+# use) and handed to endpoints as dependencies
+services = ServiceRegistry()
+services.register('pdf_parser', lambda: PDFParser(
+    password_store=password_store, parse_cache=parse_cache, parse_executor=parse_executor
+))
+services.register('email_parser', EmailParser)
+services.register('sms_parser', SMSParser)
+services.register('transaction_extractor', TransactionExtractor)
+services.register('merchant_memo', MerchantCategoryMemo)
+services.register('categorizer', lambda: TransactionCategorizer(
+    memo=services.get('merchant_memo'), model=load_category_model()
+))
+services.register('anomaly_detector', AnomalyDetector)
+services.register('anomaly_models', AnomalyModelStore)
+services.register('baselines', OnlineBaselineStore)
+services.register('reminder_service', ReminderService)
+services.register('reward_analyzer', RewardAnalyzer)
+services.register('deduplicator', TransactionDeduplicator)
+services.register('recurring_detector', RecurringChargeDetector)
+services.register('statement_ingestion', lambda: StatementIngestionService(
+    deduplicator=services.get('deduplicator'),
+    transaction_extractor=services.get('transaction_extractor'),
+    recurring_detector=services.get('recurring_detector'),
+    anomaly_models=services.get('anomaly_models'),
+    baselines=services.get('baselines')
+))
+
 def get_db():
     db = SessionLocal()
     try:
@@ -48,7 +111,6 @@ def get_db():
     finally:
         db.close()
 
-import os
 import httpx
 from dotenv import load_dotenv
        
@@ -63,6 +125,44 @@ MODEL = "mistralai/mistral-7b-instruct:free"
 async def root():
     return {"message": "Credit Card Management API"}
 
+@app.get("/stats")
+async def get_stats():
+    merchant_memo = services.loaded('merchant_memo')
+    anomaly_models = services.loaded('anomaly_models')
+    return {
+        "parse_cache": parse_cache.stats(),
+        "parse_queue": parse_executor.stats(),
+        "ingestion_jobs": ingestion_jobs.stats(),
+        "merchant_memo": merchant_memo.stats() if merchant_memo else None,
+        "anomaly_models": anomaly_models.stats() if anomaly_models else None
+    }
+
+@app.get("/ready")
+async def readiness():
+    """Reports whether every service and model has finished loading"""
+    status = services.status()
+    categorizer = services.loaded('categorizer')
+    status['models'] = {
+        'spacy': categorizer is not None and categorizer.nlp is not None
+    }
+    return JSONResponse(status_code=200 if status['ready'] else 503, content=status)
+
+@app.on_event("startup")
+def warm_up_services():
+    services.warm_up_in_background()
+
+@app.on_event("startup")
+def start_ingestion_jobs():
+    ingestion_jobs.start()
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    ingestion_jobs.stop()
+    parse_executor.shutdown()
+    anomaly_models = services.loaded('anomaly_models')
+    if anomaly_models:
+        anomaly_models.shutdown()
+
 @app.post("/customers/", response_model=CustomerResponse)
 async def create_customer(customer: CustomerCreate, db: Session = Depends(get_db)):
     db_customer = Customer(**customer.model_dump())
@@ -75,7 +175,9 @@ async def create_customer(customer: CustomerCreate, db: Session = Depends(get_db
 async def upload_pdf(
     customer_id: int,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    pdf_parser: PDFParser = Depends(services.provider('pdf_parser')),
+    statement_ingestion: StatementIngestionService = Depends(services.provider('statement_ingestion'))
 ):
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
@@ -85,71 +187,16 @@ async def upload_pdf(
         raise HTTPException(status_code=404, detail="Customer not found")
     
     try:
-        pdf_parser = PDFParser()
         parsed_data = await pdf_parser.parse_pdf(file, customer)
-        
-        # Use advanced deduplication before saving to database
-        deduplicator = TransactionDeduplicator()
-        deduplication_result = deduplicator.deduplicate_transactions(parsed_data['transactions'])
-        
-        # Save deduplicated transactions to database
-        transactions_saved = 0
-        for transaction_data in deduplication_result['deduplicated_transactions']:
-            transaction_date = datetime.strptime(transaction_data['date'], '%d-%m-%Y') if transaction_data['date'] else datetime.now()
-            
-            # Check for existing transaction in database
-            existing_transaction = db.query(Transaction).filter(
-                Transaction.customer_id == customer_id,
-                Transaction.date == transaction_date,
-                Transaction.amount == transaction_data['amount'],
-                Transaction.merchant == transaction_data['merchant']
-            ).first()
-            
-            if existing_transaction:
-                continue
-            
-            transaction = Transaction(
-                customer_id=customer_id,
-                date=transaction_date,
-                description=f"{transaction_data['merchant']} - {transaction_data['currency']} {transaction_data['amount']}",
-                amount=transaction_data['amount'],
-                category='purchase',
-                subcategory='general',
-                merchant=transaction_data['merchant'],
-                is_recurring=False,
-                confidence_score=0.9,
-                raw_text=transaction_data['raw_text']
-            )
-            db.add(transaction)
-            transactions_saved += 1
-        
-        # Update customer's credit card info if summary data available
-        if parsed_data['summary']:
-            summary = parsed_data['summary']
-            # Find or create credit card record
-            credit_card = db.query(CreditCard).filter(CreditCard.customer_id == customer_id).first()
-            if credit_card:
-                if 'current_balance' in summary:
-                    credit_card.current_balance = summary['current_balance']
-                if 'minimum_payment' in summary:
-                    credit_card.minimum_payment = summary['minimum_payment']
-                if 'credit_limit' in summary:
-                    credit_card.credit_limit = summary['credit_limit']
-                if 'due_date' in summary:
-                    credit_card.due_date = summary['due_date']
-                if 'statement_date' in summary:
-                    credit_card.statement_date = summary['statement_date']
-        
-        db.commit()
-        
-        # Add transaction count and deduplication info to response
-        parsed_data['transactions_saved'] = transactions_saved
-        parsed_data['duplicates_removed'] = deduplication_result['duplicates_removed']
-        parsed_data['original_transaction_count'] = deduplication_result['original_count']
-        parsed_data['deduplicated_transaction_count'] = deduplication_result['deduplicated_count']
-        parsed_data['deduplication_report'] = deduplicator.generate_deduplication_report(deduplication_result)
+        # Deduplication, scoring and recurring detection stay off the event loop too
+        parsed_data = await parse_executor.run(statement_ingestion.save_pdf_statement, db, customer_id, parsed_data)
         
         return parsed_data
+    except HTTPException as e:
+        db.rollback()
+        if e.status_code in PASS_THROUGH_STATUS_CODES:
+            raise
+        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
@@ -158,7 +205,8 @@ async def upload_pdf(
 async def analyze_pdf(
     customer_id: int,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    pdf_parser: PDFParser = Depends(services.provider('pdf_parser'))
 ):
     """Analyze PDF and return detailed structured data without saving to database"""
     if not file.filename.endswith('.pdf'):
@@ -169,7 +217,6 @@ async def analyze_pdf(
         raise HTTPException(status_code=404, detail="Customer not found")
     
     try:
-        pdf_parser = PDFParser()
         parsed_data = await pdf_parser.parse_pdf(file, customer)
         
         # Add analysis metadata
@@ -181,6 +228,10 @@ async def analyze_pdf(
         }
         
         return parsed_data
+    except HTTPException as e:
+        if e.status_code in PASS_THROUGH_STATUS_CODES:
+            raise
+        raise HTTPException(status_code=500, detail=f"Error analyzing PDF: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error analyzing PDF: {str(e)}")
 
@@ -188,7 +239,10 @@ async def analyze_pdf(
 async def upload_email(
     customer_id: int,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    email_parser: EmailParser = Depends(services.provider('email_parser')),
+    categorizer: TransactionCategorizer = Depends(services.provider('categorizer')),
+    statement_ingestion: StatementIngestionService = Depends(services.provider('statement_ingestion'))
 ):
     if not file.filename.endswith('.eml'):
         raise HTTPException(status_code=400, detail="Only EML email files are allowed")
@@ -197,68 +251,128 @@ async def upload_email(
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
+    with await SpooledUpload.from_upload(file) as upload:
+        email_bytes = upload.read_bytes()
+    
     try:
-        email_parser = EmailParser()
-        content = await email_parser.parse_email(file)
+        content = await parse_executor.run(email_parser.parse_email_bytes, email_bytes)
         
-        transaction_extractor = TransactionExtractor()
-        transactions = transaction_extractor.extract_transactions(content)
+        categorized_transactions = await parse_executor.run(
+            statement_ingestion.extract_email_transactions, content, categorizer
+        )
         
-        if not transactions:
+        if not categorized_transactions:
             return {"message": "No transactions found in the email", "transactions_processed": 0}
         
-        categorizer = TransactionCategorizer()
-        categorized_transactions = categorizer.categorize_transactions(transactions)
-        
-        for transaction_data in categorized_transactions:
-            transaction = Transaction(
-                customer_id=customer_id,
-                date=transaction_data.get('date'),
-                description=transaction_data.get('description'),
-                amount=transaction_data.get('amount'),
-                category=transaction_data.get('category'),
-                subcategory=transaction_data.get('subcategory'),
-                merchant=transaction_data.get('merchant'),
-                is_recurring=transaction_data.get('is_recurring', False),
-                confidence_score=transaction_data.get('confidence_score'),
-                raw_text=transaction_data.get('raw_text')
-            )
-            db.add(transaction)
-        
-        db.commit()
+        saved = await parse_executor.run(
+            statement_ingestion.save_categorized_transactions, db, customer_id, categorized_transactions
+        )
         
-        return {"message": f"Processed {len(categorized_transactions)} transactions", "transactions_processed": len(categorized_transactions)}
+        return {
+            "message": f"Processed {saved} transactions",
+            "transactions_processed": saved,
+            "duplicates_skipped": len(categorized_transactions) - saved
+        }
+    except HTTPException as e:
+        db.rollback()
+        if e.status_code in PASS_THROUGH_STATUS_CODES:
+            raise
+        raise HTTPException(status_code=500, detail=f"Error processing email: {str(e)}")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error processing email: {str(e)}")
 
+async def submit_ingestion_job(customer_id: int, kind: str, file: UploadFile, db: Session):
+    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    if not customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    
+    with await SpooledUpload.from_upload(file) as upload:
+        job = ingestion_jobs.submit(db, customer_id, kind, upload)
+    
+    return JSONResponse(
+        status_code=202,
+        content=ingestion_jobs.to_dict(job),
+        headers={"Location": f"/jobs/{job.id}"}
+    )
+
+@app.post("/jobs/upload-pdf/{customer_id}", status_code=202)
+async def submit_pdf_job(
+    customer_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """Queue a PDF statement for ingestion and return the job to poll"""
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    
+    return await submit_ingestion_job(customer_id, 'pdf', file, db)
+
+@app.post("/jobs/upload-email/{customer_id}", status_code=202)
+async def submit_email_job(
+    customer_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """Queue an EML file for ingestion and return the job to poll"""
+    if not file.filename.endswith('.eml'):
+        raise HTTPException(status_code=400, detail="Only EML email files are allowed")
+    
+    return await submit_ingestion_job(customer_id, 'eml', file, db)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, db: Session = Depends(get_db)):
+    return ingestion_jobs.to_dict(ingestion_jobs.get(db, job_id))
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, db: Session = Depends(get_db)):
+    """Server-sent events with the job state on every change, ending once it finishes"""
+    ingestion_jobs.get(db, job_id)
+    return StreamingResponse(ingestion_jobs.events(job_id), media_type="text/event-stream")
+
 @app.get("/customers/{customer_id}/transactions", response_model=List[TransactionResponse])
 async def get_transactions(customer_id: int, db: Session = Depends(get_db)):
     transactions = db.query(Transaction).filter(Transaction.customer_id == customer_id).all()
     return transactions
 
 @app.get("/customers/{customer_id}/anomalies")
-async def detect_anomalies(customer_id: int, db: Session = Depends(get_db)):
+async def detect_anomalies(
+    customer_id: int,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    anomaly_detector: AnomalyDetector = Depends(services.provider('anomaly_detector')),
+    anomaly_models: AnomalyModelStore = Depends(services.provider('anomaly_models'))
+):
     customer = db.query(Customer).filter(Customer.id == customer_id).first()
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
-    transactions = db.query(Transaction).filter(Transaction.customer_id == customer_id).all()
+    transactions = anomaly_detector.load_transactions(db, customer_id)
     
-    if not transactions:
-        return {"anomalies": [], "message": "No transactions found for analysis"}
+    if transactions.empty:
+        return {"anomalies": [], "total_anomalies": 0, "message": "No transactions found for analysis"}
     
     try:
-        anomaly_detector = AnomalyDetector()
-        anomalies = anomaly_detector.detect_anomalies(transactions)
+        # ML flags come from the customer's persisted model, retrained in the
+        # background when it has fallen behind; until the first model is
+        # ready only the rule-based detectors report
+        model_status = anomaly_models.retrain_if_due(db, customer_id)
+        stored_scores = anomaly_models.stored_scores(db, customer_id)
+        # Highest score first; a long history flags thousands of rows, so they come a page at a time
+        page = anomaly_detector.detect_anomalies_page(transactions, stored_scores=stored_scores,
+                                                      limit=limit, offset=offset)
         
-        return {"anomalies": anomalies, "total_anomalies": len(anomalies)}
+        return {**page, "limit": limit, "offset": offset, "anomaly_model": model_status}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error detecting anomalies: {str(e)}")
 
 @app.get("/customers/{customer_id}/due-dates")
-async def get_due_dates(customer_id: int, db: Session = Depends(get_db)):
-    reminder_service = ReminderService()
+async def get_due_dates(
+    customer_id: int,
+    db: Session = Depends(get_db),
+    reminder_service: ReminderService = Depends(services.provider('reminder_service'))
+):
     due_dates = reminder_service.get_upcoming_due_dates(customer_id, db)
     
     return {"due_dates": due_dates}
@@ -284,8 +398,52 @@ async def get_credit_cards(customer_id: int, db: Session = Depends(get_db)):
     credit_cards = db.query(CreditCard).filter(CreditCard.customer_id == customer_id).all()
     return credit_cards
 
+@app.get("/customers/{customer_id}/recurring")
+async def get_recurring_charges(
+    customer_id: int,
+    update: bool = False,
+    db: Session = Depends(get_db),
+    recurring_detector: RecurringChargeDetector = Depends(services.provider('recurring_detector'))
+):
+    """Recurring charges found in the customer's whole history; update=true also rewrites is_recurring"""
+    customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    if not customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    
+    try:
+        history = recurring_detector.load_history(db, customer_id)
+        series, _ = recurring_detector.detect(history)
+        response = {
+            "customer_id": customer_id,
+            "transactions_analyzed": len(history),
+            "recurring": recurring_detector.summarize(series)
+        }
+        if update:
+            response["update"] = recurring_detector.update_customer(db, customer_id)
+        return response
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error detecting recurring charges: {str(e)}")
+
+@app.post("/category-rules", response_model=CategoryRuleResponse)
+async def create_category_rule(
+    rule: CategoryRuleCreate,
+    db: Session = Depends(get_db),
+    merchant_memo: MerchantCategoryMemo = Depends(services.provider('merchant_memo'))
+):
+    """Pin merchants matching a pattern to a category; takes precedence over memoized decisions"""
+    return merchant_memo.add_rule(db, rule.pattern, rule.category, rule.subcategory, rule.confidence)
+
+@app.get("/category-rules", response_model=List[CategoryRuleResponse])
+async def get_category_rules(db: Session = Depends(get_db)):
+    return db.query(CategoryRule).order_by(CategoryRule.id).all()
+
 @app.get("/customers/{customer_id}/rewards")
-async def get_rewards_analysis(customer_id: int, db: Session = Depends(get_db)):
+async def get_rewards_analysis(
+    customer_id: int,
+    db: Session = Depends(get_db),
+    reward_analyzer: RewardAnalyzer = Depends(services.provider('reward_analyzer'))
+):
     customer = db.query(Customer).filter(Customer.id == customer_id).first()
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
@@ -297,7 +455,6 @@ async def get_rewards_analysis(customer_id: int, db: Session = Depends(get_db)):
         return {"rewards_analysis": {}, "message": "No transactions found for analysis"}
     
     try:
-        reward_analyzer = RewardAnalyzer()
         analysis = reward_analyzer.analyze_rewards(transactions, credit_cards)
         
         return {"rewards_analysis": analysis}
@@ -305,19 +462,24 @@ async def get_rewards_analysis(customer_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error analyzing rewards: {str(e)}")
 
 @app.get("/customers/{customer_id}/spending-insights")
-async def get_spending_insights(customer_id: int, db: Session = Depends(get_db)):
+async def get_spending_insights(
+    customer_id: int,
+    db: Session = Depends(get_db),
+    reward_analyzer: RewardAnalyzer = Depends(services.provider('reward_analyzer'))
+):
     transactions = db.query(Transaction).filter(Transaction.customer_id == customer_id).all()
     credit_cards = db.query(CreditCard).filter(CreditCard.customer_id == customer_id).all()
     
-    reward_analyzer = RewardAnalyzer()
     insights = reward_analyzer.generate_spending_insights(transactions, credit_cards)
     
     return {"spending_insights": insights}
 
 @app.post("/parse-sms", response_model=SMSParseResponse)
-async def parse_sms(request: SMSParseRequest):
+async def parse_sms(
+    request: SMSParseRequest,
+    sms_parser: SMSParser = Depends(services.provider('sms_parser'))
+):
     try:
-        sms_parser = SMSParser()
         parsed_data = sms_parser.parse_sms(request.sms_text)
         
         return SMSParseResponse(**parsed_data)
@@ -325,9 +487,11 @@ async def parse_sms(request: SMSParseRequest):
         raise HTTPException(status_code=500, detail=f"Error parsing SMS: {str(e)}")
 
 @app.post("/parse-sms-batch", response_model=SMSBatchParseResponse)
-async def parse_sms_batch(request: SMSBatchParseRequest):
+async def parse_sms_batch(
+    request: SMSBatchParseRequest,
+    sms_parser: SMSParser = Depends(services.provider('sms_parser'))
+):
     try:
-        sms_parser = SMSParser()
         results = sms_parser.parse_multiple_sms(request.sms_list)
         
         response_results = [SMSParseResponse(**result) for result in results]
@@ -343,15 +507,18 @@ async def parse_sms_batch(request: SMSBatchParseRequest):
 async def process_sms_for_customer(
     customer_id: int,
     request: SMSParseRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    sms_parser: SMSParser = Depends(services.provider('sms_parser')),
+    statement_ingestion: StatementIngestionService = Depends(services.provider('statement_ingestion'))
 ):
     customer = db.query(Customer).filter(Customer.id == customer_id).first()
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
     try:
-        sms_parser = SMSParser()
         parsed_data = sms_parser.parse_sms(request.sms_text)
+        duplicate = False
+        anomaly_flags = []
         
         if parsed_data['sms_type'] == 'payment_due' and parsed_data['due_date'] and parsed_data['total_amount']:
             credit_card = None
@@ -361,29 +528,33 @@ async def process_sms_for_customer(
                     CreditCard.card_number_last_four == parsed_data['card_last_four']
                 ).first()
             
-            if parsed_data['total_amount']:
-                transaction = Transaction(
-                    customer_id=customer_id,
-                    credit_card_id=credit_card.id if credit_card else None,
-                    date=datetime.now(),
-                    description=f"Payment due notification from SMS",
-                    amount=parsed_data['total_amount'],
-                    category='payment_due',
-                    subcategory='bill_payment',
-                    merchant=parsed_data['bank_name'] or 'Unknown Bank',
-                    is_recurring=False,
-                    is_anomaly=False,
-                    confidence_score=parsed_data['confidence_score'],
-                    raw_text=parsed_data['raw_text']
-                )
-                db.add(transaction)
-                db.commit()
+            saved = await parse_executor.run(statement_ingestion.store_categorized_transactions, db, customer_id, [{
+                'credit_card_id': credit_card.id if credit_card else None,
+                'date': datetime.now(),
+                'description': "Payment due notification from SMS",
+                'amount': parsed_data['total_amount'],
+                'category': 'payment_due',
+                'subcategory': 'bill_payment',
+                'merchant': parsed_data['bank_name'] or 'Unknown Bank',
+                'confidence_score': parsed_data['confidence_score'],
+                'category_source': 'sms',
+                'raw_text': parsed_data['raw_text']
+            }], commit=True)
+            duplicate = not saved
+            anomaly_flags = saved[0]['anomaly_flags'] if saved else []
         
         return {
             "message": "SMS processed successfully",
             "parsed_data": parsed_data,
+            "duplicate": duplicate,
+            "anomaly_flags": anomaly_flags,
             "customer_id": customer_id
         }
+    except HTTPException as e:
+        db.rollback()
+        if e.status_code in PASS_THROUGH_STATUS_CODES:
+            raise
+        raise HTTPException(status_code=500, detail=f"Error processing SMS: {str(e)}")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error processing SMS: {str(e)}")
@@ -392,67 +563,63 @@ async def process_sms_for_customer(
 async def process_email_for_customer(
     customer_id: int,
     request: EmailProcessRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    email_parser: EmailParser = Depends(services.provider('email_parser')),
+    categorizer: TransactionCategorizer = Depends(services.provider('categorizer')),
+    statement_ingestion: StatementIngestionService = Depends(services.provider('statement_ingestion'))
 ):
     customer = db.query(Customer).filter(Customer.id == customer_id).first()
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
     try:
-        email_parser = EmailParser()
-        
         email_content = f"Subject: {request.subject}\nFrom: {request.sender}\nBody: {request.body}"
         
         parsed_email = {
             'subject': request.subject,
             'from': request.sender,
             'body': request.body,
-            'extracted_info': email_parser.extract_financial_info(request.body)
+            'extracted_info': await parse_executor.run(email_parser.extract_financial_info, request.body)
         }
         
         transactions = email_parser.extract_transactions_from_email(parsed_email)
         
         processed_transactions = []
+        duplicates_skipped = 0
         if transactions:
-            categorizer = TransactionCategorizer()
-            categorized_transactions = categorizer.categorize_transactions(transactions)
-            
-            for transaction_data in categorized_transactions:
-                transaction = Transaction(
-                    customer_id=customer_id,
-                    date=transaction_data.get('date') or datetime.now(),
-                    description=transaction_data.get('description'),
-                    amount=transaction_data.get('amount'),
-                    category=transaction_data.get('category'),
-                    subcategory=transaction_data.get('subcategory'),
-                    merchant=transaction_data.get('merchant'),
-                    is_recurring=transaction_data.get('is_recurring', False),
-                    confidence_score=transaction_data.get('confidence_score'),
-                    raw_text=transaction_data.get('raw_text')
-                )
-                db.add(transaction)
-                processed_transactions.append(transaction_data)
-            
-            db.commit()
+            categorized_transactions = await parse_executor.run(categorizer.categorize_transactions, transactions)
+            processed_transactions = await parse_executor.run(
+                statement_ingestion.store_categorized_transactions, db, customer_id, categorized_transactions,
+                commit=True
+            )
+            duplicates_skipped = len(categorized_transactions) - len(processed_transactions)
         
         return {
             "message": "Email processed successfully",
             "transactions_processed": len(processed_transactions),
+            "duplicates_skipped": duplicates_skipped,
             "parsed_email": parsed_email,
             "transactions": processed_transactions,
             "customer_id": customer_id
         }
+    except HTTPException as e:
+        db.rollback()
+        if e.status_code in PASS_THROUGH_STATUS_CODES:
+            raise
+        raise HTTPException(status_code=500, detail=f"Error processing email: {str(e)}")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error processing email: {str(e)}")
 
 @app.post("/deduplicate-transactions")
-async def deduplicate_transactions_endpoint(transactions: List[dict]):
+async def deduplicate_transactions_endpoint(
+    transactions: List[dict],
+    deduplicator: TransactionDeduplicator = Depends(services.provider('deduplicator'))
+):
     """
     Endpoint to test transaction deduplication on a provided list of transactions
     """
     try:
-        deduplicator = TransactionDeduplicator()
         result = deduplicator.deduplicate_transactions(transactions)
         
         # Add the detailed report
@@ -466,15 +633,17 @@ async def deduplicate_transactions_endpoint(transactions: List[dict]):
 async def upload_email_content(
     customer_id: int,
     request: dict,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    email_parser: EmailParser = Depends(services.provider('email_parser')),
+    transaction_extractor: TransactionExtractor = Depends(services.provider('transaction_extractor')),
+    categorizer: TransactionCategorizer = Depends(services.provider('categorizer')),
+    statement_ingestion: StatementIngestionService = Depends(services.provider('statement_ingestion'))
 ):
     customer = db.query(Customer).filter(Customer.id == customer_id).first()
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
     try:
-        email_parser = EmailParser()
-        
         import tempfile
         import os
         
@@ -484,43 +653,35 @@ async def upload_email_content(
         
         try:
             with open(temp_file_path, 'rb') as temp_file:
-                upload_file = UploadFile(filename='email.eml', file=temp_file)
-                parsed_email = await email_parser.parse_email(upload_file)
+                email_bytes = temp_file.read()
+            parsed_email = await parse_executor.run(email_parser.parse_email_bytes, email_bytes)
             
-            transaction_extractor = TransactionExtractor()
-            transactions = transaction_extractor.extract_transactions(parsed_email)
+            transactions = await parse_executor.run(transaction_extractor.extract_transactions, parsed_email['body'])
             
             processed_transactions = []
+            duplicates_skipped = 0
             if transactions:
-                categorizer = TransactionCategorizer()
-                categorized_transactions = categorizer.categorize_transactions(transactions)
-                
-                for transaction_data in categorized_transactions:
-                    transaction = Transaction(
-                        customer_id=customer_id,
-                        date=transaction_data.get('date') or datetime.now(),
-                        description=transaction_data.get('description'),
-                        amount=transaction_data.get('amount'),
-                        category=transaction_data.get('category'),
-                        subcategory=transaction_data.get('subcategory'),
-                        merchant=transaction_data.get('merchant'),
-                        is_recurring=transaction_data.get('is_recurring', False),
-                        confidence_score=transaction_data.get('confidence_score'),
-                        raw_text=transaction_data.get('raw_text')
-                    )
-                    db.add(transaction)
-                    processed_transactions.append(transaction_data)
-                
-                db.commit()
+                categorized_transactions = await parse_executor.run(categorizer.categorize_transactions, transactions)
+                processed_transactions = await parse_executor.run(
+                    statement_ingestion.store_categorized_transactions, db, customer_id, categorized_transactions,
+                    commit=True
+                )
+                duplicates_skipped = len(categorized_transactions) - len(processed_transactions)
             
             return {
                 "message": "Email content processed successfully",
                 "transactions_processed": len(processed_transactions),
+                "duplicates_skipped": duplicates_skipped,
                 "parsed_email": parsed_email,
                 "transactions": processed_transactions
             }
         finally:
             os.unlink(temp_file_path)
+    except HTTPException as e:
+        db.rollback()
+        if e.status_code in PASS_THROUGH_STATUS_CODES:
+            raise
+        raise HTTPException(status_code=500, detail=f"Error processing email content: {str(e)}")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error processing email content: {str(e)}")
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+In-place schema upgrades for databases created before a column existed.
+Base.metadata.create_all only creates missing tables, so columns added to
+existing tables are added here. Every step is idempotent and runs at
+startup; it can also be run by hand, e.g. as a release step with
+RUN_MIGRATIONS_ON_STARTUP=0 set for the API:
+
+    python migrations.py
+
+Processes starting together on the same SQLite file take turns through a
+lock file next to it, so only the first one migrates.
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import inspect, select, text, update, bindparam
+from sqlalchemy.exc import OperationalError
+
+from database import engine as default_engine, Base
+from models import Transaction
+from services.incremental_deduplicator import transaction_fingerprint
+from services.merchant_memo import normalize_merchant
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# Rows read, fingerprinted and updated at a time
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def _has_unique_index(inspector, table, columns):
+    columns = list(columns)
+    if any(constraint['column_names'] == columns for constraint in inspector.get_unique_constraints(table)):
+        return True
+    return any(index['unique'] and index['column_names'] == columns for index in inspector.get_indexes(table))
+
+
+@contextmanager
+def migration_lock(engine):
+    """Exclusive lock on a file next to the SQLite database, held while one process migrates"""
+    database = engine.url.database if engine.dialect.name == 'sqlite' else None
+    if not FCNTL_AVAILABLE or not database or database == ':memory:':
+        yield
+        return
+
+    with open(f"{database}.migrations.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _add_column(connection, table, name, definition):
+    print(f"DEBUG - Adding {table}.{name}")
+    try:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}"))
+    except OperationalError as e:
+        # Another process without the lock added it first
+        if 'duplicate column name' not in str(e).lower():
+            raise
+
+
+def _create_tables(engine):
+    # Without the lock another process may create a table between the existence check and
+    # the CREATE; every failed pass means one more table exists, so this ends
+    for _ in range(len(Base.metadata.tables)):
+        try:
+            Base.metadata.create_all(bind=engine)
+            return
+        except OperationalError as e:
+            if 'already exists' not in str(e).lower():
+                raise
+    Base.metadata.create_all(bind=engine)
+
+
+def backfill_transaction_fingerprints(connection) -> int:
+    """
+    Fingerprint the rows that have none, a chunk of ids at a time. When
+    stored rows are already exact duplicates of each other, the oldest keeps
+    the plain fingerprint and the later copies get it suffixed with their id,
+    so the unique index can be built without deleting anything.
+    """
+    table = Transaction.__table__
+    statement = update(table).where(table.c.id == bindparam('row_id')).values(fingerprint=bindparam('value'))
+    backfilled = 0
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(table.c.id, table.c.customer_id, table.c.date, table.c.amount, table.c.merchant)
+            .where(table.c.fingerprint.is_(None), table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(BACKFILL_CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        if not backfilled:
+            # Earlier chunks' fingerprints are looked up by value below; dropped once the unique index exists
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_transactions_fingerprint_backfill ON transactions (fingerprint)"
+            ))
+        last_id = rows[-1].id
+
+        fingerprints = [
+            transaction_fingerprint(row.customer_id, row.date, row.amount, None, row.merchant) for row in rows
+        ]
+        seen = set(connection.execute(
+            select(table.c.customer_id, table.c.fingerprint).where(table.c.fingerprint.in_(set(fingerprints)))
+        ).all())
+
+        updates = []
+        for row, fingerprint in zip(rows, fingerprints):
+            if (row.customer_id, fingerprint) in seen:
+                fingerprint = f"{fingerprint}:{row.id}"
+            seen.add((row.customer_id, fingerprint))
+            updates.append({'row_id': row.id, 'value': fingerprint})
+        connection.execute(statement, updates)
+        backfilled += len(updates)
+    return backfilled
+
+
+def migrate_transaction_fingerprints(engine=default_engine):
+    inspector = inspect(engine)
+    if 'transactions' not in inspector.get_table_names():
+        return
+
+    with engine.begin() as connection:
+        columns = {column['name'] for column in inspector.get_columns('transactions')}
+        if 'fingerprint' not in columns:
+            _add_column(connection, 'transactions', 'fingerprint', 'VARCHAR')
+
+        backfilled = backfill_transaction_fingerprints(connection)
+        if backfilled:
+            print(f"DEBUG - Fingerprinted {backfilled} stored transactions")
+
+        if not _has_unique_index(inspect(connection), 'transactions', ['customer_id', 'fingerprint']):
+            connection.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ix_transactions_customer_fingerprint "
+                "ON transactions (customer_id, fingerprint)"
+            ))
+        connection.execute(text("DROP INDEX IF EXISTS ix_transactions_fingerprint_backfill"))
+
+
+def migrate_transaction_anomaly_columns(engine=default_engine):
+    inspector = inspect(engine)
+    if 'transactions' not in inspector.get_table_names():
+        return
+
+    with engine.begin() as connection:
+        columns = {column['name'] for column in inspector.get_columns('transactions')}
+        for name, definition in (('is_anomaly', 'BOOLEAN DEFAULT 0'), ('anomaly_score', 'FLOAT'), ('anomaly_flags', 'TEXT')):
+            if name not in columns:
+                _add_column(connection, 'transactions', name, definition)
+
+        # Anomaly lookups read a customer's flagged rows straight from this index
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_transactions_customer_anomaly "
+            "ON transactions (customer_id, is_anomaly)"
+        ))
+
+
+def migrate_ingestion_job_columns(engine=default_engine):
+    inspector = inspect(engine)
+    if 'ingestion_jobs' not in inspector.get_table_names():
+        return
+
+    with engine.begin() as connection:
+        columns = {column['name'] for column in inspector.get_columns('ingestion_jobs')}
+        if 'next_attempt_at' not in columns:
+            _add_column(connection, 'ingestion_jobs', 'next_attempt_at', 'DATETIME')
+
+
+def migrate_transaction_category_source(engine=default_engine):
+    inspector = inspect(engine)
+    if 'transactions' not in inspector.get_table_names():
+        return
+
+    with engine.begin() as connection:
+        columns = {column['name'] for column in inspector.get_columns('transactions')}
+        if 'category_source' not in columns:
+            _add_column(connection, 'transactions', 'category_source', 'VARCHAR')
+
+
+def migrate_anomaly_model_status(engine=default_engine):
+    inspector = inspect(engine)
+    if 'anomaly_models' not in inspector.get_table_names():
+        return
+
+    with engine.begin() as connection:
+        columns = {column['name'] for column in inspector.get_columns('anomaly_models')}
+        if 'status' not in columns:
+            # Versions recorded before claims existed were only written once complete
+            _add_column(connection, 'anomaly_models', 'status', "VARCHAR DEFAULT 'active'")
+
+
+def migrate_transaction_merchant_keys(engine=default_engine):
+    inspector = inspect(engine)
+    if 'transactions' not in inspector.get_table_names():
+        return
+
+    with engine.begin() as connection:
+        columns = {column['name'] for column in inspector.get_columns('transactions')}
+        if 'merchant_key' not in columns:
+            _add_column(connection, 'transactions', 'merchant_key', 'VARCHAR')
+
+        # Recurring detection reads a customer's series of one merchant straight from this index
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_transactions_customer_merchant_key "
+            "ON transactions (customer_id, merchant_key)"
+        ))
+
+        table = Transaction.__table__
+        statement = update(table).where(table.c.id == bindparam('row_id')).values(merchant_key=bindparam('value'))
+        backfilled = 0
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                select(table.c.id, table.c.merchant)
+                .where(table.c.merchant_key.is_(None), table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(BACKFILL_CHUNK_SIZE)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            connection.execute(statement, [{'row_id': row.id, 'value': normalize_merchant(row.merchant)} for row in rows])
+            backfilled += len(rows)
+        if backfilled:
+            print(f"DEBUG - Normalized the merchant of {backfilled} stored transactions")
+
+
+def migrate_merchant_category_text(engine=default_engine):
+    inspector = inspect(engine)
+    if 'merchant_categories' not in inspector.get_table_names():
+        return
+
+    with engine.begin() as connection:
+        columns = {column['name'] for column in inspector.get_columns('merchant_categories')}
+        if 'text' not in columns:
+            _add_column(connection, 'merchant_categories', 'text', 'TEXT')
+
+
+def run_migrations(engine=default_engine):
+    """Create the missing tables and upgrade the existing ones, one process at a time"""
+    with migration_lock(engine):
+        _create_tables(engine)
+        migrate_transaction_fingerprints(engine)
+        migrate_transaction_anomaly_columns(engine)
+        migrate_transaction_category_source(engine)
+        migrate_transaction_merchant_keys(engine)
+        migrate_ingestion_job_columns(engine)
+        migrate_anomaly_model_status(engine)
+        migrate_merchant_category_text(engine)
+
+
+if __name__ == "__main__":
+    run_migrations()
+    print("Migrations complete")
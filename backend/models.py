@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -38,6 +38,11 @@ class CreditCard(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        UniqueConstraint("customer_id", "fingerprint"),
+        Index("ix_transactions_customer_anomaly", "customer_id", "is_anomaly"),
+        Index("ix_transactions_customer_merchant_key", "customer_id", "merchant_key"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"))
@@ -48,10 +53,15 @@ class Transaction(Base):
     category = Column(String)
     subcategory = Column(String)
     merchant = Column(String)
+    merchant_key = Column(String, nullable=True)  # normalized merchant; NULL on rows stored before it was recorded
     is_recurring = Column(Boolean, default=False)
     is_anomaly = Column(Boolean, default=False)
+    anomaly_score = Column(Float, nullable=True)  # IsolationForest score of the customer's anomaly model
+    anomaly_flags = Column(Text, nullable=True)  # JSON: rule-based flags raised against the baseline on arrival
     confidence_score = Column(Float)
+    category_source = Column(String, nullable=True)  # 'categorizer', 'statement' or 'sms'; NULL on rows stored before it was recorded
     raw_text = Column(Text)
+    fingerprint = Column(String, nullable=True)  # customer, day, amount, currency, normalized merchant
     created_at = Column(DateTime, default=datetime.utcnow)
     
     customer = relationship("Customer", back_populates="transactions")
@@ -76,4 +86,118 @@ class CategoryRule(Base):
     category = Column(String)
     subcategory = Column(String)
     confidence = Column(Float)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class LearnedPassword(Base):
+    __tablename__ = "learned_passwords"
+    __table_args__ = (UniqueConstraint("customer_id", "issuer_fingerprint"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), index=True)
+    issuer_fingerprint = Column(String)
+    template = Column(String)
+    encrypted_password = Column(Text, nullable=True)
+    success_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class PasswordTemplateStat(Base):
+    __tablename__ = "password_template_stats"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    template = Column(String, unique=True, index=True)
+    success_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+    __table_args__ = (UniqueConstraint("customer_id", "kind", "content_sha256"),)
+    
+    id = Column(String, primary_key=True, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), index=True)
+    kind = Column(String)  # pdf, eml
+    filename = Column(String)
+    content_sha256 = Column(String)
+    file_path = Column(String)
+    status = Column(String, default="queued", index=True)  # queued, running, succeeded, failed
+    stage = Column(String, default="queued")
+    progress = Column(Float, default=0.0)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)  # earliest retry after a transient failure
+    result = Column(Text, nullable=True)  # JSON
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class MerchantCategory(Base):
+    __tablename__ = "merchant_categories"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    merchant_key = Column(String, unique=True, index=True)  # normalized merchant name
+    category = Column(String)
+    subcategory = Column(String)
+    confidence = Column(Float)
+    text = Column(Text, nullable=True)  # the text the categorizer decided on, matched by new custom rules
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class AnomalyModelVersion(Base):
+    __tablename__ = "anomaly_models"
+    __table_args__ = (UniqueConstraint("customer_id", "version"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), index=True)
+    version = Column(Integer)
+    path = Column(String)
+    training_rows = Column(Integer)
+    last_transaction_id = Column(Integer)  # newest transaction seen in training
+    anomaly_rate = Column(Float)  # share of the training rows flagged
+    status = Column(String, default='active')  # 'training' while a trainer holds the version number
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class CustomerBaseline(Base):
+    __tablename__ = "customer_baselines"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), unique=True, index=True)
+    transaction_count = Column(Integer, default=0)
+    amount_mean = Column(Float, default=0.0)
+    amount_m2 = Column(Float, default=0.0)  # Welford sum of squared deviations
+    amount_quantiles = Column(Text, nullable=True)  # JSON: P-square markers per quantile
+    last_transaction_id = Column(Integer, default=0)  # newest transaction folded in
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class CategoryBaseline(Base):
+    __tablename__ = "category_baselines"
+    __table_args__ = (UniqueConstraint("customer_id", "category"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), index=True)
+    category = Column(String)
+    transaction_count = Column(Integer, default=0)
+    amount_mean = Column(Float, default=0.0)
+    amount_m2 = Column(Float, default=0.0)
+
+class MerchantSighting(Base):
+    __tablename__ = "merchant_sightings"
+    __table_args__ = (UniqueConstraint("customer_id", "merchant_key"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), index=True)
+    merchant_key = Column(String)  # normalized merchant name
+    transaction_count = Column(Integer, default=0)
+    first_seen = Column(DateTime, default=datetime.utcnow)
+
+class Anomaly(Base):
+    __tablename__ = "anomalies"
+    __table_args__ = (UniqueConstraint("transaction_id", "anomaly_type"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), index=True)
+    transaction_id = Column(Integer, ForeignKey("transactions.id"), index=True)
+    anomaly_type = Column(String, index=True)
+    score = Column(Float)
+    description = Column(Text)
+    sweep_id = Column(String, index=True)  # fleet sweep that found it
+    detected_at = Column(DateTime, default=datetime.utcnow)
@@ -54,6 +54,23 @@ class CreditCardResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CategoryRuleCreate(BaseModel):
+    pattern: str
+    category: str
+    subcategory: str
+    confidence: float = 0.9
+
+class CategoryRuleResponse(BaseModel):
+    id: int
+    pattern: str
+    category: str
+    subcategory: str
+    confidence: float
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
 class AnomalyResponse(BaseModel):
     transaction_id: int
     anomaly_type: str
@@ -0,0 +1,111 @@
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction import FeatureHasher
+
+# Numeric columns of the ML anomaly stage, in order, as prepared by AnomalyDetector
+NUMERIC_FEATURES = ['amount', 'hour', 'day_of_week', 'day_of_month', 'month']
+
+
+class TransactionFeatureEncoder:
+    """
+    Sparse, fixed-width features for the ML anomaly stage. The most frequent
+    merchants and categories seen at fit time get a column each; every other
+    value, including ones first seen after fitting, is hashed into a fixed
+    number of shared buckets. The width depends only on the settings, never
+    on how many distinct merchants a customer has, and each row stores just
+    its numeric values and two non-zeros.
+    """
+
+    def __init__(self, top_merchants: Optional[int] = None, merchant_buckets: Optional[int] = None,
+                 top_categories: Optional[int] = None, category_buckets: Optional[int] = None):
+        if top_merchants is None:
+            top_merchants = int(os.getenv("ANOMALY_TOP_MERCHANTS", 256))
+        if merchant_buckets is None:
+            merchant_buckets = int(os.getenv("ANOMALY_MERCHANT_BUCKETS", 256))
+        if top_categories is None:
+            top_categories = int(os.getenv("ANOMALY_TOP_CATEGORIES", 32))
+        if category_buckets is None:
+            category_buckets = int(os.getenv("ANOMALY_CATEGORY_BUCKETS", 8))
+
+        self.top_merchants = max(0, top_merchants)
+        self.merchant_buckets = max(1, merchant_buckets)
+        self.top_categories = max(0, top_categories)
+        self.category_buckets = max(1, category_buckets)
+        self.merchants = []
+        self.categories = []
+
+    @property
+    def n_features(self) -> int:
+        return (len(NUMERIC_FEATURES) + self.top_merchants + self.merchant_buckets
+                + self.top_categories + self.category_buckets)
+
+    def fit(self, merchants, categories) -> 'TransactionFeatureEncoder':
+        self.merchants = self._most_frequent(merchants, self.top_merchants)
+        self.categories = self._most_frequent(categories, self.top_categories)
+        return self
+
+    def transform(self, numeric: np.ndarray, merchants, categories) -> sparse.csr_matrix:
+        """CSR matrix of the numeric columns followed by the merchant and category columns"""
+        numeric = np.asarray(numeric, dtype=float)
+        n_rows = len(numeric)
+        blocks = [sparse.csr_matrix(numeric)]
+        for values, vocabulary, top, buckets in (
+            (merchants, self.merchants, self.top_merchants, self.merchant_buckets),
+            (categories, self.categories, self.top_categories, self.category_buckets)
+        ):
+            columns = self._columns(values, vocabulary, top, buckets)
+            known = columns >= 0
+            blocks.append(sparse.csr_matrix(
+                (np.ones(known.sum()), (np.flatnonzero(known), columns[known])),
+                shape=(n_rows, top + buckets)
+            ))
+        return sparse.hstack(blocks, format='csr')
+
+    def fit_transform(self, numeric: np.ndarray, merchants, categories) -> sparse.csr_matrix:
+        return self.fit(merchants, categories).transform(numeric, merchants, categories)
+
+    def _most_frequent(self, values, limit: int) -> List[str]:
+        counts = pd.Series(values, dtype=object).value_counts(sort=False)
+        if limit == 0 or counts.empty:
+            return []
+        # Ties broken by value, so the vocabulary does not depend on row order
+        counts = counts.rename_axis('value').reset_index(name='count')
+        counts = counts.sort_values(['count', 'value'], ascending=[False, True], kind='stable')
+        return counts['value'].head(limit).tolist()
+
+    def _columns(self, values, vocabulary: List[str], top: int, buckets: int) -> np.ndarray:
+        """Column of each value within its block; -1 for missing values"""
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        if len(uniques) == 0:
+            return codes
+
+        # Each distinct value is looked up and hashed once
+        unique_columns = pd.Index(vocabulary, dtype=object).get_indexer(uniques)
+        unseen = np.flatnonzero(unique_columns < 0)
+        if len(unseen):
+            hasher = FeatureHasher(n_features=buckets, input_type='string', alternate_sign=False)
+            hashed = hasher.transform([[str(value)] for value in uniques[unseen]])
+            unique_columns[unseen] = top + hashed.indices
+        return np.where(codes >= 0, unique_columns[np.maximum(codes, 0)], -1)
+
+    def to_dict(self) -> Dict:
+        return {
+            'top_merchants': self.top_merchants,
+            'merchant_buckets': self.merchant_buckets,
+            'top_categories': self.top_categories,
+            'category_buckets': self.category_buckets,
+            'merchants': self.merchants,
+            'categories': self.categories
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> 'TransactionFeatureEncoder':
+        encoder = cls(state['top_merchants'], state['merchant_buckets'],
+                      state['top_categories'], state['category_buckets'])
+        encoder.merchants = state['merchants']
+        encoder.categories = state['categories']
+        return encoder
@@ -0,0 +1,101 @@
+import os
+from datetime import datetime
+from typing import Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from scipy import sparse
+from sklearn.preprocessing import StandardScaler
+
+from services.anomaly_features import TransactionFeatureEncoder
+
+# 2: sparse frequency-capped and hashed merchant/category features
+MODEL_FORMAT_VERSION = 2
+
+# Columns a frame needs to be scored
+MODEL_COLUMNS = ['date', 'amount', 'merchant', 'category']
+
+
+class AnomalyModel:
+    """
+    A customer's fitted ML anomaly stage: the features AnomalyDetector uses
+    (amount, hour, weekday, day of month, month and the sparse merchant and
+    category columns of TransactionFeatureEncoder), a StandardScaler and an
+    IsolationForest. The encoder's vocabularies are fixed at fit time and
+    bounded, so new transactions are scored on the same columns; merchants
+    outside them, including ones unseen in training, share hashed buckets.
+    """
+
+    def __init__(self, contamination: float = 0.1, random_state: int = 42):
+        self.contamination = contamination
+        self.random_state = random_state
+        self.encoder = TransactionFeatureEncoder()
+        self.scaler = None
+        self.forest = None
+        self.metadata = {}
+
+    def features(self, frame: pd.DataFrame) -> sparse.csr_matrix:
+        # Missing or unparseable dates count as now, as in AnomalyDetector
+        dates = pd.to_datetime(frame['date'], errors='coerce', format='mixed').fillna(pd.Timestamp(datetime.now()))
+        amounts = pd.to_numeric(frame['amount'], errors='coerce').fillna(0.0)
+        numeric = np.column_stack([
+            amounts.to_numpy(dtype=float), dates.dt.hour, dates.dt.dayofweek, dates.dt.day, dates.dt.month
+        ]).astype(float)
+        return self.encoder.transform(numeric, frame['merchant'], frame['category'])
+
+    def fit(self, frame: pd.DataFrame) -> 'AnomalyModel':
+        self.encoder.fit(frame['merchant'], frame['category'])
+
+        features = self.features(frame)
+        self.scaler = StandardScaler(with_mean=False)
+        self.forest = IsolationForest(contamination=self.contamination, random_state=self.random_state)
+        self.forest.fit(self.scaler.fit_transform(features))
+
+        _, flagged = self.score(frame)
+        self.metadata = {
+            'trained_at': datetime.utcnow().isoformat(),
+            'training_rows': len(frame),
+            'anomaly_rate': float(flagged.mean()) if len(flagged) else 0.0
+        }
+        return self
+
+    def score(self, frame: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """IsolationForest scores (lower is more anomalous) and the flagged rows"""
+        if self.forest is None:
+            raise ValueError("Anomaly model has not been trained")
+        if len(frame) == 0:
+            return np.array([]), np.array([], dtype=bool)
+
+        scores = self.forest.score_samples(self.scaler.transform(self.features(frame)))
+        # The forest's own cut-off: predict() flags the same rows
+        return scores, scores < self.forest.offset_
+
+    def save(self, path: str):
+        artifact = {
+            'format_version': MODEL_FORMAT_VERSION,
+            'contamination': self.contamination,
+            'random_state': self.random_state,
+            'encoder': self.encoder.to_dict(),
+            'scaler': self.scaler,
+            'forest': self.forest,
+            'metadata': self.metadata
+        }
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = f"{path}.tmp"
+        joblib.dump(artifact, temp_path, compress=3)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'AnomalyModel':
+        artifact = joblib.load(path)
+        if artifact.get('format_version') != MODEL_FORMAT_VERSION:
+            raise ValueError(f"Unsupported anomaly model format: {artifact.get('format_version')}")
+
+        model = cls(contamination=artifact['contamination'], random_state=artifact['random_state'])
+        model.encoder = TransactionFeatureEncoder.from_dict(artifact['encoder'])
+        model.scaler = artifact['scaler']
+        model.forest = artifact['forest']
+        model.metadata = artifact.get('metadata', {})
+        return model
@@ -0,0 +1,414 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy import select, update, bindparam, func, case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine
+from models import Transaction, AnomalyModelVersion
+from services.anomaly_model import AnomalyModel, MODEL_COLUMNS
+
+# Transactions scored and written back per commit when a new model is rolled out
+RESCORE_CHUNK_SIZE = 5000
+
+# New scored transactions needed before their flagged share is compared with training
+DRIFT_MIN_ROWS = 20
+
+# Per-worker store, created by _init_worker
+_worker_store = None
+
+
+def _init_worker(settings: Dict):
+    global _worker_store
+    # Connections inherited from the parent must not be reused in the child
+    engine.dispose(close=False)
+    _worker_store = AnomalyModelStore(training_workers=0, **settings)
+
+
+def _train_customer(customer_id: int) -> Optional[int]:
+    db = SessionLocal()
+    try:
+        record = _worker_store.train(db, customer_id)
+        return record.version if record else None
+    finally:
+        db.close()
+
+
+class AnomalyModelStore:
+    """
+    Versioned per-customer anomaly models. Each training run saves a new
+    AnomalyModel artifact under model_dir, rescores the customer's stored
+    transactions into is_anomaly/anomaly_score and records the version in
+    the anomaly_models table; the newest version is the active one. A
+    trainer claims its version row before writing anything, so concurrent
+    trainers never share a version and the customer is not rescheduled
+    while the claimed version is being rolled out. New
+    transactions are scored against the active model as they are ingested.
+    A model is retrained in a background process only when enough new rows
+    have arrived since training, or when the share of new rows it flags has
+    drifted well above its training rate.
+    """
+
+    def __init__(self, model_dir: Optional[str] = None, training_workers: Optional[int] = None,
+                 min_rows: Optional[int] = None, max_training_rows: Optional[int] = None,
+                 retrain_fraction: Optional[float] = None, drift_ratio: Optional[float] = None,
+                 versions_kept: Optional[int] = None, training_timeout: Optional[float] = None,
+                 cache_size: int = 32):
+        if model_dir is None:
+            model_dir = os.getenv("ANOMALY_MODEL_DIR", "./anomaly_models")
+        if training_workers is None:
+            training_workers = int(os.getenv("ANOMALY_TRAINING_WORKERS", 1))
+        if min_rows is None:
+            # The ML stage has always needed more than 20 transactions
+            min_rows = int(os.getenv("ANOMALY_MODEL_MIN_ROWS", 21))
+        if max_training_rows is None:
+            max_training_rows = int(os.getenv("ANOMALY_MODEL_MAX_ROWS", 20000))
+        if retrain_fraction is None:
+            retrain_fraction = float(os.getenv("ANOMALY_RETRAIN_FRACTION", 0.2))
+        if drift_ratio is None:
+            drift_ratio = float(os.getenv("ANOMALY_DRIFT_RATIO", 2.0))
+        if versions_kept is None:
+            versions_kept = int(os.getenv("ANOMALY_MODEL_VERSIONS_KEPT", 3))
+        if training_timeout is None:
+            # A claim older than this was left behind by a trainer that died
+            training_timeout = float(os.getenv("ANOMALY_TRAINING_TIMEOUT", 3600))
+
+        self.model_dir = model_dir
+        # 0 disables background training in this process (e.g. ingestion workers)
+        self.training_workers = max(0, training_workers)
+        self.min_rows = max(1, min_rows)
+        self.max_training_rows = max(self.min_rows, max_training_rows)
+        self.retrain_fraction = retrain_fraction
+        self.drift_ratio = drift_ratio
+        self.versions_kept = max(1, versions_kept)
+        self.training_timeout = training_timeout
+        self.cache_size = cache_size
+
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = set()
+
+        self.trained = 0
+        self.scheduled = 0
+        self.failed = 0
+
+    def settings(self) -> Dict:
+        return {
+            'model_dir': self.model_dir,
+            'min_rows': self.min_rows,
+            'max_training_rows': self.max_training_rows,
+            'retrain_fraction': self.retrain_fraction,
+            'drift_ratio': self.drift_ratio,
+            'versions_kept': self.versions_kept,
+            'training_timeout': self.training_timeout
+        }
+
+    def active_version(self, db: Session, customer_id: int) -> Optional[AnomalyModelVersion]:
+        return (
+            db.query(AnomalyModelVersion)
+            .filter(AnomalyModelVersion.customer_id == customer_id, AnomalyModelVersion.status == 'active')
+            .order_by(AnomalyModelVersion.version.desc())
+            .first()
+        )
+
+    def training_claim(self, db: Session, customer_id: int) -> Optional[AnomalyModelVersion]:
+        """The version a trainer has claimed for the customer and not finished, if it is still live"""
+        return (
+            db.query(AnomalyModelVersion)
+            .filter(AnomalyModelVersion.customer_id == customer_id, AnomalyModelVersion.status == 'training',
+                    AnomalyModelVersion.created_at > datetime.utcnow() - timedelta(seconds=self.training_timeout))
+            .order_by(AnomalyModelVersion.version.desc())
+            .first()
+        )
+
+    def model(self, record: AnomalyModelVersion) -> Optional[AnomalyModel]:
+        """The artifact of a model version, loaded once per process"""
+        key = (record.customer_id, record.version)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+
+        try:
+            model = AnomalyModel.load(record.path)
+        except Exception as e:
+            print(f"WARNING - Could not load anomaly model {record.path}: {e}")
+            return None
+
+        with self._lock:
+            self._models[key] = model
+            while len(self._models) > self.cache_size:
+                self._models.popitem(last=False)
+        return model
+
+    def score_rows(self, db: Session, customer_id: int, rows: List[Dict]) -> Optional[int]:
+        """
+        Set is_anomaly and anomaly_score on transaction rows about to be
+        inserted, using the customer's active model. Returns the model version,
+        or None when the customer has no model yet.
+        """
+        if not rows:
+            return None
+        record = self.active_version(db, customer_id)
+        model = self.model(record) if record is not None else None
+        if model is None:
+            return None
+
+        frame = pd.DataFrame({column: [row.get(column) for row in rows] for column in MODEL_COLUMNS})
+        scores, flagged = model.score(frame)
+        for row, score, is_anomaly in zip(rows, scores.tolist(), flagged.tolist()):
+            row['anomaly_score'] = score
+            row['is_anomaly'] = is_anomaly
+        return record.version
+
+    def stored_scores(self, db: Session, customer_id: int) -> pd.Series:
+        """Model scores of the customer's flagged transactions, by transaction id"""
+        rows = db.execute(
+            select(Transaction.id, Transaction.anomaly_score)
+            .where(Transaction.customer_id == customer_id, Transaction.is_anomaly == True)
+            .order_by(Transaction.id)
+        ).all()
+        return pd.Series([score for _, score in rows], index=[row_id for row_id, _ in rows], dtype=float)
+
+    def training_status(self, db: Session, customer_id: int) -> Dict:
+        """Whether the customer's model should be (re)trained, and why"""
+        record = self.active_version(db, customer_id)
+        last_id = record.last_transaction_id if record is not None else 0
+
+        new_rows, scored, flagged = db.execute(
+            select(
+                func.count(Transaction.id),
+                func.count(Transaction.anomaly_score),
+                func.coalesce(func.sum(case((Transaction.is_anomaly == True, 1), else_=0)), 0)
+            ).where(Transaction.customer_id == customer_id, Transaction.id > (last_id or 0))
+        ).one()
+
+        status = {
+            'version': record.version if record is not None else None,
+            'new_rows': new_rows,
+            'retrain_reason': None,
+            'training': self.training_claim(db, customer_id) is not None
+        }
+        if status['training']:
+            # The claimed version is being rolled out; the active one is about to be replaced
+            return status
+        if record is None:
+            if new_rows >= self.min_rows:
+                status['retrain_reason'] = 'no_model'
+        elif self.model(record) is None:
+            # Missing artifact, or one saved in an older format
+            status['retrain_reason'] = 'unreadable'
+        elif new_rows >= max(self.min_rows, self.retrain_fraction * (record.training_rows or 0)):
+            status['retrain_reason'] = 'row_count'
+        elif scored >= DRIFT_MIN_ROWS and flagged / scored > self.drift_ratio * max(record.anomaly_rate or 0.0, 0.01):
+            status['retrain_reason'] = 'drift'
+        return status
+
+    def retrain_if_due(self, db: Session, customer_id: int) -> Dict:
+        status = self.training_status(db, customer_id)
+        if status['retrain_reason'] is not None:
+            self.schedule(customer_id)
+        with self._lock:
+            status['training'] = status['training'] or customer_id in self._pending
+        return status
+
+    def schedule(self, customer_id: int) -> bool:
+        """Train the customer's model in the background unless it is already being trained"""
+        if self.training_workers == 0:
+            return False
+
+        with self._lock:
+            if customer_id in self._pending:
+                return True
+            try:
+                future = self._training_executor().submit(_train_customer, customer_id)
+            except (BrokenProcessPool, RuntimeError) as e:
+                print(f"WARNING - Anomaly training pool unavailable, restarting it: {e}")
+                self._executor = None
+                future = self._training_executor().submit(_train_customer, customer_id)
+            self._pending.add(customer_id)
+            self.scheduled += 1
+
+        future.add_done_callback(lambda done: self._training_finished(customer_id, done))
+        return True
+
+    def _training_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.training_workers, initializer=_init_worker, initargs=(self.settings(),)
+            )
+        return self._executor
+
+    def _training_finished(self, customer_id: int, future):
+        with self._lock:
+            self._pending.discard(customer_id)
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self.failed += 1
+                if isinstance(future.exception(), BrokenProcessPool):
+                    self._executor = None
+            else:
+                self.trained += 1
+
+        if future.exception() is not None:
+            print(f"WARNING - Anomaly model training failed for customer {customer_id}: {future.exception()}")
+        else:
+            print(f"DEBUG - Trained anomaly model v{future.result()} for customer {customer_id}")
+
+    def train(self, db: Session, customer_id: int) -> Optional[AnomalyModelVersion]:
+        """
+        Fit a new model on the customer's most recent transactions, rescore
+        all of their stored transactions with it and make it the active
+        version. Returns None when the customer has too few transactions or
+        another trainer is already rolling out the customer's next version.
+        """
+        rows = db.execute(
+            select(Transaction.id, *(getattr(Transaction, column) for column in MODEL_COLUMNS))
+            .where(Transaction.customer_id == customer_id)
+            .order_by(Transaction.id.desc())
+            .limit(self.max_training_rows)
+        ).all()
+        if len(rows) < self.min_rows:
+            return None
+
+        record = self._claim(db, customer_id)
+        if record is None:
+            return None
+
+        try:
+            frame = pd.DataFrame.from_records(rows, columns=['id'] + MODEL_COLUMNS)
+            model = AnomalyModel().fit(frame)
+
+            path = os.path.join(self.model_dir, f"customer_{customer_id}", f"v{record.version}.joblib")
+            model.save(path)
+
+            self.rescore(db, customer_id, model)
+
+            record.path = path
+            record.training_rows = len(frame)
+            record.last_transaction_id = int(frame['id'].max())
+            record.anomaly_rate = model.metadata['anomaly_rate']
+            record.status = 'active'
+            db.commit()
+        except Exception:
+            # Release the version so the customer can be trained again
+            db.rollback()
+            db.delete(record)
+            db.commit()
+            raise
+
+        self._prune(db, customer_id)
+        return record
+
+    def _claim(self, db: Session, customer_id: int) -> Optional[AnomalyModelVersion]:
+        """
+        Insert the customer's next version row before any artifact is written.
+        Returns None when another trainer, in this or any other process, holds
+        a live claim or commits the same version first.
+        """
+        if self.training_claim(db, customer_id) is not None:
+            return None
+
+        abandoned = (
+            db.query(AnomalyModelVersion)
+            .filter(AnomalyModelVersion.customer_id == customer_id, AnomalyModelVersion.status == 'training')
+            .all()
+        )
+        for claim in abandoned:
+            print(f"WARNING - Releasing abandoned anomaly model v{claim.version} claim for customer {customer_id}")
+            db.delete(claim)
+
+        latest = (
+            db.query(func.max(AnomalyModelVersion.version))
+            .filter(AnomalyModelVersion.customer_id == customer_id)
+            .scalar()
+        )
+        record = AnomalyModelVersion(customer_id=customer_id, version=(latest or 0) + 1, status='training',
+                                     created_at=datetime.utcnow())
+        db.add(record)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return None
+        return record
+
+    def rescore(self, db: Session, customer_id: int, model: AnomalyModel) -> int:
+        """
+        Write the model's flags and scores back to every stored transaction of
+        the customer, one short transaction per chunk so the API keeps writing.
+        """
+        table = Transaction.__table__
+        statement = update(table).where(table.c.id == bindparam('row_id')).values(
+            is_anomaly=bindparam('flag'), anomaly_score=bindparam('score')
+        )
+
+        last_id = 0
+        rescored = 0
+        while True:
+            rows = db.execute(
+                select(Transaction.id, *(getattr(Transaction, column) for column in MODEL_COLUMNS))
+                .where(Transaction.customer_id == customer_id, Transaction.id > last_id)
+                .order_by(Transaction.id)
+                .limit(RESCORE_CHUNK_SIZE)
+            ).all()
+            if not rows:
+                return rescored
+
+            frame = pd.DataFrame.from_records(rows, columns=['id'] + MODEL_COLUMNS)
+            scores, flagged = model.score(frame)
+            db.execute(statement, [
+                {'row_id': row_id, 'flag': is_anomaly, 'score': score}
+                for row_id, score, is_anomaly in zip(frame['id'].tolist(), scores.tolist(), flagged.tolist())
+            ])
+            db.commit()
+
+            rescored += len(rows)
+            last_id = rows[-1].id
+
+    def _prune(self, db: Session, customer_id: int):
+        """Drop the versions (and artifacts) older than the newest versions_kept"""
+        stale = (
+            db.query(AnomalyModelVersion)
+            .filter(AnomalyModelVersion.customer_id == customer_id, AnomalyModelVersion.status == 'active')
+            .order_by(AnomalyModelVersion.version.desc())
+            .offset(self.versions_kept)
+            .all()
+        )
+        for record in stale:
+            try:
+                os.remove(record.path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"WARNING - Could not remove anomaly model {record.path}: {e}")
+            db.delete(record)
+        if stale:
+            db.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'training_workers': self.training_workers,
+                'training': len(self._pending),
+                'scheduled': self.scheduled,
+                'trained': self.trained,
+                'failed': self.failed,
+                'models_loaded': len(self._models)
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import select, delete, insert
+from sqlalchemy.orm import sessionmaker
+
+from database import SessionLocal, engine
+from models import Customer, Anomaly
+from services.anomaly_detector import AnomalyDetector
+from services.anomaly_model_store import AnomalyModelStore
+
+# Per-worker sweep, created by _init_worker
+_worker_sweep = None
+
+
+def _init_worker():
+    global _worker_sweep
+    # Connections inherited from the parent must not be reused in the child
+    engine.dispose(close=False)
+    _worker_sweep = AnomalySweep(workers=0)
+
+
+def _sweep_customer(customer_id: int) -> Dict:
+    return _worker_sweep.detect_customer(customer_id)
+
+
+class AnomalySweep:
+    """
+    Batch anomaly detection over every customer, for the nightly fraud
+    review. Customers are read in id order, a chunk at a time, and detected
+    in a pool of worker processes, each reading its customer's transactions
+    on its own connection. Only this process writes: each customer's
+    anomalies replace the ones of earlier sweeps in one short transaction,
+    so the API is never locked out for long. The last swept chunk is
+    recorded in a checkpoint file, and an interrupted sweep resumes after it.
+    Customers whose detection failed are listed in the checkpoint and tried
+    again first when the sweep resumes.
+    """
+
+    def __init__(self, session_factory: Optional[sessionmaker] = None, workers: Optional[int] = None,
+                 chunk_size: Optional[int] = None, checkpoint_path: Optional[str] = None):
+        if workers is None:
+            workers = int(os.getenv("ANOMALY_SWEEP_WORKERS", os.cpu_count() or 1))
+        if chunk_size is None:
+            chunk_size = int(os.getenv("ANOMALY_SWEEP_CHUNK_SIZE", 100))
+        if checkpoint_path is None:
+            checkpoint_path = os.getenv("ANOMALY_SWEEP_CHECKPOINT", "./.anomaly_sweep_checkpoint.json")
+
+        # Workers always read through database.SessionLocal
+        self.session_factory = session_factory or SessionLocal
+        # 0 detects in this process
+        self.workers = max(0, workers)
+        self.chunk_size = max(1, chunk_size)
+        self.checkpoint_path = checkpoint_path
+
+        # Each customer is read once per sweep, so frames are not cached
+        self.detector = AnomalyDetector(frame_cache_size=0)
+        self.models = AnomalyModelStore(training_workers=0)
+        self._executor = None
+
+    def detect_customer(self, customer_id: int) -> Dict:
+        """
+        Anomalies of one customer as the endpoint reports them: from the
+        persisted model's flags when the customer has a model, otherwise with
+        the ML stage fitted on the spot.
+        """
+        result = {'customer_id': customer_id, 'transactions': 0, 'anomalies': [], 'seconds': 0.0, 'error': None}
+        started = time.perf_counter()
+        try:
+            db = self.session_factory()
+            try:
+                frame = self.detector.load_transactions(db, customer_id)
+                stored_scores = None
+                if self.models.active_version(db, customer_id) is not None:
+                    stored_scores = self.models.stored_scores(db, customer_id)
+            finally:
+                # Nothing is held open while detecting
+                db.close()
+
+            result['transactions'] = len(frame)
+            result['anomalies'] = [
+                {key: anomaly[key] for key in ('transaction_id', 'anomaly_type', 'score', 'description')}
+                for anomaly in self.detector.detect_anomalies_frame(frame, stored_scores=stored_scores)
+            ]
+        except Exception as e:
+            result['error'] = str(e)
+        result['seconds'] = time.perf_counter() - started
+        return result
+
+    def run(self, restart: bool = False) -> Dict:
+        """Sweep every customer after the checkpoint, or all of them when restarting"""
+        checkpoint = None if restart else self.load_checkpoint()
+        if checkpoint is None or checkpoint.get('finished_at'):
+            checkpoint = {
+                'sweep_id': uuid.uuid4().hex,
+                'started_at': datetime.utcnow().isoformat(),
+                'last_customer_id': 0,
+                'failed_customer_ids': [],
+                'finished_at': None
+            }
+            self.save_checkpoint(checkpoint)
+        failed = set(checkpoint.get('failed_customer_ids', []))
+
+        stats = {
+            'sweep_id': checkpoint['sweep_id'],
+            'resumed_after': checkpoint['last_customer_id'],
+            'customers': 0,
+            'customers_failed': 0,
+            'transactions': 0,
+            'anomalies': 0,
+            'by_type': Counter(),
+            'timings': {'detect': 0.0, 'save': 0.0},
+            'finished': False
+        }
+
+        started_at = time.perf_counter()
+        try:
+            if failed:
+                print(f"DEBUG - Retrying {len(failed)} customers that failed before the checkpoint")
+                for result in self._detect_chunk(sorted(failed)):
+                    if self._record(result, checkpoint['sweep_id'], stats):
+                        failed.discard(result['customer_id'])
+                checkpoint['failed_customer_ids'] = sorted(failed)
+                self.save_checkpoint(checkpoint)
+
+            for customer_ids in self._customer_chunks(checkpoint['last_customer_id']):
+                for result in self._detect_chunk(customer_ids):
+                    if not self._record(result, checkpoint['sweep_id'], stats):
+                        failed.add(result['customer_id'])
+
+                # Every customer of the chunk is saved or listed as failed: a resumed
+                # sweep starts after the chunk and retries the failed ones
+                checkpoint['last_customer_id'] = customer_ids[-1]
+                checkpoint['failed_customer_ids'] = sorted(failed)
+                self.save_checkpoint(checkpoint)
+                elapsed = time.perf_counter() - started_at
+                print(f"DEBUG - Anomaly sweep at customer {customer_ids[-1]}: {stats['customers']} customers, "
+                      f"{stats['customers'] / elapsed if elapsed > 0 else 0.0:.1f} customers/s")
+
+            checkpoint['finished_at'] = datetime.utcnow().isoformat()
+            self.save_checkpoint(checkpoint)
+            stats['finished'] = True
+        finally:
+            self.shutdown()
+            stats['elapsed'] = time.perf_counter() - started_at
+            stats['last_customer_id'] = checkpoint['last_customer_id']
+            stats['failed_customer_ids'] = sorted(failed)
+        return stats
+
+    def _customer_chunks(self, after_id: int) -> Iterator[List[int]]:
+        # Keyset pages: no read transaction stays open across the sweep
+        while True:
+            db = self.session_factory()
+            try:
+                customer_ids = list(db.execute(
+                    select(Customer.id).where(Customer.id > after_id).order_by(Customer.id).limit(self.chunk_size)
+                ).scalars())
+            finally:
+                db.close()
+            if not customer_ids:
+                return
+            yield customer_ids
+            after_id = customer_ids[-1]
+
+    def _detect_chunk(self, customer_ids: List[int]) -> Iterator[Dict]:
+        if self.workers == 0:
+            for customer_id in customer_ids:
+                yield self.detect_customer(customer_id)
+            return
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        futures = {self._executor.submit(_sweep_customer, customer_id): customer_id for customer_id in customer_ids}
+        died = []
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                died.append(futures[future])
+        if not died:
+            return
+
+        print(f"WARNING - Anomaly sweep worker pool broke, retrying {len(died)} customers on a new one")
+        self.shutdown()
+        # One customer at a time, so a customer that kills its worker only fails itself
+        for customer_id in sorted(died):
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            try:
+                yield self._executor.submit(_sweep_customer, customer_id).result()
+            except BrokenProcessPool:
+                self.shutdown()
+                yield {'customer_id': customer_id, 'transactions': 0, 'anomalies': [], 'seconds': 0.0,
+                       'error': 'worker process died'}
+
+    def _record(self, result: Dict, sweep_id: str, stats: Dict) -> bool:
+        """Save one customer's anomalies; False when their detection failed"""
+        stats['timings']['detect'] += result['seconds']
+        if result['error']:
+            stats['customers_failed'] += 1
+            print(f"WARNING - Anomaly sweep failed for customer {result['customer_id']}: {result['error']}")
+            return False
+
+        started = time.perf_counter()
+        self.save_anomalies(result['customer_id'], result['anomalies'], sweep_id)
+        stats['timings']['save'] += time.perf_counter() - started
+
+        stats['customers'] += 1
+        stats['transactions'] += result['transactions']
+        stats['anomalies'] += len(result['anomalies'])
+        stats['by_type'].update(anomaly['anomaly_type'] for anomaly in result['anomalies'])
+        return True
+
+    def save_anomalies(self, customer_id: int, anomalies: List[Dict], sweep_id: str):
+        """Replace the customer's stored anomalies, in one short write transaction"""
+        db = self.session_factory()
+        try:
+            db.execute(delete(Anomaly).where(Anomaly.customer_id == customer_id))
+            if anomalies:
+                detected_at = datetime.utcnow()
+                db.execute(insert(Anomaly), [
+                    {**anomaly, 'customer_id': customer_id, 'sweep_id': sweep_id, 'detected_at': detected_at}
+                    for anomaly in anomalies
+                ])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def load_checkpoint(self) -> Optional[Dict]:
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_checkpoint(self, checkpoint: Dict):
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, indent=2)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
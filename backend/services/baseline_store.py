@@ -0,0 +1,248 @@
+import json
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models import Transaction, CustomerBaseline, CategoryBaseline, MerchantSighting
+from services.merchant_memo import normalize_merchant
+from services.streaming_stats import RunningStats, P2Quantile
+
+# Amount quantiles kept per customer: the IQR bounds, the median and the large-amount cut-off
+QUANTILES = (0.25, 0.5, 0.75, 0.9)
+
+# Stored transactions folded into a baseline per query
+CATCH_UP_CHUNK_SIZE = 5000
+
+# History needed before amounts and new merchants are judged, as in AnomalyDetector
+MIN_HISTORY = 10
+MIN_CATEGORY_HISTORY = 3
+
+
+def _amount(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class OnlineBaselineStore:
+    """
+    Per-customer streaming baselines for flagging transactions as they
+    arrive: Welford mean and variance and P-square quantiles of the amounts,
+    Welford aggregates per category and the merchants seen so far. Every
+    stored transaction is folded in once, in id order, at O(1) cost, so an
+    incoming SMS or email transaction is judged with a few indexed lookups
+    instead of the customer's whole history.
+    """
+
+    def __init__(self, iqr_factor: float = 3.0, category_z_threshold: float = 2.5):
+        # The thresholds of the amount and category detectors in AnomalyDetector
+        self.iqr_factor = iqr_factor
+        self.category_z_threshold = category_z_threshold
+
+    def flag(self, db: Session, customer_id: int, transactions: List[Dict]) -> List[List[Dict]]:
+        """
+        Rule-based flags for each incoming transaction, judged against the
+        customer's baseline and the batch's earlier transactions. The stored
+        baseline is left as it is; catch_up folds the rows in once saved.
+        """
+        baseline = self.catch_up(db, customer_id)
+        amount_stats, quantiles = self._amount_state(baseline)
+
+        categories = {t.get('category') for t in transactions if t.get('category')}
+        category_stats = self._load_categories(db, customer_id, categories)
+
+        merchant_keys = [normalize_merchant(t.get('merchant')) for t in transactions]
+        seen = set()
+        if any(merchant_keys):
+            seen = set(db.execute(
+                select(MerchantSighting.merchant_key).where(
+                    MerchantSighting.customer_id == customer_id,
+                    MerchantSighting.merchant_key.in_({key for key in merchant_keys if key})
+                )
+            ).scalars())
+
+        flags = []
+        for transaction, merchant_key in zip(transactions, merchant_keys):
+            amount = _amount(transaction.get('amount'))
+            if amount is None:
+                flags.append([])
+                continue
+
+            category = transaction.get('category')
+            flags.append(self._evaluate(
+                transaction, amount, amount_stats, quantiles,
+                category_stats.get(category), merchant_key and merchant_key not in seen
+            ))
+
+            amount_stats.push(amount)
+            for quantile in quantiles.values():
+                quantile.push(amount)
+            if category:
+                category_stats.setdefault(category, RunningStats()).push(amount)
+            if merchant_key:
+                seen.add(merchant_key)
+        return flags
+
+    def _evaluate(self, transaction: Dict, amount: float, amount_stats: RunningStats,
+                  quantiles: Dict[float, P2Quantile], category_stats: Optional[RunningStats],
+                  new_merchant: bool) -> List[Dict]:
+        flags = []
+
+        if amount_stats.count >= MIN_HISTORY:
+            q1, median, q3, large = (quantiles[p].value() for p in QUANTILES)
+            iqr = q3 - q1
+            if amount > q3 + self.iqr_factor * iqr or amount < q1 - self.iqr_factor * iqr:
+                std = amount_stats.std()
+                flags.append({
+                    'anomaly_type': 'amount_outlier',
+                    'score': min(abs(amount - median) / std, 1.0) if std > 0 else 1.0,
+                    'description': f'Amount ${amount:.2f} is unusual (typical range: ${q1:.2f} - ${q3:.2f})'
+                })
+
+            if new_merchant and amount > large:
+                flags.append({
+                    'anomaly_type': 'merchant_anomaly',
+                    'score': 0.8,
+                    'description': f"First transaction with {transaction.get('merchant')} for large amount ${amount:.2f}"
+                })
+
+        category = transaction.get('category')
+        if category and category != 'Other' and category_stats is not None \
+                and category_stats.count >= MIN_CATEGORY_HISTORY:
+            std = category_stats.std(sample=True)
+            if std > 0:
+                z_score = abs(amount - category_stats.mean) / std
+                if z_score > self.category_z_threshold:
+                    flags.append({
+                        'anomaly_type': 'category_anomaly',
+                        'score': min(z_score / 3, 1.0),
+                        'description': f'Unusual amount ${amount:.2f} for {category} (typical: ${category_stats.mean:.2f})'
+                    })
+
+        return flags
+
+    def catch_up(self, db: Session, customer_id: int) -> CustomerBaseline:
+        """
+        Fold the customer's transactions stored since the last call into the
+        persisted baseline, without committing. The first call for a customer
+        with history reads it once; after that only new rows are read.
+        """
+        baseline = self._baseline(db, customer_id)
+        while True:
+            rows = db.execute(
+                select(Transaction.id, Transaction.amount, Transaction.category, Transaction.merchant)
+                .where(Transaction.customer_id == customer_id, Transaction.id > baseline.last_transaction_id)
+                .order_by(Transaction.id)
+                .limit(CATCH_UP_CHUNK_SIZE)
+            ).all()
+            if not rows or not self._fold(db, baseline, rows):
+                return baseline
+
+    def _baseline(self, db: Session, customer_id: int) -> CustomerBaseline:
+        baseline = db.query(CustomerBaseline).filter(CustomerBaseline.customer_id == customer_id).first()
+        if baseline is None:
+            db.execute(insert(CustomerBaseline).values(
+                customer_id=customer_id, transaction_count=0, amount_mean=0.0, amount_m2=0.0,
+                last_transaction_id=0, updated_at=datetime.utcnow()
+            ).on_conflict_do_nothing(index_elements=['customer_id']))
+            baseline = db.query(CustomerBaseline).filter(CustomerBaseline.customer_id == customer_id).first()
+        return baseline
+
+    def _amount_state(self, baseline: CustomerBaseline):
+        stats = RunningStats(baseline.transaction_count or 0, baseline.amount_mean or 0.0, baseline.amount_m2 or 0.0)
+        stored = json.loads(baseline.amount_quantiles) if baseline.amount_quantiles else {}
+        quantiles = {
+            p: P2Quantile.from_dict(stored[str(p)]) if str(p) in stored else P2Quantile(p)
+            for p in QUANTILES
+        }
+        return stats, quantiles
+
+    def _load_categories(self, db: Session, customer_id: int, categories) -> Dict[str, RunningStats]:
+        if not categories:
+            return {}
+        rows = db.execute(
+            select(CategoryBaseline.category, CategoryBaseline.transaction_count,
+                   CategoryBaseline.amount_mean, CategoryBaseline.amount_m2)
+            .where(CategoryBaseline.customer_id == customer_id, CategoryBaseline.category.in_(categories))
+        ).all()
+        return {row.category: RunningStats(row.transaction_count, row.amount_mean, row.amount_m2) for row in rows}
+
+    def _fold(self, db: Session, baseline: CustomerBaseline, rows) -> bool:
+        """Add a chunk of stored rows to the baseline; False when another writer already has"""
+        customer_id = baseline.customer_id
+        previous_id = baseline.last_transaction_id
+        amount_stats, quantiles = self._amount_state(baseline)
+
+        amounts_by_category = {}
+        merchant_counts = {}
+        merchant_keys = {}
+        for row in rows:
+            key = merchant_keys.get(row.merchant)
+            if key is None:
+                key = merchant_keys[row.merchant] = normalize_merchant(row.merchant)
+            if key:
+                merchant_counts[key] = merchant_counts.get(key, 0) + 1
+
+            amount = _amount(row.amount)
+            if amount is None:
+                continue
+            amount_stats.push(amount)
+            for quantile in quantiles.values():
+                quantile.push(amount)
+            if row.category:
+                amounts_by_category.setdefault(row.category, []).append(amount)
+
+        # Claim the rows first: a concurrent catch-up that got there before us wins
+        claimed = db.execute(
+            update(CustomerBaseline)
+            .where(CustomerBaseline.id == baseline.id, CustomerBaseline.last_transaction_id == previous_id)
+            .values(
+                transaction_count=amount_stats.count,
+                amount_mean=amount_stats.mean,
+                amount_m2=amount_stats.m2,
+                amount_quantiles=json.dumps({str(p): quantile.to_dict() for p, quantile in quantiles.items()}),
+                last_transaction_id=rows[-1].id,
+                updated_at=datetime.utcnow()
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.expire(baseline)
+        if not claimed:
+            return False
+
+        if amounts_by_category:
+            category_stats = self._load_categories(db, customer_id, set(amounts_by_category))
+            values = []
+            for category, amounts in amounts_by_category.items():
+                stats = category_stats.get(category) or RunningStats()
+                for amount in amounts:
+                    stats.push(amount)
+                values.append({
+                    'customer_id': customer_id, 'category': category,
+                    'transaction_count': stats.count, 'amount_mean': stats.mean, 'amount_m2': stats.m2
+                })
+            statement = insert(CategoryBaseline)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=['customer_id', 'category'],
+                set_={
+                    'transaction_count': statement.excluded.transaction_count,
+                    'amount_mean': statement.excluded.amount_mean,
+                    'amount_m2': statement.excluded.amount_m2
+                }
+            ), values)
+
+        if merchant_counts:
+            statement = insert(MerchantSighting)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=['customer_id', 'merchant_key'],
+                set_={'transaction_count': MerchantSighting.transaction_count + statement.excluded.transaction_count}
+            ), [
+                {'customer_id': customer_id, 'merchant_key': key, 'transaction_count': count,
+                 'first_seen': datetime.utcnow()}
+                for key, count in merchant_counts.items()
+            ])
+        return True
@@ -1,12 +1,46 @@
-import re
-from typing import List, Dict, Optional
+import os
+import threading
+from typing import List, Dict, NamedTuple, Optional
 import spacy
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import pandas as pd
 
+from services.keyword_matcher import KeywordMatcher
+from services.merchant_memo import MerchantCategoryMemo
+from services.category_model import CategoryModel
+
+# Pipeline components the categorizer never reads; only the entities are used
+NLP_DISABLED_COMPONENTS = ["parser", "lemmatizer"]
+
+
+class CategoryIndex(NamedTuple):
+    """
+    Everything built from one version of the category table. A rebuild
+    publishes a new index as a whole, so a batch that reads the index once
+    never mixes a matcher, vectorizer or vector set from different versions.
+    """
+    version: int
+    categories: Dict
+    keyword_matcher: KeywordMatcher
+    pattern_matcher: KeywordMatcher
+    vectorizer: Optional[TfidfVectorizer]
+    category_names: List[str]
+    category_vectors: object
+
+
 class TransactionCategorizer:
-    def __init__(self):
+    def __init__(self, nlp_batch_size: Optional[int] = None, nlp_n_process: Optional[int] = None,
+                 memo: Optional[MerchantCategoryMemo] = None, model: Optional[CategoryModel] = None,
+                 model_threshold: Optional[float] = None):
+        if nlp_batch_size is None:
+            nlp_batch_size = int(os.getenv("CATEGORIZER_NLP_BATCH_SIZE", 256))
+        if nlp_n_process is None:
+            nlp_n_process = int(os.getenv("CATEGORIZER_NLP_PROCESSES", 1))
+        if model_threshold is None:
+            model_threshold = float(os.getenv("CATEGORY_MODEL_THRESHOLD", 0.7))
+        
+        # Bumped on every change of the category table; the index is rebuilt when it moves
+        self._categories_version = 0
         self.categories = {
             'Food & Dining': {
                 'keywords': ['restaurant', 'food', 'dining', 'cafe', 'pizza', 'burger', 'starbucks', 'mcdonalds', 'subway', 'delivery', 'takeout', 'bar', 'pub', 'bakery', 'grocery', 'supermarket', 'market', 'whole foods', 'safeway', 'kroger'],
@@ -66,13 +100,33 @@ class TransactionCategorizer:
         }
         
         self.nlp = None
-        self.vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
-        self.category_vectors = None
+        # Optional merchant -> category memo consulted before the cascade
+        self.memo = memo
+        # Optional trained classifier that replaces the NLP and TF-IDF stages for
+        # every row it predicts with at least model_threshold probability
+        self.model = model
+        self.model_threshold = model_threshold
+        self.nlp_batch_size = max(1, nlp_batch_size)
+        self.nlp_n_process = max(1, nlp_n_process)
+        # Keyword/pattern automata and TF-IDF index of the category table, built
+        # once and rebuilt only when the categories change
+        self._category_index = None
+        self._index_lock = threading.Lock()
         self._initialize_nlp()
     
+    @property
+    def categories(self) -> Dict:
+        return self._categories
+    
+    @categories.setter
+    def categories(self, categories: Dict):
+        # Replacing the table counts as a change; edits in place must call invalidate_category_index()
+        self._categories = categories
+        self._categories_version += 1
+    
     def _initialize_nlp(self):
         try:
-            self.nlp = spacy.load("en_core_web_sm")
+            self.nlp = spacy.load("en_core_web_sm", disable=NLP_DISABLED_COMPONENTS)
         except OSError:
             print("spaCy model not found. Install with: python -m spacy download en_core_web_sm")
             self.nlp = None
@@ -81,31 +135,117 @@ class TransactionCategorizer:
         if not transactions:
             return []
         
-        for transaction in transactions:
-            category, subcategory, confidence = self.categorize_single_transaction(transaction)
+        # The whole batch is matched against this one version of the index
+        index = self._ensure_category_index()
+        
+        texts = [self._extract_text_for_analysis(transaction) for transaction in transactions]
+        results = [None] * len(transactions)
+        
+        # Merchants decided before are served from the memo; of the rest only the
+        # first row per merchant goes through the cascade
+        keys = [self.memo.key_for(transaction) for transaction in transactions] if self.memo else [''] * len(texts)
+        memoized = self.memo.lookup_many(keys) if self.memo else {}
+        pending = []
+        first_row_for_key = {}
+        for i, key in enumerate(keys):
+            if key in memoized:
+                results[i] = memoized[key]
+            elif not key:
+                pending.append(i)
+            elif key not in first_row_for_key:
+                first_row_for_key[key] = i
+                pending.append(i)
+        
+        # Cascading passes over the batch; each stage only sees the rows the previous ones left unresolved
+        pending = self._resolve(results, pending, 0.8,
+                                (self._keyword_matching(texts[i], index) for i in pending))
+        pending = self._resolve(results, pending, 0.7,
+                                (self._pattern_matching(texts[i], index) for i in pending))
+        
+        if self.model is not None and pending:
+            pending = self._resolve(results, pending, self.model_threshold,
+                                    self._model_matching([texts[i] for i in pending]), inclusive=True)
+        
+        if self.nlp and pending:
+            docs = self.nlp.pipe(
+                (texts[i] for i in pending),
+                batch_size=self.nlp_batch_size,
+                n_process=self.nlp_n_process
+            )
+            pending = self._resolve(results, pending, 0.6,
+                                    (self._nlp_match_doc(doc, index) for doc in docs))
+        
+        # Everything the rules could not place is scored against the category index in one batch
+        for i, ml_match in zip(pending, self._ml_matching_batch([texts[i] for i in pending], index)):
+            results[i] = self._final_match(ml_match)
+        
+        if first_row_for_key:
+            for i, key in enumerate(keys):
+                if results[i] is None:
+                    results[i] = results[first_row_for_key[key]]
+            self.memo.store_many({key: results[i] for key, i in first_row_for_key.items()},
+                                 texts={key: texts[i] for key, i in first_row_for_key.items()})
+        
+        for transaction, (category, subcategory, confidence) in zip(transactions, results):
             transaction['category'] = category
             transaction['subcategory'] = subcategory
             transaction['confidence_score'] = confidence
+            transaction['category_source'] = 'categorizer'
         
         return transactions
     
     def categorize_single_transaction(self, transaction: Dict) -> tuple:
         text_to_analyze = self._extract_text_for_analysis(transaction)
+        index = self._ensure_category_index()
         
-        keyword_match = self._keyword_matching(text_to_analyze)
+        rule_match = self._rule_based_matching(text_to_analyze, index)
+        if rule_match is not None:
+            return rule_match
+        
+        return self._final_match(self._ml_matching(text_to_analyze, index))
+    
+    @staticmethod
+    def _resolve(results: List, positions, threshold: float, matches, inclusive: bool = False) -> List[int]:
+        """Store the matches above the threshold and return the positions still unresolved"""
+        unresolved = []
+        for i, match in zip(positions, matches):
+            if match[2] > threshold or (inclusive and match[2] == threshold):
+                results[i] = match
+            else:
+                unresolved.append(i)
+        return unresolved
+    
+    def _model_matching(self, texts: List[str]) -> List[tuple]:
+        try:
+            return self.model.predict(texts)
+        except Exception as e:
+            print(f"Model matching error: {e}")
+            return [('Other', 'Miscellaneous', 0.0)] * len(texts)
+    
+    def _rule_based_matching(self, text_to_analyze: str, index: Optional[CategoryIndex] = None) -> Optional[tuple]:
+        """Keyword, pattern, model and NLP stages; None when the text falls through to ML"""
+        index = index or self._ensure_category_index()
+        keyword_match = self._keyword_matching(text_to_analyze, index)
         if keyword_match[2] > 0.8:
             return keyword_match
         
-        pattern_match = self._pattern_matching(text_to_analyze)
+        pattern_match = self._pattern_matching(text_to_analyze, index)
         if pattern_match[2] > 0.7:
             return pattern_match
         
+        if self.model is not None:
+            model_match = self._model_matching([text_to_analyze])[0]
+            if model_match[2] >= self.model_threshold:
+                return model_match
+        
         if self.nlp:
-            nlp_match = self._nlp_matching(text_to_analyze)
+            nlp_match = self._nlp_matching(text_to_analyze, index)
             if nlp_match[2] > 0.6:
                 return nlp_match
         
-        ml_match = self._ml_matching(text_to_analyze)
+        return None
+    
+    def _final_match(self, ml_match: tuple) -> tuple:
         if ml_match[2] > 0.5:
             return ml_match
         
@@ -125,12 +265,14 @@ class TransactionCategorizer:
         
         return ' '.join(text_parts).lower()
     
-    def _keyword_matching(self, text: str) -> tuple:
+    def _keyword_matching(self, text: str, index: Optional[CategoryIndex] = None) -> tuple:
+        index = index or self._ensure_category_index()
         best_match = ('Other', 'Miscellaneous', 0.0)
+        hits = index.keyword_matcher.hit_counts(text)
         
-        for category, data in self.categories.items():
+        for category, data in index.categories.items():
             keywords = data['keywords']
-            matches = sum(1 for keyword in keywords if keyword in text)
+            matches = hits.get(category, 0)
             
             if matches > 0:
                 confidence = min(matches / len(keywords), 1.0)
@@ -140,28 +282,31 @@ class TransactionCategorizer:
         
         return best_match
     
-    def _pattern_matching(self, text: str) -> tuple:
+    def _pattern_matching(self, text: str, index: Optional[CategoryIndex] = None) -> tuple:
+        index = index or self._ensure_category_index()
         best_match = ('Other', 'Miscellaneous', 0.0)
+        hits = index.pattern_matcher.hit_counts(text)
         
-        for category, data in self.categories.items():
-            patterns = data['patterns']
-            for pattern in patterns:
-                if re.search(pattern, text, re.IGNORECASE):
-                    subcategory = data['subcategories'][0] if data['subcategories'] else 'General'
-                    return (category, subcategory, 0.85)
+        for category, data in index.categories.items():
+            if hits.get(category):
+                subcategory = data['subcategories'][0] if data['subcategories'] else 'General'
+                return (category, subcategory, 0.85)
         
         return best_match
     
-    def _nlp_matching(self, text: str) -> tuple:
+    def _nlp_matching(self, text: str, index: Optional[CategoryIndex] = None) -> tuple:
         if not self.nlp:
             return ('Other', 'Miscellaneous', 0.0)
         
-        doc = self.nlp(text)
+        return self._nlp_match_doc(self.nlp(text), index)
+    
+    def _nlp_match_doc(self, doc, index: Optional[CategoryIndex] = None) -> tuple:
+        index = index or self._ensure_category_index()
         entities = [ent.text.lower() for ent in doc.ents]
+        entity_hits = [index.keyword_matcher.hit_counts(entity) for entity in entities]
         
-        for category, data in self.categories.items():
-            keywords = data['keywords']
-            entity_matches = sum(1 for entity in entities if any(keyword in entity for keyword in keywords))
+        for category, data in index.categories.items():
+            entity_matches = sum(1 for hits in entity_hits if hits.get(category))
             
             if entity_matches > 0:
                 confidence = min(entity_matches / max(len(entities), 1), 0.9)
@@ -171,52 +316,114 @@ class TransactionCategorizer:
         
         return ('Other', 'Miscellaneous', 0.0)
     
-    def _ml_matching(self, text: str) -> tuple:
-        try:
-            category_texts = []
-            category_names = []
-            
-            for category, data in self.categories.items():
-                if category != 'Other':
-                    category_text = ' '.join(data['keywords'])
-                    category_texts.append(category_text)
-                    category_names.append(category)
-            
-            if not category_texts:
-                return ('Other', 'Miscellaneous', 0.0)
-            
-            all_texts = category_texts + [text]
-            tfidf_matrix = self.vectorizer.fit_transform(all_texts)
-            
-            text_vector = tfidf_matrix[-1]
-            category_vectors = tfidf_matrix[:-1]
+    def _ensure_category_index(self) -> CategoryIndex:
+        """
+        The index of the current category table, rebuilt only when the table
+        version has moved since the last build. A rebuild fits a new vectorizer
+        and swaps the finished index in, so readers holding the old one are unaffected.
+        """
+        index = self._category_index
+        if index is not None and index.version == self._categories_version:
+            return index
+        
+        with self._index_lock:
+            version = self._categories_version
+            index = self._category_index
+            if index is not None and index.version == version:
+                return index
             
-            similarities = cosine_similarity(text_vector, category_vectors).flatten()
+            snapshot = [
+                (category, list(data['keywords']), list(data['patterns']), list(data['subcategories']))
+                for category, data in self._categories.items()
+            ]
+            keyword_matcher = KeywordMatcher.from_table(
+                {category: keywords for category, keywords, _, _ in snapshot}
+            )
+            pattern_matcher = KeywordMatcher.from_table(
+                {category: patterns for category, _, patterns, _ in snapshot},
+                ignore_case=True,
+                patterns=True
+            )
             
-            best_idx = similarities.argmax()
-            best_similarity = similarities[best_idx]
+            names = [category for category, _, _, _ in snapshot if category != 'Other']
+            texts = [' '.join(keywords) for category, keywords, _, _ in snapshot if category != 'Other']
+            vectorizer = None
+            category_vectors = None
+            if texts:
+                try:
+                    vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
+                    category_vectors = vectorizer.fit_transform(texts)
+                except ValueError as e:
+                    # Every category text is empty or made only of stop words
+                    print(f"ML matching error: {e}")
+                    vectorizer = None
             
-            if best_similarity > 0.3:
-                best_category = category_names[best_idx]
-                subcategory = self.categories[best_category]['subcategories'][0]
-                return (best_category, subcategory, best_similarity)
+            categories = {
+                category: {'keywords': keywords, 'patterns': patterns, 'subcategories': subcategories}
+                for category, keywords, patterns, subcategories in snapshot
+            }
+            self._category_index = CategoryIndex(version, categories, keyword_matcher, pattern_matcher,
+                                                 vectorizer, names, category_vectors)
+            return self._category_index
+    
+    def invalidate_category_index(self):
+        """Force a rebuild on the next match, e.g. after the category table is edited in place"""
+        with self._index_lock:
+            self._categories_version += 1
+    
+    def _ml_matching(self, text: str, index: Optional[CategoryIndex] = None) -> tuple:
+        return self._ml_matching_batch([text], index)[0]
+    
+    def _ml_matching_batch(self, texts: List[str], index: Optional[CategoryIndex] = None) -> List[tuple]:
+        """Cosine similarity of each text against every category in one sparse product"""
+        no_match = ('Other', 'Miscellaneous', 0.0)
+        if not texts:
+            return []
         
+        try:
+            index = index or self._ensure_category_index()
+            if index.category_vectors is None:
+                return [no_match] * len(texts)
+            
+            # Rows are L2-normalised by the vectorizer, so the dot product is the cosine similarity
+            text_vectors = index.vectorizer.transform(texts)
+            similarities = (text_vectors @ index.category_vectors.T).toarray()
         except Exception as e:
             print(f"ML matching error: {e}")
+            return [no_match] * len(texts)
         
-        return ('Other', 'Miscellaneous', 0.0)
+        matches = []
+        for row in similarities:
+            best_idx = row.argmax()
+            best_similarity = row[best_idx]
+            
+            if best_similarity > 0.3:
+                best_category = index.category_names[best_idx]
+                subcategory = index.categories[best_category]['subcategories'][0]
+                matches.append((best_category, subcategory, best_similarity))
+            else:
+                matches.append(no_match)
+        
+        return matches
     
     def add_custom_rule(self, pattern: str, category: str, subcategory: str, confidence: float = 0.9):
-        if category not in self.categories:
-            self.categories[category] = {
-                'keywords': [],
-                'patterns': [],
-                'subcategories': [subcategory]
-            }
+        # Under the index lock, so a rebuild never snapshots a half-added rule
+        with self._index_lock:
+            if category not in self.categories:
+                self.categories[category] = {
+                    'keywords': [],
+                    'patterns': [],
+                    'subcategories': [subcategory]
+                }
+            
+            self.categories[category]['patterns'].append(pattern)
+            if subcategory not in self.categories[category]['subcategories']:
+                self.categories[category]['subcategories'].append(subcategory)
+            self._categories_version += 1
         
-        self.categories[category]['patterns'].append(pattern)
-        if subcategory not in self.categories[category]['subcategories']:
-            self.categories[category]['subcategories'].append(subcategory)
+        if self.memo is not None:
+            # Only merchants the new pattern matches can be categorized differently now
+            self.memo.invalidate_matching(pattern)
     
     def get_category_statistics(self, transactions: List[Dict]) -> Dict:
         stats = {}
@@ -0,0 +1,122 @@
+import os
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import joblib
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+
+MODEL_FORMAT_VERSION = 1
+DEFAULT_MODEL_PATH = "category_model.joblib"
+
+
+class CategoryModel:
+    """
+    Compact linear category classifier: hashed character n-grams of the
+    transaction text and a logistic regression. The vectorizer is stateless,
+    so the artifact holds only the regression weights and a few settings,
+    and a whole batch is categorized with one sparse matrix product.
+    """
+
+    def __init__(self, n_features: int = 2 ** 18, ngram_range: Tuple[int, int] = (3, 4), C: float = 10.0):
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.C = C
+        self.vectorizer = self._build_vectorizer()
+        self.classifier = None
+        # Most frequent subcategory of each category in the training data
+        self.subcategories = {}
+        self.metadata = {}
+
+    def _build_vectorizer(self) -> HashingVectorizer:
+        return HashingVectorizer(
+            analyzer='char_wb',
+            ngram_range=self.ngram_range,
+            n_features=self.n_features,
+            alternate_sign=False,
+            lowercase=True
+        )
+
+    @property
+    def categories(self) -> List[str]:
+        return list(self.classifier.classes_) if self.classifier is not None else []
+
+    def fit(self, texts: List[str], categories: List[str], subcategories: Optional[List[str]] = None) -> 'CategoryModel':
+        if len(set(categories)) < 2:
+            raise ValueError("Training needs transactions from at least two categories")
+
+        features = self.vectorizer.transform(texts)
+        # saga handles wide sparse inputs far faster than the default lbfgs
+        self.classifier = LogisticRegression(C=self.C, solver='saga', tol=1e-3, max_iter=1000)
+        self.classifier.fit(features, categories)
+
+        counts = defaultdict(Counter)
+        for category, subcategory in zip(categories, subcategories or [None] * len(categories)):
+            counts[category][subcategory or 'General'] += 1
+        self.subcategories = {category: counter.most_common(1)[0][0] for category, counter in counts.items()}
+
+        self.metadata = {
+            'trained_at': datetime.utcnow().isoformat(),
+            'training_rows': len(texts),
+            'categories': len(self.subcategories)
+        }
+        return self
+
+    def predict(self, texts: List[str]) -> List[Tuple[str, str, float]]:
+        """(category, subcategory, probability) for each text, in one vectorized step"""
+        if not texts:
+            return []
+        if self.classifier is None:
+            raise ValueError("Category model has not been trained")
+
+        probabilities = self.classifier.predict_proba(self.vectorizer.transform(texts))
+        best = probabilities.argmax(axis=1)
+        classes = self.classifier.classes_
+        return [
+            (classes[index], self.subcategories.get(classes[index], 'General'), float(probabilities[row, index]))
+            for row, index in enumerate(best)
+        ]
+
+    def save(self, path: str):
+        artifact = {
+            'format_version': MODEL_FORMAT_VERSION,
+            'n_features': self.n_features,
+            'ngram_range': self.ngram_range,
+            'C': self.C,
+            'classifier': self.classifier,
+            'subcategories': self.subcategories,
+            'metadata': self.metadata
+        }
+        temp_path = f"{path}.tmp"
+        joblib.dump(artifact, temp_path, compress=3)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CategoryModel':
+        artifact = joblib.load(path)
+        if artifact.get('format_version') != MODEL_FORMAT_VERSION:
+            raise ValueError(f"Unsupported category model format: {artifact.get('format_version')}")
+
+        model = cls(n_features=artifact['n_features'], ngram_range=artifact['ngram_range'], C=artifact['C'])
+        model.classifier = artifact['classifier']
+        model.subcategories = artifact['subcategories']
+        model.metadata = artifact.get('metadata', {})
+        return model
+
+
+def load_category_model(path: Optional[str] = None) -> Optional[CategoryModel]:
+    """The trained model at CATEGORY_MODEL_PATH, or None when there is none"""
+    if path is None:
+        path = os.getenv("CATEGORY_MODEL_PATH", DEFAULT_MODEL_PATH)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        model = CategoryModel.load(path)
+    except Exception as e:
+        print(f"WARNING - Could not load category model {path}: {e}")
+        return None
+
+    print(f"DEBUG - Loaded category model {path} ({model.metadata.get('training_rows', '?')} training rows)")
+    return model
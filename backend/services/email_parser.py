@@ -8,6 +8,8 @@ from fastapi import UploadFile, HTTPException
 import dateparser
 from datetime import datetime
 
+from services.keyword_matcher import KeywordMatcher
+
 class EmailParser:
     def __init__(self):
         self.credit_card_patterns = {
@@ -36,11 +38,14 @@ class EmailParser:
                 r'credit limit'
             ]
         }
+        self.email_type_matcher = KeywordMatcher.from_table(self.credit_card_patterns, patterns=True)
     
     async def parse_email(self, file: UploadFile) -> Dict:
+        content = await file.read()
+        return self.parse_email_bytes(content)
+    
+    def parse_email_bytes(self, content) -> Dict:
         try:
-            content = await file.read()
-            
             if isinstance(content, bytes):
                 content = content.decode('utf-8', errors='ignore')
             
@@ -121,13 +126,7 @@ class EmailParser:
     
     def classify_email_type(self, subject: str, body: str) -> str:
         text_to_check = (subject + " " + body).lower()
-        
-        for email_type, patterns in self.credit_card_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, text_to_check):
-                    return email_type
-        
-        return 'unknown'
+        return self.email_type_matcher.first_label(text_to_check) or 'unknown'
     
     def extract_financial_info(self, body: str) -> Dict:
         info = {}
@@ -0,0 +1,148 @@
+import os
+import hashlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import Transaction
+from services.transaction_deduplicator import TransactionDeduplicator, DuplicateBlockingIndex
+from services.merchant_memo import normalize_merchant
+
+# Amounts per query, below SQLite's variable limit
+LOOKUP_CHUNK_SIZE = 500
+
+DATE_FORMAT = '%d-%m-%Y'
+
+DEFAULT_CURRENCY = os.getenv("DEFAULT_CURRENCY", "AED")
+
+
+def _amount(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def transaction_fingerprint(customer_id: int, date, amount, currency: Optional[str], merchant: Optional[str]) -> str:
+    """
+    Content hash of a transaction: customer, day, amount, currency and
+    normalized merchant. Exact duplicates share it, whatever the time of
+    day or the merchant's store number and location suffix.
+    """
+    if isinstance(date, str):
+        try:
+            date = datetime.strptime(date, DATE_FORMAT)
+        except ValueError:
+            pass
+    day = date.strftime('%Y-%m-%d') if isinstance(date, datetime) else (date or '')
+    amount = _amount(amount)
+    amount = f"{amount:.2f}" if isinstance(amount, float) else ''
+    key = '|'.join([str(customer_id), day, amount, (currency or DEFAULT_CURRENCY).upper(), normalize_merchant(merchant)])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class IncrementalDeduplicator:
+    """
+    Deduplicates an incoming batch within itself and against the customer's
+    stored transactions. Only the stored rows that could match -- the batch's
+    amounts, dated within the widest duplicate window of the batch's dates --
+    are loaded, with one query per chunk of amounts, and the whole batch is
+    checked against them in memory with the TransactionDeduplicator rules.
+    """
+
+    def __init__(self, deduplicator: Optional[TransactionDeduplicator] = None,
+                 default_currency: Optional[str] = None):
+        self.deduplicator = deduplicator or TransactionDeduplicator()
+        # The transactions table has no currency column
+        self.default_currency = default_currency or DEFAULT_CURRENCY
+
+    def comparable(self, transaction: Dict[str, Any], default_date: datetime) -> Dict[str, Any]:
+        """The fields the duplicate rules look at, in the shape of a parsed statement row"""
+        date = transaction.get('date') or default_date
+        if isinstance(date, datetime):
+            date = date.strftime(DATE_FORMAT)
+        return {
+            'date': date,
+            'amount': _amount(transaction.get('amount')),
+            'currency': transaction.get('currency') or self.default_currency,
+            'merchant': transaction.get('merchant'),
+            'raw_text': transaction.get('raw_text'),
+            'transaction_block': transaction.get('transaction_block')
+        }
+
+    def load_stored(self, db: Session, customer_id: int, incoming: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Stored transactions sharing an amount with the batch, within its date window"""
+        amounts = sorted({t['amount'] for t in incoming if isinstance(t['amount'], float)})
+        if not amounts:
+            return []
+
+        days = []
+        for t in incoming:
+            try:
+                days.append(datetime.strptime(t['date'], DATE_FORMAT))
+            except (TypeError, ValueError):
+                # A date the rules cannot place leaves the window open
+                days = None
+                break
+
+        query = select(
+            Transaction.id, Transaction.date, Transaction.amount, Transaction.merchant, Transaction.raw_text
+        ).where(Transaction.customer_id == customer_id)
+        if days:
+            window = timedelta(days=DuplicateBlockingIndex.MAX_DATE_WINDOW_DAYS)
+            query = query.where(
+                Transaction.date >= min(days) - window,
+                Transaction.date < max(days) + window + timedelta(days=1)
+            )
+
+        stored = []
+        for start in range(0, len(amounts), LOOKUP_CHUNK_SIZE):
+            chunk = amounts[start:start + LOOKUP_CHUNK_SIZE]
+            for row in db.execute(query.where(Transaction.amount.in_(chunk))):
+                stored.append({
+                    'id': row.id,
+                    'date': row.date.strftime(DATE_FORMAT) if row.date else None,
+                    'amount': _amount(row.amount),
+                    'currency': self.default_currency,
+                    'merchant': row.merchant,
+                    'raw_text': row.raw_text,
+                    'transaction_block': None
+                })
+        return stored
+
+    def deduplicate(self, db: Session, customer_id: int, transactions: List[Dict[str, Any]],
+                    default_date: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Split a batch into the transactions to save and the duplicates. Rows
+        without a date are compared as if dated default_date (now), the date
+        they are saved with. Pending rows in the session are flushed first so
+        earlier batches of the same transaction count as stored.
+        """
+        default_date = default_date or datetime.now()
+        incoming = [self.comparable(t, default_date) for t in transactions]
+
+        batch_result = self.deduplicator.deduplicate_transactions(incoming)
+        removed = {i for group in batch_result['duplicate_groups'] for i in group['transaction_indices'][1:]}
+        kept = [i for i in range(len(transactions)) if i not in removed]
+
+        db.flush()
+        stored = self.load_stored(db, customer_id, [incoming[i] for i in kept])
+
+        already_stored = set()
+        if stored:
+            rows = [incoming[i] for i in kept] + stored
+            index = DuplicateBlockingIndex(rows, self.deduplicator._normalize_merchant_name)
+            for position in range(len(kept)):
+                if any(j >= len(kept) and index.matches(position, j) for j in index.candidates(position)):
+                    already_stored.add(kept[position])
+
+        return {
+            'new_transactions': [transactions[i] for i in kept if i not in already_stored],
+            'original_count': len(transactions),
+            'duplicates_removed': len(removed),
+            'already_stored': len(already_stored),
+            'stored_rows_checked': len(stored),
+            'batch_result': batch_result
+        }
@@ -0,0 +1,501 @@
+import os
+import json
+import uuid
+import shutil
+import sqlite3
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+from fastapi import HTTPException
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine
+from models import Customer, IngestionJob
+from services.pdf_parser import PDFParser
+from services.email_parser import EmailParser
+from services.password_store import PasswordStore
+from services.parse_cache import ParseCache
+from services.statement_ingestion import StatementIngestionService
+from services.pdf_source import SpooledUpload
+from services.registry import ServiceRegistry
+from services.categorizer import TransactionCategorizer
+from services.merchant_memo import MerchantCategoryMemo
+from services.category_model import load_category_model
+from services.recurring_detector import RecurringChargeDetector
+from services.anomaly_model_store import AnomalyModelStore
+from services.baseline_store import OnlineBaselineStore
+
+JOB_KINDS = ('pdf', 'eml')
+TERMINAL_STATUSES = ('succeeded', 'failed')
+
+# Per-worker services, registered by _init_worker and built on first use
+_worker_services = None
+
+
+def _init_worker():
+    global _worker_services
+    # Connections inherited from the parent must not be reused in the child
+    engine.dispose(close=False)
+
+    _worker_services = ServiceRegistry()
+    _worker_services.register('pdf_parser', lambda: PDFParser(
+        password_store=PasswordStore(), parse_cache=ParseCache()
+    ))
+    _worker_services.register('email_parser', EmailParser)
+    _worker_services.register('merchant_memo', MerchantCategoryMemo)
+    _worker_services.register('categorizer', lambda: TransactionCategorizer(
+        memo=_worker_services.get('merchant_memo'), model=load_category_model()
+    ))
+    # New rows are scored here; retraining is left to the API process
+    _worker_services.register('anomaly_models', lambda: AnomalyModelStore(training_workers=0))
+    _worker_services.register('statement_ingestion', lambda: StatementIngestionService(
+        recurring_detector=RecurringChargeDetector(),
+        anomaly_models=_worker_services.get('anomaly_models'),
+        baselines=OnlineBaselineStore()
+    ))
+
+
+def _update_job(job_id: str, **fields):
+    db = SessionLocal()
+    try:
+        fields['updated_at'] = datetime.utcnow()
+        db.query(IngestionJob).filter(IngestionJob.id == job_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _remove_spool_file(path: Optional[str]):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"WARNING - Could not remove spooled upload {path}: {e}")
+
+
+def _is_transient(error: Exception) -> bool:
+    # e.g. "database is locked" while the API or a bulk ingest holds the write lock
+    return isinstance(error, (OperationalError, sqlite3.OperationalError))
+
+
+def _retry_or_fail_job(job_id: str, attempts: int, max_attempts: int, retry_backoff: float,
+                       error: str, file_path: Optional[str]) -> str:
+    """
+    Requeue a job after a transient failure, waiting longer after each
+    attempt, or fail it for good once it is out of attempts. The spooled
+    upload is kept until then, so a retry never needs the file again.
+    """
+    if attempts < max_attempts:
+        delay = retry_backoff * 2 ** max(0, attempts - 1)
+        _update_job(job_id, status='queued', stage='queued', progress=0.0, error=error,
+                    next_attempt_at=datetime.utcnow() + timedelta(seconds=delay))
+        return 'queued'
+
+    _update_job(job_id, status='failed', stage='failed', error=error, finished_at=datetime.utcnow())
+    _remove_spool_file(file_path)
+    return 'failed'
+
+
+def _process_job(job_id: str, max_attempts: int = 1, retry_backoff: float = 0.0) -> str:
+    """Run one claimed job and return its status: succeeded, failed, or queued for a retry"""
+    db = SessionLocal()
+    job = None
+    file_path = None
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if not job or job.status != 'running':
+            return job.status if job else 'missing'
+        file_path = job.file_path
+        attempts = job.attempts
+
+        customer = db.query(Customer).filter(Customer.id == job.customer_id).first()
+        if not customer:
+            raise HTTPException(status_code=404, detail="Customer not found")
+
+        def progress(stage: str, value: float):
+            _update_job(job_id, stage=stage, progress=value)
+
+        ingestion = _worker_services.get('statement_ingestion')
+        progress('parsing', 0.1)
+
+        if job.kind == 'pdf':
+            pdf_parser = _worker_services.get('pdf_parser')
+            parsed_data = pdf_parser.parse_pdf_source(file_path, customer, cache_key=job.content_sha256)
+            result = ingestion.save_pdf_statement(db, job.customer_id, parsed_data, progress=progress, commit=False)
+        else:
+            with open(file_path, 'rb') as f:
+                parsed_email = _worker_services.get('email_parser').parse_email_bytes(f.read())
+            progress('categorizing', 0.4)
+            transactions = ingestion.extract_email_transactions(parsed_email, _worker_services.get('categorizer'))
+            progress('saving', 0.8)
+            saved = ingestion.save_categorized_transactions(db, job.customer_id, transactions, commit=False)
+            result = {"message": f"Processed {saved} transactions", "transactions_processed": saved}
+
+        # The saved transactions and the succeeded status land in one commit, so
+        # a job that is re-run after a crash never inserts its rows twice
+        now = datetime.utcnow()
+        job.status = 'succeeded'
+        job.stage = 'done'
+        job.progress = 1.0
+        job.result = json.dumps(result, default=str)
+        job.error = None
+        job.finished_at = now
+        job.updated_at = now
+        db.commit()
+
+        _remove_spool_file(file_path)
+        return 'succeeded'
+    except Exception as e:
+        db.rollback()
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        if _is_transient(e):
+            if job is None:
+                # Not even the job could be read: the dispatcher retries it like a crashed one
+                raise
+            print(f"WARNING - Ingestion job {job_id} hit a transient error on attempt {attempts}: {error}")
+            return _retry_or_fail_job(job_id, attempts, max_attempts, retry_backoff, error, file_path)
+
+        print(f"WARNING - Ingestion job {job_id} failed: {error}")
+        _update_job(job_id, status='failed', stage='failed', error=error, finished_at=datetime.utcnow())
+        _remove_spool_file(file_path)
+        return 'failed'
+    finally:
+        db.close()
+
+
+class IngestionJobQueue:
+    """
+    Durable queue for statement ingestion. Submitted PDF/EML files are spooled
+    to disk and recorded in the ingestion_jobs table; a dispatcher thread claims
+    queued jobs and runs them in a local process pool. Jobs left running by a
+    crash or restart are requeued on start, and resubmitting the same file for
+    the same customer returns the existing job instead of creating a new one.
+    A job that hits a transient database error, or whose worker dies, is
+    retried with exponential backoff up to max_attempts times.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, spool_dir: Optional[str] = None,
+                 max_attempts: Optional[int] = None, retry_backoff: Optional[float] = None,
+                 poll_interval: float = 0.5, session_factory=SessionLocal):
+        if max_workers is None:
+            max_workers = int(os.getenv("INGESTION_WORKERS", 0)) or min(2, os.cpu_count() or 1)
+        if spool_dir is None:
+            spool_dir = os.getenv("INGESTION_SPOOL_DIR", "./ingestion_spool")
+        if max_attempts is None:
+            max_attempts = int(os.getenv("INGESTION_MAX_ATTEMPTS", 3))
+        if retry_backoff is None:
+            # Seconds before the first retry, doubled for each later one
+            retry_backoff = float(os.getenv("INGESTION_RETRY_BACKOFF", 2.0))
+
+        self.max_workers = max(1, max_workers)
+        self.spool_dir = spool_dir
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = max(0.0, retry_backoff)
+        self.poll_interval = poll_interval
+        self.session_factory = session_factory
+
+        self._executor = None
+        self._dispatcher = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._in_flight = 0
+
+        self.dispatched = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.requeued = 0
+
+    def start(self):
+        if self._dispatcher is not None:
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._recover()
+        self._stopping.clear()
+        self._executor = self._create_executor()
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="ingestion-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join(timeout=5)
+            self._dispatcher = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, db: Session, customer_id: int, kind: str, upload: SpooledUpload) -> IngestionJob:
+        """Queue a spooled upload for ingestion, returning the existing job for a repeated upload"""
+        if kind not in JOB_KINDS:
+            raise HTTPException(status_code=400, detail=f"Unsupported job kind: {kind}")
+
+        content_sha256 = upload.sha256
+        filename = upload.filename
+        job = self._find_job(db, customer_id, kind, content_sha256)
+        if job is not None and job.status != 'failed':
+            return job
+
+        file_path = self._spool(customer_id, kind, upload)
+        now = datetime.utcnow()
+
+        if job is not None:
+            # Retrying a failed upload restarts the same job
+            job.status = 'queued'
+            job.stage = 'queued'
+            job.progress = 0.0
+            job.attempts = 0
+            job.next_attempt_at = None
+            job.error = None
+            job.result = None
+            job.filename = filename
+            job.file_path = file_path
+            job.started_at = None
+            job.finished_at = None
+            job.updated_at = now
+            db.commit()
+        else:
+            job = IngestionJob(
+                id=uuid.uuid4().hex,
+                customer_id=customer_id,
+                kind=kind,
+                filename=filename,
+                content_sha256=content_sha256,
+                file_path=file_path,
+                status='queued',
+                stage='queued',
+                progress=0.0,
+                attempts=0,
+                created_at=now,
+                updated_at=now
+            )
+            db.add(job)
+            try:
+                db.commit()
+            except IntegrityError:
+                # A concurrent request queued the same file first
+                db.rollback()
+                return self._find_job(db, customer_id, kind, content_sha256)
+
+        self._wakeup.set()
+        return job
+
+    def get(self, db: Session, job_id: str) -> IngestionJob:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+    @staticmethod
+    def to_dict(job: IngestionJob) -> Dict:
+        return {
+            'job_id': job.id,
+            'customer_id': job.customer_id,
+            'kind': job.kind,
+            'filename': job.filename,
+            'status': job.status,
+            'stage': job.stage,
+            'progress': job.progress,
+            'attempts': job.attempts,
+            'next_attempt_at': job.next_attempt_at.isoformat() if job.next_attempt_at else None,
+            'result': json.loads(job.result) if job.result else None,
+            'error': job.error,
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'started_at': job.started_at.isoformat() if job.started_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None
+        }
+
+    async def events(self, job_id: str, interval: float = 0.5):
+        """Server-sent events with the job state on every change, ending once it finishes"""
+        last_state = None
+        while True:
+            db = self.session_factory()
+            try:
+                job = self.to_dict(self.get(db, job_id))
+            finally:
+                db.close()
+
+            state = (job['status'], job['stage'], job['progress'])
+            if state != last_state:
+                last_state = state
+                yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+
+            if job['status'] in TERMINAL_STATUSES:
+                break
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict:
+        db = self.session_factory()
+        try:
+            counts = {status: 0 for status in ('queued', 'running') + TERMINAL_STATUSES}
+            for status, in db.query(IngestionJob.status).all():
+                counts[status] = counts.get(status, 0) + 1
+        finally:
+            db.close()
+
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'in_flight': self._in_flight,
+                'dispatched': self.dispatched,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'requeued': self.requeued,
+                'jobs': counts
+            }
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+
+    def _find_job(self, db: Session, customer_id: int, kind: str, content_sha256: str) -> Optional[IngestionJob]:
+        return db.query(IngestionJob).filter(
+            IngestionJob.customer_id == customer_id,
+            IngestionJob.kind == kind,
+            IngestionJob.content_sha256 == content_sha256
+        ).first()
+
+    def _spool(self, customer_id: int, kind: str, upload: SpooledUpload) -> str:
+        """Move the uploaded file into the spool directory, where the worker reads it"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.abspath(os.path.join(self.spool_dir, f"{customer_id}-{upload.sha256}.{kind}"))
+        # Once moved, closing the upload no longer deletes anything
+        shutil.move(upload.path, path)
+        return path
+
+    def _recover(self):
+        db = self.session_factory()
+        try:
+            recovered = db.query(IngestionJob).filter(IngestionJob.status == 'running').update({
+                'status': 'queued', 'stage': 'queued', 'updated_at': datetime.utcnow()
+            })
+            db.commit()
+            if recovered:
+                print(f"DEBUG - Requeued {recovered} interrupted ingestion jobs")
+        finally:
+            db.close()
+
+    def _claim_next(self) -> Optional[str]:
+        """Atomically move the oldest queued job that is not backing off to running"""
+        db = self.session_factory()
+        try:
+            while True:
+                now = datetime.utcnow()
+                row = db.query(IngestionJob.id).filter(
+                    IngestionJob.status == 'queued',
+                    or_(IngestionJob.next_attempt_at.is_(None), IngestionJob.next_attempt_at <= now)
+                ).order_by(IngestionJob.created_at).first()
+                if row is None:
+                    return None
+
+                claimed = db.query(IngestionJob).filter(
+                    IngestionJob.id == row.id,
+                    IngestionJob.status == 'queued'
+                ).update({
+                    'status': 'running',
+                    'stage': 'starting',
+                    'attempts': IngestionJob.attempts + 1,
+                    'next_attempt_at': None,
+                    'started_at': now,
+                    'updated_at': now
+                }, synchronize_session=False)
+                db.commit()
+                if claimed:
+                    return row.id
+        finally:
+            db.close()
+
+    def _dispatch_loop(self):
+        while not self._stopping.is_set():
+            with self._lock:
+                has_capacity = self._in_flight < self.max_workers
+
+            job_id = None
+            if has_capacity:
+                try:
+                    job_id = self._claim_next()
+                except Exception as e:
+                    print(f"WARNING - Could not claim ingestion job: {e}")
+
+            if job_id is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                future = self._executor.submit(_process_job, job_id, self.max_attempts, self.retry_backoff)
+            except (BrokenProcessPool, RuntimeError) as e:
+                print(f"WARNING - Ingestion pool unavailable, restarting it: {e}")
+                self._requeue(job_id, count_attempt=False)
+                self._restart_executor()
+                continue
+
+            with self._lock:
+                self._in_flight += 1
+                self.dispatched += 1
+            future.add_done_callback(lambda f, job_id=job_id: self._on_done(job_id, f))
+
+    def _on_done(self, job_id: str, future):
+        with self._lock:
+            self._in_flight -= 1
+
+        if future.cancelled():
+            self._requeue(job_id, count_attempt=False)
+        else:
+            error = future.exception()
+            if error is None:
+                status = future.result()
+                with self._lock:
+                    if status == 'succeeded':
+                        self.succeeded += 1
+                    elif status == 'queued':
+                        self.requeued += 1
+                    else:
+                        self.failed += 1
+            else:
+                # The worker process died mid-job; nothing was committed for it
+                print(f"WARNING - Ingestion worker crashed on job {job_id}: {error}")
+                self._retry_or_fail(job_id, str(error))
+                if isinstance(error, BrokenProcessPool) and not self._stopping.is_set():
+                    self._restart_executor()
+
+        self._wakeup.set()
+
+    def _retry_or_fail(self, job_id: str, error: str):
+        db = self.session_factory()
+        try:
+            job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+            attempts = job.attempts if job else self.max_attempts
+            file_path = job.file_path if job else None
+        finally:
+            db.close()
+
+        status = _retry_or_fail_job(job_id, attempts, self.max_attempts, self.retry_backoff, error, file_path)
+        with self._lock:
+            if status == 'queued':
+                self.requeued += 1
+            else:
+                self.failed += 1
+
+    def _requeue(self, job_id: str, count_attempt: bool):
+        fields = {'status': 'queued', 'stage': 'queued', 'progress': 0.0}
+        if not count_attempt:
+            fields['attempts'] = IngestionJob.attempts - 1
+        _update_job(job_id, **fields)
+        with self._lock:
+            self.requeued += 1
+
+    def _restart_executor(self):
+        with self._lock:
+            old_executor = self._executor
+            self._executor = self._create_executor()
+        if old_executor is not None:
+            old_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,169 @@
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+# Characters that make a table entry a real regular expression rather than a literal
+_REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+
+
+def literal_from_pattern(pattern: str) -> Optional[str]:
+    """
+    The literal a pattern searches for, or None when it needs the regex
+    engine. Patterns written as '.*word.*' match exactly where 'word' occurs.
+    """
+    while pattern.startswith('.*'):
+        pattern = pattern[2:]
+    while pattern.endswith('.*') and not pattern.endswith('\\.*'):
+        pattern = pattern[:-2]
+    if any(char in _REGEX_METACHARACTERS for char in pattern):
+        return None
+    return pattern
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over a table of labelled keywords. One pass over
+    the text finds every keyword it contains, so matching cost depends on the
+    text length and not on the size of the table. Patterns that are real
+    regular expressions are kept aside and searched individually.
+
+    hit_counts() gives, per label, the number of distinct table entries found
+    in the text - the same count as `sum(1 for k in keywords if k in text)`.
+    """
+
+    def __init__(self, ignore_case: bool = False):
+        self.ignore_case = ignore_case
+        self.labels = []
+        self._keyword_ids = {}
+        self._keyword_labels = []
+        self._regexes = []
+        self._always = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        self._built = True
+
+    @classmethod
+    def from_table(cls, table: Dict[str, Iterable[str]], ignore_case: bool = False,
+                   patterns: bool = False) -> 'KeywordMatcher':
+        """Build a matcher from {label: [keyword or pattern, ...]}, keeping the label order"""
+        matcher = cls(ignore_case=ignore_case)
+        for label, entries in table.items():
+            matcher._add_label(label)
+            for entry in entries:
+                if patterns:
+                    matcher.add_pattern(entry, label)
+                else:
+                    matcher.add_keyword(entry, label)
+        matcher.build()
+        return matcher
+
+    def _add_label(self, label: str):
+        if label not in self.labels:
+            self.labels.append(label)
+
+    def add_keyword(self, keyword: str, label: str):
+        self._add_label(label)
+        if self.ignore_case:
+            keyword = keyword.lower()
+        if not keyword:
+            # An empty keyword is contained in every text
+            self._always.append(label)
+            return
+
+        keyword_id = self._keyword_ids.get(keyword)
+        if keyword_id is None:
+            keyword_id = len(self._keyword_labels)
+            self._keyword_ids[keyword] = keyword_id
+            self._keyword_labels.append([])
+            self._insert(keyword, keyword_id)
+        # A keyword listed twice (or under two labels) counts once per listing
+        self._keyword_labels[keyword_id].append(label)
+        self._built = False
+
+    def add_pattern(self, pattern: str, label: str):
+        literal = literal_from_pattern(pattern)
+        if literal is not None:
+            self.add_keyword(literal, label)
+            return
+
+        self._add_label(label)
+        flags = re.IGNORECASE if self.ignore_case else 0
+        self._regexes.append((label, re.compile(pattern, flags)))
+
+    def _insert(self, keyword: str, keyword_id: int):
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            node = next_node
+        self._output[node] = self._output[node] + (keyword_id,)
+
+    def build(self):
+        """Compute the failure links; called once after the table is loaded"""
+        queue = deque()
+        for node in self._goto[0].values():
+            self._fail[node] = 0
+            queue.append(node)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                # Keywords ending at the fallback state also end here
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+        self._built = True
+
+    def find_keywords(self, text: str) -> set:
+        """Ids of the distinct keywords contained in the text"""
+        if not self._built:
+            self.build()
+        if self.ignore_case:
+            text = text.lower()
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+    def hit_counts(self, text: str) -> Dict[str, int]:
+        """Number of table entries found in the text, per label (labels without hits are omitted)"""
+        counts = {}
+        for keyword_id in self.find_keywords(text):
+            for label in self._keyword_labels[keyword_id]:
+                counts[label] = counts.get(label, 0) + 1
+        for label in self._always:
+            counts[label] = counts.get(label, 0) + 1
+        for label, regex in self._regexes:
+            if regex.search(text):
+                counts[label] = counts.get(label, 0) + 1
+        return counts
+
+    def first_label(self, text: str, order: Optional[List[str]] = None) -> Optional[str]:
+        """The first label, in table order unless given, with at least one hit"""
+        counts = self.hit_counts(text)
+        for label in order if order is not None else self.labels:
+            if counts.get(label):
+                return label
+        return None
+
+    def __len__(self) -> int:
+        return len(self._keyword_labels) + len(self._regexes) + len(self._always)
@@ -0,0 +1,328 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import CategoryRule, MerchantCategory
+from services.keyword_matcher import KeywordMatcher
+
+# Location and legal-form tokens that vary between terminals of the same merchant
+MERCHANT_NOISE_WORDS = {'dubai', 'abu', 'dhabi', 'sharjah', 'ajman', 'ae', 'uae', 'are', 'llc', 'fze', 'pos', 'com', 'www'}
+
+_NON_LETTERS = re.compile(r'[^a-z&]+')
+
+# Keys per IN (...) query and rows per upsert, well below SQLite's variable limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+def normalize_merchant(merchant: Optional[str]) -> str:
+    """'CARREFOUR #1234 DUBAI AE' -> 'carrefour'; empty when nothing is left"""
+    if not merchant:
+        return ""
+    words = _NON_LETTERS.sub(' ', merchant.lower()).split()
+    return ' '.join(word for word in words if word not in MERCHANT_NOISE_WORDS and len(word) > 1)
+
+
+class MerchantCategoryMemo:
+    """
+    Remembers the category decided for each normalized merchant, so a merchant
+    seen before skips the keyword/pattern/NLP/TF-IDF cascade. Lookups go
+    through an in-process LRU, then the category_rules table (newest matching
+    rule wins), then the persisted merchant_categories table. New decisions
+    are written through to both the LRU and the table, together with the
+    text they were decided on; the 'Other' fallback is only kept in the LRU,
+    so categories added later still reach those merchants after a restart.
+
+    The LRU is dropped whenever the rules change, including rules added by
+    another process, so rule edits take effect on the next lookup.
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_entries: Optional[int] = None):
+        if max_entries is None:
+            max_entries = int(os.getenv("MERCHANT_MEMO_SIZE", 10000))
+
+        self.session_factory = session_factory
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._rules = {}
+        self._rule_matcher = None
+        self._rules_version = None
+
+        self.hits = 0
+        self.rule_hits = 0
+        self.table_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key_for(transaction: Dict) -> str:
+        return normalize_merchant(transaction.get('merchant'))
+
+    def lookup_many(self, keys: Iterable[str]) -> Dict[str, Tuple[str, str, float]]:
+        """(category, subcategory, confidence) for every key the memo knows"""
+        keys = {key for key in keys if key}
+        if not keys:
+            return {}
+
+        self._refresh_rules()
+
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[0]
+            self.hits += len(found)
+
+        missing = [key for key in keys if key not in found]
+        from_rules = {}
+        for key in missing:
+            decision = self._match_rule(key)
+            if decision is not None:
+                from_rules[key] = decision
+
+        missing = [key for key in missing if key not in from_rules]
+        from_table = self._read_table(missing) if missing else {}
+
+        with self._lock:
+            for key, decision in from_rules.items():
+                self._insert(key, decision)
+            for key, (decision, text) in from_table.items():
+                self._insert(key, decision, text)
+            self.rule_hits += len(from_rules)
+            self.table_hits += len(from_table)
+            self.misses += len(missing) - len(from_table)
+
+        found.update(from_rules)
+        found.update({key: decision for key, (decision, _) in from_table.items()})
+        return found
+
+    def match_rules(self, keys: Iterable[str]) -> Dict[str, Tuple[str, str, float]]:
+        """The newest category rule's decision for every key a rule matches, ignoring stored decisions"""
+        self._refresh_rules()
+        found = {}
+        for key in set(keys):
+            decision = self._match_rule(key) if key else None
+            if decision is not None:
+                found[key] = decision
+        return found
+
+    def store_many(self, decisions: Dict[str, Tuple[str, str, float]], texts: Optional[Dict[str, str]] = None):
+        """
+        Write new cascade decisions through to the LRU and the persisted
+        table, with the text each was decided on. 'Other' is not persisted.
+        """
+        decisions = {key: decision for key, decision in decisions.items() if key}
+        if not decisions:
+            return
+        texts = texts or {}
+
+        with self._lock:
+            for key, decision in decisions.items():
+                self._insert(key, decision, texts.get(key))
+            self.writes += len(decisions)
+
+        now = datetime.utcnow()
+        rows = [
+            {
+                'merchant_key': key,
+                'category': category,
+                'subcategory': subcategory,
+                'confidence': float(confidence),
+                'text': texts.get(key),
+                'created_at': now,
+                'updated_at': now
+            }
+            for key, (category, subcategory, confidence) in decisions.items()
+            if category != 'Other'
+        ]
+        if not rows:
+            return
+
+        db = self.session_factory()
+        try:
+            for start in range(0, len(rows), LOOKUP_CHUNK_SIZE):
+                statement = insert(MerchantCategory).values(rows[start:start + LOOKUP_CHUNK_SIZE])
+                statement = statement.on_conflict_do_update(
+                    index_elements=['merchant_key'],
+                    set_={
+                        'category': statement.excluded.category,
+                        'subcategory': statement.excluded.subcategory,
+                        'confidence': statement.excluded.confidence,
+                        'text': statement.excluded.text,
+                        'updated_at': statement.excluded.updated_at
+                    }
+                )
+                db.execute(statement)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"WARNING - Could not persist merchant categories: {e}")
+        finally:
+            db.close()
+
+    def add_rule(self, db: Session, pattern: str, category: str, subcategory: str,
+                 confidence: float = 0.9) -> CategoryRule:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid rule pattern: {e}")
+
+        rule = CategoryRule(pattern=pattern, category=category, subcategory=subcategory, confidence=confidence)
+        db.add(rule)
+        db.commit()
+        db.refresh(rule)
+
+        self._refresh_rules(force=True)
+        return rule
+
+    def invalidate(self, persisted: bool = False):
+        """Drop the LRU, and with persisted=True also every stored decision"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+        if persisted:
+            db = self.session_factory()
+            try:
+                db.query(MerchantCategory).delete()
+                db.commit()
+            finally:
+                db.close()
+
+    def invalidate_matching(self, pattern: str) -> int:
+        """
+        Drop the decisions, cached and persisted, that a new categorizer
+        pattern matches: the pattern is tried on the text each decision was
+        made on, as the categorizer applies it, and on the merchant key.
+        Every other decision stays valid. Returns the number of persisted
+        decisions removed.
+        """
+        matcher = KeywordMatcher.from_table({'pattern': [pattern]}, ignore_case=True, patterns=True)
+
+        def matches(key, text):
+            return bool(matcher.first_label(key) or (text and matcher.first_label(text)))
+
+        with self._lock:
+            stale = [key for key, (_, text) in self._entries.items() if matches(key, text)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += 1
+
+        removed = 0
+        last_id = 0
+        db = self.session_factory()
+        try:
+            while True:
+                rows = (
+                    db.query(MerchantCategory.id, MerchantCategory.merchant_key, MerchantCategory.text)
+                    .filter(MerchantCategory.id > last_id)
+                    .order_by(MerchantCategory.id)
+                    .limit(LOOKUP_CHUNK_SIZE)
+                    .all()
+                )
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                ids = [row.id for row in rows if matches(row.merchant_key or '', row.text)]
+                if ids:
+                    removed += (
+                        db.query(MerchantCategory)
+                        .filter(MerchantCategory.id.in_(ids))
+                        .delete(synchronize_session=False)
+                    )
+            db.commit()
+        finally:
+            db.close()
+        return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            served = self.hits + self.rule_hits + self.table_hits
+            lookups = served + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'rules': len(self._rules),
+                'hits': self.hits,
+                'rule_hits': self.rule_hits,
+                'table_hits': self.table_hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'invalidations': self.invalidations,
+                'hit_rate': served / lookups if lookups else 0.0,
+                'lru_hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def _refresh_rules(self, force: bool = False):
+        db = self.session_factory()
+        try:
+            version = db.query(func.count(CategoryRule.id), func.max(CategoryRule.id)).one()
+            version = tuple(version)
+            if not force and version == self._rules_version:
+                return
+            rules = db.query(CategoryRule).order_by(CategoryRule.id.desc()).all()
+        finally:
+            db.close()
+
+        rule_table = {}
+        decisions = {}
+        for rule in rules:
+            if not rule.pattern or not rule.category:
+                continue
+            try:
+                re.compile(rule.pattern)
+            except re.error as e:
+                print(f"WARNING - Skipping category rule {rule.id}: {e}")
+                continue
+            label = str(rule.id)
+            rule_table[label] = [rule.pattern]
+            confidence = rule.confidence if rule.confidence is not None else 0.9
+            decisions[label] = (rule.category, rule.subcategory or 'General', confidence)
+
+        with self._lock:
+            if self._rules_version is not None:
+                self._entries.clear()
+                self.invalidations += 1
+            self._rules = decisions
+            self._rule_matcher = KeywordMatcher.from_table(rule_table, ignore_case=True, patterns=True)
+            self._rules_version = version
+
+    def _match_rule(self, key: str) -> Optional[Tuple[str, str, float]]:
+        if not self._rules:
+            return None
+        label = self._rule_matcher.first_label(key)
+        return self._rules.get(label) if label else None
+
+    def _read_table(self, keys) -> Dict[str, Tuple[Tuple[str, str, float], Optional[str]]]:
+        """(decision, text) of every key stored in the table"""
+        found = {}
+        db = self.session_factory()
+        try:
+            for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+                chunk = keys[start:start + LOOKUP_CHUNK_SIZE]
+                rows = db.query(MerchantCategory).filter(MerchantCategory.merchant_key.in_(chunk)).all()
+                for row in rows:
+                    found[row.merchant_key] = ((row.category, row.subcategory, row.confidence), row.text)
+        finally:
+            db.close()
+        return found
+
+    def _insert(self, key: str, decision: Tuple[str, str, float], text: Optional[str] = None):
+        # Caller holds the lock
+        self._entries[key] = (decision, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,194 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import fitz
+import numpy as np
+import pytesseract
+from PIL import Image
+
+from services.pdf_source import PDFSource, open_pdf
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+# Fast pass first; the remaining page segmentation modes are only tried on
+# pages whose fast-pass confidence is too low
+FAST_CONFIG = '--psm 6'         # Uniform block of text
+ESCALATION_CONFIGS = [
+    '--psm 4',                  # Single column of text
+    '--psm 3',                  # Fully automatic page segmentation
+    '--psm 11',                 # Sparse text
+    '--psm 12',                 # Sparse text with OSD
+]
+
+# Per-worker document, opened once by _init_worker
+_worker_doc = None
+
+
+def _layout_line(words: List[Tuple[int, int, str]]) -> str:
+    """Join one line's (left, width, word) boxes, keeping wide gaps as runs of spaces
+
+    The statement extractor splits columns on two or more spaces, so a gap is
+    converted to as many spaces as characters would fit in it.
+    """
+    words = sorted(words)
+    char_width = sum(width for _, width, _ in words) / max(sum(len(word) for _, _, word in words), 1)
+
+    line = words[0][2]
+    for (left, width, _), (next_left, _, word) in zip(words, words[1:]):
+        gap = next_left - (left + width)
+        spaces = max(1, round(gap / char_width)) if char_width > 0 else 1
+        line += ' ' * spaces + word
+    return line
+
+
+def _ocr_image(img: Image.Image, config: str) -> Tuple[str, float]:
+    """Run Tesseract once and return the text with its mean word confidence"""
+    data = pytesseract.image_to_data(img, config=config, output_type=pytesseract.Output.DICT)
+
+    lines = {}
+    confidences = []
+    for i, word in enumerate(data['text']):
+        if not word or not word.strip():
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        box = (int(data['left'][i]), int(data['width'][i])) if 'left' in data else (i, 0)
+        lines.setdefault(key, []).append(box + (word,))
+        try:
+            confidence = float(data['conf'][i])
+        except (TypeError, ValueError):
+            continue
+        if confidence >= 0:
+            confidences.append(confidence)
+
+    # Same layout as image_to_string: one line per text line, a blank line
+    # between paragraphs
+    text_lines = []
+    paragraph = None
+    for (block, par, _), words in sorted(lines.items()):
+        if paragraph is not None and (block, par) != paragraph:
+            text_lines.append('')
+        paragraph = (block, par)
+        text_lines.append(_layout_line(words))
+
+    text = '\n'.join(text_lines)
+    mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+
+    return text, mean_confidence
+
+
+def _preprocess_image(img: Image.Image) -> Optional[Image.Image]:
+    if not CV2_AVAILABLE:
+        return None
+    try:
+        img_cv = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+        gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+        thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+        return Image.fromarray(thresh)
+    except Exception:
+        # OpenCV processing failed, skip preprocessing
+        return None
+
+
+def _ocr_page(doc, page_num: int, zoom: float, confidence_threshold: float) -> Tuple[int, str, float]:
+    page = doc[page_num]
+    # Increase resolution for better OCR results
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    img = Image.open(io.BytesIO(pix.tobytes("png")))
+
+    best_text, best_confidence = "", 0.0
+    for config in [FAST_CONFIG] + ESCALATION_CONFIGS:
+        try:
+            text, confidence = _ocr_image(img, config)
+        except Exception:
+            continue
+
+        if text.strip() and (not best_text.strip() or confidence > best_confidence):
+            best_text, best_confidence = text, confidence
+
+        if best_text.strip() and best_confidence >= confidence_threshold:
+            break
+
+    if not best_text.strip():
+        processed_img = _preprocess_image(img)
+        if processed_img is not None:
+            try:
+                best_text, best_confidence = _ocr_image(processed_img, FAST_CONFIG)
+            except Exception:
+                pass
+
+    return page_num, best_text, best_confidence
+
+
+def _open_document(source: PDFSource, password: Optional[str] = None):
+    doc = open_pdf(source)
+    if password is not None and doc.needs_pass:
+        doc.authenticate(password)
+    return doc
+
+
+def _init_worker(source: PDFSource, password: Optional[str]):
+    global _worker_doc
+    _worker_doc = _open_document(source, password)
+
+
+def _ocr_worker_page(page_num: int, zoom: float, confidence_threshold: float) -> Tuple[int, str, float]:
+    return _ocr_page(_worker_doc, page_num, zoom, confidence_threshold)
+
+
+class OCREngine:
+    """
+    Renders and OCRs statement pages concurrently in a process pool capped
+    by CPU count. Each page gets one fast Tesseract pass and is escalated
+    through the other page segmentation modes only when its confidence is low.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, zoom: float = 2.0,
+                 confidence_threshold: float = 60.0):
+        cpu_count = os.cpu_count() or 1
+        if max_workers is None:
+            max_workers = int(os.getenv("OCR_WORKERS", 0)) or cpu_count
+
+        self.max_workers = max(1, min(max_workers, cpu_count))
+        self.zoom = zoom
+        self.confidence_threshold = confidence_threshold
+
+    def ocr_pages(self, source: PDFSource, page_numbers: Optional[List[int]] = None,
+                  password: Optional[str] = None) -> Dict[int, Dict]:
+        """OCR the given pages (all by default) and return {page_num: {'text', 'confidence'}}"""
+        doc = _open_document(source, password)
+        try:
+            if page_numbers is None:
+                page_numbers = list(range(len(doc)))
+
+            workers = min(self.max_workers, len(page_numbers))
+            if workers <= 1:
+                results = [
+                    _ocr_page(doc, page_num, self.zoom, self.confidence_threshold)
+                    for page_num in page_numbers
+                ]
+            else:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=(source, password)) as executor:
+                    results = list(executor.map(
+                        _ocr_worker_page,
+                        page_numbers,
+                        [self.zoom] * len(page_numbers),
+                        [self.confidence_threshold] * len(page_numbers)
+                    ))
+        finally:
+            doc.close()
+
+        return {
+            page_num: {'text': text, 'confidence': confidence}
+            for page_num, text, confidence in results
+        }
+
+    def extract_text(self, source: PDFSource) -> str:
+        pages = self.ocr_pages(source)
+        return ''.join(pages[page_num]['text'] + "\n" for page_num in sorted(pages))
@@ -0,0 +1,166 @@
+import os
+import json
+import copy
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class ParseCache:
+    """
+    Content-addressed cache of extracted statement text and parse results,
+    keyed by the SHA-256 of the uploaded bytes. An in-memory LRU sits in
+    front of an optional on-disk tier (one JSON file per document).
+
+    Results that could only be extracted with a customer's password are
+    tagged with that customer, are not served to anyone else and are kept
+    in memory only: the disk tier would store the decrypted statement in
+    plaintext. Disk entries are private to the server's user and expire
+    after ttl_days.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, disk_dir: Optional[str] = None,
+                 ttl_days: Optional[float] = None):
+        if max_entries is None:
+            max_entries = int(os.getenv("PDF_PARSE_CACHE_SIZE", 128))
+        if disk_dir is None:
+            disk_dir = os.getenv("PDF_PARSE_CACHE_DIR") or None
+        if ttl_days is None:
+            ttl_days = float(os.getenv("PDF_PARSE_CACHE_TTL_DAYS", 30))
+
+        self.max_entries = max(1, max_entries)
+        self.disk_dir = disk_dir
+        self.ttl_seconds = ttl_days * 86400
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def key_for(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def get(self, key: str, customer_id: Optional[int] = None) -> Optional[Dict]:
+        """Return a private copy of the cached parse result, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        from_disk = False
+        if entry is None:
+            entry = self._read_disk(key)
+            from_disk = entry is not None
+
+        if entry is None or not self._visible_to(entry, customer_id):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            if from_disk:
+                self.disk_hits += 1
+                self._insert(key, entry)
+
+        return copy.deepcopy(entry['result'])
+
+    def put(self, key: str, text: str, result: Dict, customer_id: Optional[int] = None):
+        """Cache the extracted text and parse result for a document"""
+        entry = {
+            'text': text,
+            'result': copy.deepcopy(result),
+            'customer_id': customer_id
+        }
+
+        with self._lock:
+            self._insert(key, entry)
+
+        if customer_id is None:
+            self._write_disk(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'disk_tier': bool(self.disk_dir)
+            }
+
+    def _visible_to(self, entry: Dict, customer_id: Optional[int]) -> bool:
+        owner = entry.get('customer_id')
+        return owner is None or owner == customer_id
+
+    def _insert(self, key: str, entry: Dict):
+        # Caller holds the lock
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Dict]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                self._remove_disk(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"WARNING - Could not read parse cache entry {key}: {e}")
+            return None
+
+        if entry.get('customer_id') is not None:
+            # Written by an older version: password-protected results are not kept on disk
+            self._remove_disk(path)
+            return None
+        return entry
+
+    def _remove_disk(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"WARNING - Could not remove parse cache entry {path}: {e}")
+
+    def _write_disk(self, key: str, entry: Dict):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            # Statement text and transactions: readable by the server's user only
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(temp_path, path)
+        except Exception as e:
+            print(f"WARNING - Could not write parse cache entry {key}: {e}")
@@ -0,0 +1,113 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from fastapi import HTTPException
+
+
+class ParseExecutor:
+    """
+    Bounded executor for CPU-bound document parsing. Work submitted from an
+    async endpoint runs on a dedicated thread pool (which in turn fans out to
+    the OCR and password-search process pools), so the event loop stays free
+    for cheap requests. When every worker is busy and the queue is full, new
+    work is rejected with a 503 instead of piling up. Work whose request is
+    cancelled while it is still queued is dropped without running.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue: Optional[int] = None):
+        if max_workers is None:
+            max_workers = int(os.getenv("PARSE_WORKERS", 0)) or min(4, os.cpu_count() or 1)
+        if max_queue is None:
+            max_queue = int(os.getenv("PARSE_QUEUE_SIZE", 16))
+
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="parse")
+        self._lock = threading.Lock()
+
+        self.queued = 0
+        self.running = 0
+        self.peak_queue_depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Run func(*args, **kwargs) on the parse pool and await its result"""
+        with self._lock:
+            if self.queued + self.running >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Document parsing queue is full, please retry shortly"
+                )
+            self.queued += 1
+            self.submitted += 1
+            self.peak_queue_depth = max(self.peak_queue_depth, self.queued)
+
+        enqueued_at = time.monotonic()
+        # 'started' is set by the worker, 'abandoned' by a request cancelled first
+        state = {'started': False, 'abandoned': False}
+
+        def task():
+            started_at = time.monotonic()
+            with self._lock:
+                if state['abandoned']:
+                    return None
+                state['started'] = True
+                self.queued -= 1
+                self.running += 1
+                self.total_wait_seconds += started_at - enqueued_at
+
+            succeeded = False
+            try:
+                result = func(*args, **kwargs)
+                succeeded = True
+                return result
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.total_run_seconds += time.monotonic() - started_at
+                    if succeeded:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, task)
+        finally:
+            with self._lock:
+                # Cancelled before a worker picked it up: the task never leaves the queue itself
+                if not state['started'] and not state['abandoned']:
+                    state['abandoned'] = True
+                    self.queued -= 1
+                    self.cancelled += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'running': self.running,
+                'queue_depth': self.queued,
+                'peak_queue_depth': self.peak_queue_depth,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'cancelled': self.cancelled,
+                'avg_wait_seconds': self.total_wait_seconds / finished if finished else 0.0,
+                'avg_run_seconds': self.total_run_seconds / finished if finished else 0.0
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,170 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Optional
+
+import pikepdf
+
+from services.pdf_source import PDFSource, open_pdf, open_pikepdf
+
+# Per-worker state, populated once by _init_worker so that the PDF (and its
+# encryption dictionary) is parsed a single time per process instead of once
+# per password attempt.
+_worker_doc = None
+_worker_cancel = None
+
+
+class _EncryptedDocument:
+    """An encrypted PDF opened once and probed repeatedly with passwords."""
+
+    def __init__(self, source: PDFSource):
+        self.source = source
+        self.doc = None
+        try:
+            self.doc = open_pdf(source)
+        except Exception as e:
+            print(f"WARNING - PyMuPDF could not open encrypted PDF, falling back to pikepdf: {e}")
+
+        if self.doc is not None:
+            self.needs_pass = bool(self.doc.needs_pass)
+        else:
+            self.needs_pass = not self._pikepdf_opens("")
+
+    def _pikepdf_opens(self, password: str) -> bool:
+        try:
+            with open_pikepdf(self.source, password=password):
+                return True
+        except pikepdf.PasswordError:
+            return False
+        except Exception:
+            return False
+
+    def try_password(self, password: str) -> bool:
+        # authenticate() also succeeds on documents without a user password,
+        # so no candidate counts as correct for them
+        if not self.needs_pass:
+            return False
+
+        if self.doc is not None:
+            # authenticate() re-uses the already parsed encryption dictionary
+            return bool(self.doc.authenticate(password))
+
+        return self._pikepdf_opens(password)
+
+    def close(self):
+        if self.doc is not None:
+            self.doc.close()
+            self.doc = None
+
+
+def _search_candidates(document: _EncryptedDocument, candidates: List[str],
+                       deadline: Optional[float], cancel_event=None) -> Optional[str]:
+    if not document.needs_pass:
+        return None
+
+    for password in candidates:
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        if deadline is not None and time.time() > deadline:
+            return None
+        if document.try_password(password):
+            if cancel_event is not None:
+                cancel_event.set()
+            return password
+    return None
+
+
+def _init_worker(source: PDFSource, cancel_event):
+    global _worker_doc, _worker_cancel
+    _worker_doc = _EncryptedDocument(source)
+    _worker_cancel = cancel_event
+
+
+def _search_chunk(candidates: List[str], deadline: Optional[float]) -> Optional[str]:
+    return _search_candidates(_worker_doc, candidates, deadline, _worker_cancel)
+
+
+class PasswordSearchEngine:
+    """
+    Finds the password of an encrypted statement by splitting the candidate
+    list across a process pool. Each worker parses the PDF once, the first
+    worker to succeed cancels the rest, and the whole search is bounded by a
+    time budget.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, time_budget: Optional[float] = None,
+                 chunk_size: int = 8, parallel_threshold: int = 24):
+        if max_workers is None:
+            max_workers = int(os.getenv("PDF_PASSWORD_WORKERS", 0)) or (os.cpu_count() or 1)
+        if time_budget is None:
+            time_budget = float(os.getenv("PDF_PASSWORD_TIME_BUDGET", 10.0))
+
+        self.max_workers = max(1, max_workers)
+        self.time_budget = time_budget
+        self.chunk_size = max(1, chunk_size)
+        self.parallel_threshold = parallel_threshold
+
+    def search(self, source: PDFSource, candidates: List[str]) -> Optional[str]:
+        """Return the first candidate that unlocks the PDF, or None when none does or it is not encrypted"""
+        if not candidates:
+            return None
+
+        deadline = time.time() + self.time_budget if self.time_budget else None
+
+        if self.max_workers == 1 or len(candidates) < self.parallel_threshold:
+            return self._search_serial(source, candidates, deadline)
+
+        return self._search_parallel(source, candidates, deadline)
+
+    def _search_serial(self, source: PDFSource, candidates: List[str],
+                       deadline: Optional[float]) -> Optional[str]:
+        document = _EncryptedDocument(source)
+        try:
+            return _search_candidates(document, candidates, deadline)
+        finally:
+            document.close()
+
+    def _search_parallel(self, source: PDFSource, candidates: List[str],
+                         deadline: Optional[float]) -> Optional[str]:
+        # Keep candidate order meaningful: chunk i holds candidates in priority
+        # order, so the most likely passwords are tried first by every worker.
+        chunks = [
+            candidates[i:i + self.chunk_size]
+            for i in range(0, len(candidates), self.chunk_size)
+        ]
+        workers = min(self.max_workers, len(chunks))
+
+        cancel_event = multiprocessing.Event()
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(source, cancel_event)
+        )
+
+        found = None
+        try:
+            pending = {executor.submit(_search_chunk, chunk, deadline) for chunk in chunks}
+
+            while pending and found is None:
+                timeout = max(deadline - time.time(), 0) if deadline is not None else None
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                if not done:
+                    print("DEBUG - Password search time budget exhausted")
+                    break
+
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"WARNING - Password search worker failed: {e}")
+                        continue
+                    if result is not None:
+                        found = result
+                        break
+        finally:
+            cancel_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return found
@@ -0,0 +1,202 @@
+import os
+import hashlib
+import tempfile
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from database import SessionLocal
+from models import LearnedPassword, PasswordTemplateStat
+from services.pdf_source import PDFSource, open_pdf
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    CRYPTOGRAPHY_AVAILABLE = True
+except ImportError:
+    CRYPTOGRAPHY_AVAILABLE = False
+
+LEARNED_TEMPLATE = 'learned'
+
+
+def issuer_fingerprint(source: PDFSource) -> Optional[str]:
+    """
+    Fingerprint the issuer of an encrypted statement from its encryption
+    dictionary, which is readable before the password is known. Statements
+    from the same bank share these parameters month after month.
+    """
+    try:
+        doc = open_pdf(source)
+    except Exception:
+        return None
+
+    try:
+        metadata = doc.metadata or {}
+        parts = [metadata.get('format') or '', metadata.get('encryption') or '']
+        encrypt_ref = doc.xref_get_key(-1, "Encrypt")
+        if encrypt_ref[0] == 'xref':
+            encrypt_xref = int(encrypt_ref[1].split()[0])
+            for key in ['Filter', 'SubFilter', 'V', 'R', 'Length', 'P', 'CF/StdCF/CFM']:
+                parts.append(f"{key}={doc.xref_get_key(encrypt_xref, key)[1]}")
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:32]
+    except Exception as e:
+        print(f"WARNING - Could not fingerprint PDF issuer: {e}")
+        return None
+    finally:
+        doc.close()
+
+
+class PasswordStore:
+    """
+    Remembers which password (encrypted at rest) and which candidate template
+    unlocked a customer's last statement per issuer, plus global success
+    counts per template, so repeat uploads unlock on the first attempt.
+    """
+
+    def __init__(self, session_factory=SessionLocal, key: Optional[bytes] = None):
+        self.session_factory = session_factory
+        self.cipher = self._load_cipher(key)
+
+    def _load_cipher(self, key: Optional[bytes]):
+        if not CRYPTOGRAPHY_AVAILABLE:
+            print("WARNING - cryptography not installed, only password templates will be remembered")
+            return None
+
+        if key is None:
+            key = os.getenv("PASSWORD_STORE_KEY", "").encode() or None
+
+        if key is None:
+            key = self._read_or_create_key(os.getenv("PASSWORD_STORE_KEY_FILE", ".password_store.key"))
+
+        return Fernet(key)
+
+    def _read_or_create_key(self, key_file: str) -> bytes:
+        """
+        The key in key_file, created on first use. Several workers may start
+        at once: the key is written to a private temp file and hard-linked
+        into place, which fails if another process got there first, so the
+        key file is never seen half-written and every process ends up with
+        the same key.
+        """
+        if not os.path.exists(key_file):
+            key = Fernet.generate_key()
+            # mkstemp creates the file readable by its owner only
+            fd, temp_path = tempfile.mkstemp(prefix=f"{os.path.basename(key_file)}.",
+                                             dir=os.path.dirname(key_file) or '.')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(key)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.link(temp_path, key_file)
+                return key
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(temp_path)
+
+        with open(key_file, 'rb') as f:
+            return f.read().strip()
+
+    def _encrypt(self, password: str) -> Optional[str]:
+        if self.cipher is None:
+            return None
+        return self.cipher.encrypt(password.encode('utf-8')).decode('ascii')
+
+    def _decrypt(self, token: Optional[str]) -> Optional[str]:
+        if self.cipher is None or not token:
+            return None
+        try:
+            return self.cipher.decrypt(token.encode('ascii')).decode('utf-8')
+        except InvalidToken:
+            print("WARNING - Stored password could not be decrypted with the current key")
+            return None
+
+    def rank_candidates(self, templated: List[Tuple[str, str]], customer_id: Optional[int],
+                        fingerprint: Optional[str]) -> List[Tuple[str, str]]:
+        """
+        Order (template, password) pairs: the learned password first, then
+        candidates from the learned template, then the rest by global
+        template success count (stable, so generation order breaks ties).
+        """
+        try:
+            db = self.session_factory()
+            try:
+                learned = None
+                if customer_id is not None:
+                    query = db.query(LearnedPassword).filter(LearnedPassword.customer_id == customer_id)
+                    if fingerprint is not None:
+                        learned = query.filter(LearnedPassword.issuer_fingerprint == fingerprint).first()
+                    if learned is None:
+                        learned = query.order_by(LearnedPassword.updated_at.desc()).first()
+
+                stats = {row.template: row.success_count for row in db.query(PasswordTemplateStat).all()}
+            finally:
+                db.close()
+        except Exception as e:
+            print(f"WARNING - Password store unavailable: {e}")
+            return templated
+
+        learned_password = self._decrypt(learned.encrypted_password) if learned else None
+        learned_template = learned.template if learned else None
+
+        def rank(item):
+            template, candidate = item
+            if candidate == learned_password:
+                return (0, 0)
+            if template == learned_template:
+                return (1, 0)
+            return (2, -stats.get(template, 0))
+
+        ranked = sorted(templated, key=rank)
+
+        if learned_password and all(candidate != learned_password for _, candidate in ranked):
+            # The customer's details changed since, but the old password may still work
+            ranked.insert(0, (LEARNED_TEMPLATE, learned_password))
+
+        return ranked
+
+    def record_success(self, customer_id: Optional[int], fingerprint: Optional[str],
+                       template: str, password: str):
+        """Remember the password and template that unlocked a statement"""
+        if customer_id is None:
+            return
+
+        fingerprint = fingerprint or 'unknown'
+
+        try:
+            db = self.session_factory()
+            try:
+                learned = db.query(LearnedPassword).filter(
+                    LearnedPassword.customer_id == customer_id,
+                    LearnedPassword.issuer_fingerprint == fingerprint
+                ).first()
+                if learned is None:
+                    learned = LearnedPassword(
+                        customer_id=customer_id,
+                        issuer_fingerprint=fingerprint,
+                        success_count=0
+                    )
+                    db.add(learned)
+
+                # A password replayed from the store keeps the template it was learned under
+                if template != LEARNED_TEMPLATE:
+                    learned.template = template
+                learned.encrypted_password = self._encrypt(password)
+                learned.success_count = (learned.success_count or 0) + 1
+                learned.updated_at = datetime.utcnow()
+
+                if template != LEARNED_TEMPLATE:
+                    stat = db.query(PasswordTemplateStat).filter(PasswordTemplateStat.template == template).first()
+                    if stat is None:
+                        stat = PasswordTemplateStat(template=template, success_count=0)
+                        db.add(stat)
+                    stat.success_count = (stat.success_count or 0) + 1
+                    stat.updated_at = datetime.utcnow()
+
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+        except Exception as e:
+            print(f"WARNING - Could not record learned password: {e}")
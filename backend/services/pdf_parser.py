@@ -1,33 +1,51 @@
-import fitz
-import pikepdf
-import pytesseract
-from PIL import Image
 import io
 import re
 import os
 import tempfile
+import threading
 from datetime import datetime
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from fastapi import UploadFile, HTTPException
 from models import Customer
-import numpy as np
+from services.password_search import PasswordSearchEngine
+from services.password_store import PasswordStore, issuer_fingerprint
+from services.ocr_engine import OCREngine
+from services.parse_cache import ParseCache
+from services.parse_executor import ParseExecutor
+from services.statement_scanner import StatementScanner
+from services.pdf_source import PDFSource, SpooledUpload, open_pdf, open_pikepdf, source_digest
 
 # Fix OpenSSL legacy provider issue
 os.environ['OPENSSL_CONF'] = '/dev/null'
 
-try:
-    import cv2
-    CV2_AVAILABLE = True
-except ImportError:
-    CV2_AVAILABLE = False
+# The legacy-provider config is written once per process and shared by every parser
+_openssl_config_path = None
+_openssl_config_lock = threading.Lock()
 
 class PDFParser:
-    def __init__(self):
+    def __init__(self, password_store: Optional[PasswordStore] = None,
+                 parse_cache: Optional[ParseCache] = None,
+                 parse_executor: Optional[ParseExecutor] = None):
         self.password_attempts = []
+        self.password_search = PasswordSearchEngine()
+        self.password_store = password_store
+        self.parse_cache = parse_cache
+        self.parse_executor = parse_executor
+        self.ocr_engine = OCREngine()
+        self.scanner = StatementScanner()
+        # Pages with less text than this that carry images are OCR'd
+        self.min_text_layer_chars = 20
         self.setup_openssl_config()
     
     def setup_openssl_config(self):
         """Setup OpenSSL configuration to handle legacy encryption"""
+        global _openssl_config_path
+        with _openssl_config_lock:
+            if _openssl_config_path is None:
+                _openssl_config_path = self._write_openssl_config()
+        self.openssl_config_path = _openssl_config_path
+    
+    def _write_openssl_config(self) -> str:
         try:
             # Create a temporary OpenSSL config that enables legacy provider
             openssl_config = """
@@ -49,15 +67,17 @@ activate = 1
             # Write config to a temporary file
             with tempfile.NamedTemporaryFile(mode='w', suffix='.conf', delete=False) as f:
                 f.write(openssl_config)
-                self.openssl_config_path = f.name
+                config_path = f.name
             
             # Set environment variable to use our config
-            os.environ['OPENSSL_CONF'] = self.openssl_config_path
-            print(f"DEBUG - OpenSSL config set to: {self.openssl_config_path}")
+            os.environ['OPENSSL_CONF'] = config_path
+            print(f"DEBUG - OpenSSL config set to: {config_path}")
+            return config_path
         except Exception as e:
             print(f"WARNING - Could not setup OpenSSL config: {e}")
             # Fallback: disable OpenSSL config entirely
             os.environ['OPENSSL_CONF'] = '/dev/null'
+            return '/dev/null'
     
     def extract_birth_year(self, dob: str) -> Optional[str]:
         """Extract birth year from various date formats"""
@@ -111,14 +131,21 @@ activate = 1
         
         return None
     
-    def generate_password_candidates(self, customer: Customer) -> List[str]:
-        """Generate password candidates with focus on birth year + phone format"""
+    def generate_templated_password_candidates(self, customer: Customer) -> List[Tuple[str, str]]:
+        """
+        Generate (template, password) pairs with focus on birth year + phone format.
+        The template names how the password was derived from the customer's
+        details, so a scheme learned on one statement can be replayed on the next.
+        """
         candidates = []
         name_parts = customer.name.lower().split()
         full_name = ''.join(name_parts)
         phone = re.sub(r'[^\d]', '', customer.phone_number)
         dob = customer.date_of_birth
 
+        def add(template: str, candidate: str):
+            candidates.append((template, candidate))
+
         # Extract birth year properly
         birth_year = self.extract_birth_year(dob)
 
@@ -132,290 +159,287 @@ activate = 1
         # PRIORITY: Add the specific format (birth year + last 4 phone digits) first
         if birth_year and len(phone) >= 4:
             primary_password = f"{birth_year}{phone[-4:]}"
-            candidates.insert(0, primary_password)
+            add('birth_year+phone_last4', primary_password)
             print(f"DEBUG - Primary password candidate: '{primary_password}'")
-            
-            # Add encoding variations for the primary password
-            candidates.extend([
-                primary_password,
-                primary_password.encode('utf-8').decode('utf-8'),
-                primary_password.encode('latin-1').decode('latin-1', errors='ignore'),
-                str(primary_password).strip(),
-            ])
 
         # Add variations of birth year + phone combinations
         if birth_year and len(phone) >= 4:
-            candidates.extend([
-                f"{birth_year}{phone[-4:]}",
-                f"{birth_year[-2:]}{phone[-4:]}",  # 2-digit year + last 4 phone
-                f"{birth_year}{phone[-6:]}",       # year + last 6 phone digits
-                f"{birth_year}{phone[-8:]}",       # year + last 8 phone digits
-            ])
+            add('birth_year+phone_last4', f"{birth_year}{phone[-4:]}")
+            add('birth_year_2+phone_last4', f"{birth_year[-2:]}{phone[-4:]}")
+            add('birth_year+phone_last6', f"{birth_year}{phone[-6:]}")
+            add('birth_year+phone_last8', f"{birth_year}{phone[-8:]}")
 
         # Legacy date parsing for backward compatibility
         dob_digits = re.sub(r'[^\d]', '', dob)
         if len(dob_digits) >= 8:
-            # Try different interpretations of date digits
-            ddmm = dob_digits[6:8] + dob_digits[4:6]  # assuming YYYYMMDD
-            ddmmyy = dob_digits[6:8] + dob_digits[4:6] + dob_digits[2:4]
-            
             # Also try DD/MM/YYYY format
-            if len(dob_digits) == 8:
+            if len(dob_digits) == 8 and birth_year:
                 ddmm_alt = dob_digits[0:2] + dob_digits[2:4]  # assuming DDMMYYYY
                 ddmmyy_alt = dob_digits[0:2] + dob_digits[2:4] + dob_digits[6:8]
-                
-                candidates.extend([
-                    f"{birth_year}{ddmm_alt}" if birth_year else '',
-                    f"{birth_year}{ddmmyy_alt}" if birth_year else '',
-                ])
+
+                add('birth_year+dob_digits_0_4', f"{birth_year}{ddmm_alt}")
+                add('birth_year+dob_digits_0_4+dob_digits_6_8', f"{birth_year}{ddmmyy_alt}")
 
         # Name derived combinations
         if len(full_name) >= 4:
             first4 = full_name[:4]
             last4 = full_name[-4:]
-            
+
             if len(dob_digits) >= 8:
-                ddmm = dob_digits[6:8] + dob_digits[4:6] if len(dob_digits) >= 8 else ''
-                ddmmyy = dob_digits[6:8] + dob_digits[4:6] + dob_digits[2:4] if len(dob_digits) >= 8 else ''
-                
-                candidates.extend([
-                    f"{first4}{ddmmyy}",
-                    f"{first4}{ddmm}",
-                    f"{last4}{phone[-4:]}" if len(phone) >= 4 else '',
-                    f"{first4.upper()}{ddmm}",
-                    f"{first4.upper()}{ddmmyy}"
-                ])
+                # assuming YYYYMMDD
+                ddmm = dob_digits[6:8] + dob_digits[4:6]
+                ddmmyy = dob_digits[6:8] + dob_digits[4:6] + dob_digits[2:4]
+
+                add('name_first4+ddmmyy', f"{first4}{ddmmyy}")
+                add('name_first4+ddmm', f"{first4}{ddmm}")
+                if len(phone) >= 4:
+                    add('name_last4+phone_last4', f"{last4}{phone[-4:]}")
+                add('NAME_FIRST4+ddmm', f"{first4.upper()}{ddmm}")
+                add('NAME_FIRST4+ddmmyy', f"{first4.upper()}{ddmmyy}")
 
         # Card derived combinations
-        for card in customer.credit_cards:
+        for card_index, card in enumerate(customer.credit_cards):
             if hasattr(card, 'card_number_last_four'):
                 if len(dob_digits) >= 8:
                     ddmm = dob_digits[6:8] + dob_digits[4:6]
-                    candidates.append(f"{card.card_number_last_four}{ddmm}")
+                    add(f'card{card_index}_last4+ddmm', f"{card.card_number_last_four}{ddmm}")
 
         # Date format variations
         dob_formats = [
-            dob.replace('-', ''),
-            dob.replace('/', ''),
-            dob.replace('.', ''),
+            ('dob_nodash', dob.replace('-', '')),
+            ('dob_noslash', dob.replace('/', '')),
+            ('dob_nodot', dob.replace('.', '')),
         ]
-        
+
         # Add 2-digit year versions
-        for fmt in dob_formats:
+        for fmt_name, fmt in dob_formats:
             if len(fmt) >= 2:
-                candidates.extend([
-                    fmt,
-                    fmt[-2:],  # last 2 digits
-                    fmt[-4:],  # last 4 digits
-                ])
+                add(fmt_name, fmt)
+                add(f'{fmt_name}_last2', fmt[-2:])
+                add(f'{fmt_name}_last4', fmt[-4:])
 
         # Name variations
-        for name_part in name_parts:
+        for part_index, name_part in enumerate(name_parts):
             if name_part:
-                candidates.extend([
-                    name_part,
-                    name_part.capitalize(),
-                    name_part.upper(),
-                ])
+                add(f'name{part_index}', name_part)
+                add(f'Name{part_index}', name_part.capitalize())
+                add(f'NAME{part_index}', name_part.upper())
 
         # Phone variations
         if len(phone) >= 4:
-            candidates.extend([
-                phone,
-                phone[-4:],
-                phone[-6:] if len(phone) >= 6 else '',
-                phone[-8:] if len(phone) >= 8 else '',
-            ])
+            add('phone', phone)
+            add('phone_last4', phone[-4:])
+            if len(phone) >= 6:
+                add('phone_last6', phone[-6:])
+            if len(phone) >= 8:
+                add('phone_last8', phone[-8:])
 
         # Name + date combinations
-        for name_part in name_parts:
+        for part_index, name_part in enumerate(name_parts):
             if name_part:
-                for dob_format in dob_formats:
+                for fmt_name, dob_format in dob_formats:
                     if dob_format:
-                        candidates.extend([
-                            f"{name_part}{dob_format}",
-                            f"{name_part.capitalize()}{dob_format}",
-                            f"{dob_format}{name_part}",
-                            f"{name_part}{dob_format[-4:]}" if len(dob_format) >= 4 else '',
-                            f"{name_part}{dob_format[-2:]}" if len(dob_format) >= 2 else '',
-                        ])
+                        add(f'name{part_index}+{fmt_name}', f"{name_part}{dob_format}")
+                        add(f'Name{part_index}+{fmt_name}', f"{name_part.capitalize()}{dob_format}")
+                        add(f'{fmt_name}+name{part_index}', f"{dob_format}{name_part}")
+                        if len(dob_format) >= 4:
+                            add(f'name{part_index}+{fmt_name}_last4', f"{name_part}{dob_format[-4:]}")
+                        if len(dob_format) >= 2:
+                            add(f'name{part_index}+{fmt_name}_last2', f"{name_part}{dob_format[-2:]}")
 
         # Name + phone combinations
-        for name_part in name_parts:
+        for part_index, name_part in enumerate(name_parts):
             if name_part and len(phone) >= 4:
-                candidates.extend([
-                    f"{name_part}{phone[-4:]}",
-                    f"{name_part.capitalize()}{phone[-4:]}",
-                    f"{phone[-4:]}{name_part}",
-                ])
+                add(f'name{part_index}+phone_last4', f"{name_part}{phone[-4:]}")
+                add(f'Name{part_index}+phone_last4', f"{name_part.capitalize()}{phone[-4:]}")
+                add(f'phone_last4+name{part_index}', f"{phone[-4:]}{name_part}")
 
         # Additional birth year combinations
         if birth_year:
-            candidates.extend([
-                birth_year,
-                birth_year[-2:],  # 2-digit year
-            ])
-            
+            add('birth_year', birth_year)
+            add('birth_year_2', birth_year[-2:])
+
             # Birth year + name combinations
-            for name_part in name_parts:
+            for part_index, name_part in enumerate(name_parts):
                 if name_part:
-                    candidates.extend([
-                        f"{birth_year}{name_part}",
-                        f"{name_part}{birth_year}",
-                        f"{birth_year[-2:]}{name_part}",
-                        f"{name_part}{birth_year[-2:]}",
-                    ])
+                    add(f'birth_year+name{part_index}', f"{birth_year}{name_part}")
+                    add(f'name{part_index}+birth_year', f"{name_part}{birth_year}")
+                    add(f'birth_year_2+name{part_index}', f"{birth_year[-2:]}{name_part}")
+                    add(f'name{part_index}+birth_year_2', f"{name_part}{birth_year[-2:]}")
 
-        # Remove empty strings and duplicates while preserving order
-        candidates = [c for c in candidates if c and c.strip()]
-        candidates = list(dict.fromkeys(candidates))  # Remove duplicates while preserving order
+        # Remove empty strings and duplicates while preserving order; the first
+        # template to produce a password is the one credited for it
+        unique = {}
+        for template, candidate in candidates:
+            if candidate and candidate.strip() and candidate not in unique:
+                unique[candidate] = template
 
-        print(f"DEBUG - Generated {len(candidates)} total candidates")
-        print(f"DEBUG - First 10 candidates: {candidates[:10]}")
+        return [(template, candidate) for candidate, template in unique.items()]
+
+    def rank_password_candidates(self, customer: Customer,
+                                 issuer_fingerprint: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        Order templated candidates so that the password learned from this
+        customer's previous statements comes first, then the rest by global
+        template success counts.
+        """
+        templated = self.generate_templated_password_candidates(customer)
+
+        if self.password_store is not None:
+            templated = self.password_store.rank_candidates(
+                templated, getattr(customer, 'id', None), issuer_fingerprint
+            )
 
-        return candidates
+        print(f"DEBUG - Generated {len(templated)} total candidates")
+
+        return templated
+
+    def generate_password_candidates(self, customer: Customer,
+                                     issuer_fingerprint: Optional[str] = None) -> List[str]:
+        """Generate password candidates in the order they should be tried"""
+        return [candidate for _, candidate in self.rank_password_candidates(customer, issuer_fingerprint)]
+    
+    def try_password_protected_pdf(self, source: PDFSource, customer: Customer) -> Optional[str]:
+        unlocked = self.unlock_password_protected_pdf(source, customer)
+        if unlocked is None:
+            return None
+        
+        text_content, _ = unlocked
+        return text_content if text_content.strip() else None
     
-    def try_password_protected_pdf(self, pdf_bytes: bytes, customer: Customer) -> Optional[str]:
-        password_candidates = self.generate_password_candidates(customer)
+    def unlock_password_protected_pdf(self, source: PDFSource, customer: Customer) -> Optional[Tuple[str, List[Dict]]]:
+        """Find the statement password and extract (text, page_extraction) with it"""
+        fingerprint = issuer_fingerprint(source) if self.password_store is not None else None
+        templated = self.rank_password_candidates(customer, fingerprint)
+        password_candidates = [candidate for _, candidate in templated]
         
         print(f"DEBUG - Attempting to unlock PDF with {len(password_candidates)} password candidates")
         
-        for i, password in enumerate(password_candidates):
-            print(f"DEBUG - Trying password {i+1}/{len(password_candidates)}: '{password}'")
-            
-            # Method 1: Try with pikepdf
-            try:
-                with pikepdf.open(io.BytesIO(pdf_bytes), password=password) as pdf:
-                    text_content = ""
-                    for page in pdf.pages:
-                        page_text = str(page)
-                        text_content += page_text + "\n"
-                    
-                    if text_content.strip():
-                        print(f"SUCCESS - PDF unlocked with pikepdf using password: '{password}'")
-                        return text_content
-            except pikepdf.PasswordError:
-                continue
-            except Exception as e:
-                print(f"WARNING - pikepdf failed with password '{password}': {str(e)}")
-                
-                # Method 2: Try with PyMuPDF as fallback
-                try:
-                    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-                    if doc.needs_pass:
-                        auth_result = doc.authenticate(password)
-                        if auth_result:
-                            text_content = ""
-                            for page_num in range(len(doc)):
-                                page = doc[page_num]
-                                text_content += page.get_text() + "\n"
-                            doc.close()
-                            
-                            if text_content.strip():
-                                print(f"SUCCESS - PDF unlocked with PyMuPDF using password: '{password}'")
-                                return text_content
-                        doc.close()
-                except Exception as pymupdf_error:
-                    print(f"WARNING - PyMuPDF also failed with password '{password}': {str(pymupdf_error)}")
-                    continue
-        
-        print("DEBUG - All password attempts failed")
-        return None
+        password = self.password_search.search(source, password_candidates)
+        if password is None:
+            print("DEBUG - All password attempts failed")
+            return None
+        
+        position = password_candidates.index(password)
+        print(f"SUCCESS - PDF unlocked using candidate {position + 1}/{len(password_candidates)}")
+        
+        try:
+            unlocked = self.extract_text_hybrid(source, password=password)
+        except Exception:
+            # PyMuPDF cannot read this encryption variant; decrypt with pikepdf instead
+            with open_pikepdf(source, password=password) as pdf:
+                decrypted = io.BytesIO()
+                pdf.save(decrypted)
+            unlocked = self.extract_text_hybrid(decrypted.getvalue())
+        
+        # Only a password that yields statement text is learned and credited to its template
+        if self.password_store is not None and unlocked[0].strip():
+            self.password_store.record_success(
+                getattr(customer, 'id', None), fingerprint, templated[position][0], password
+            )
+        
+        return unlocked
+    
+    def _open_document(self, source: PDFSource, password: Optional[str] = None):
+        doc = open_pdf(source)
+        if password is not None and doc.needs_pass and not doc.authenticate(password):
+            doc.close()
+            raise ValueError("Password rejected by PyMuPDF")
+        return doc
     
-    def extract_text_with_pymupdf(self, pdf_bytes: bytes) -> str:
+    def _extract_page_text(self, page) -> str:
+        # Try multiple text extraction methods
+        page_text = page.get_text()
+        
+        # If no text found, try extracting text blocks
+        if not page_text.strip():
+            text_blocks = page.get_text("blocks")
+            for block in text_blocks:
+                if len(block) > 4:  # Block contains text
+                    page_text += block[4] + "\n"
+        
+        # If still no text, try extracting text with layout preserved
+        if not page_text.strip():
+            page_dict = page.get_text("dict")
+            if isinstance(page_dict, dict) and "blocks" in page_dict:
+                for block in page_dict["blocks"]:
+                    if "lines" in block:
+                        for line in block["lines"]:
+                            if "spans" in line:
+                                for span in line["spans"]:
+                                    if "text" in span:
+                                        page_text += span["text"] + " "
+                                page_text += "\n"
+        
+        return str(page_text)
+    
+    def extract_text_with_pymupdf(self, source: PDFSource, password: Optional[str] = None) -> str:
         try:
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            doc = self._open_document(source, password)
             text_content = ""
             
             for page_num in range(len(doc)):
-                page = doc[page_num]
-                # Try multiple text extraction methods
-                page_text = page.get_text()
-                
-                # If no text found, try extracting text blocks
-                if not page_text.strip():
-                    text_blocks = page.get_text("blocks")
-                    for block in text_blocks:
-                        if len(block) > 4:  # Block contains text
-                            page_text += block[4] + "\n"
-                
-                # If still no text, try extracting text with layout preserved
-                if not page_text.strip():
-                    page_text = page.get_text("dict")
-                    if isinstance(page_text, dict) and "blocks" in page_text:
-                        for block in page_text["blocks"]:
-                            if "lines" in block:
-                                for line in block["lines"]:
-                                    if "spans" in line:
-                                        for span in line["spans"]:
-                                            if "text" in span:
-                                                page_text += span["text"] + " "
-                                        page_text += "\n"
-                
-                text_content += str(page_text) + "\n"
+                text_content += self._extract_page_text(doc[page_num]) + "\n"
             
             doc.close()
             return text_content
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Failed to extract text from PDF: {str(e)}")
     
-    def extract_text_with_ocr(self, pdf_bytes: bytes) -> str:
+    def extract_text_hybrid(self, source: PDFSource, password: Optional[str] = None) -> Tuple[str, List[Dict]]:
+        """
+        Decide per page whether a usable text layer exists and OCR only the
+        image-only pages. Returns the text and how each page was extracted.
+        """
+        doc = self._open_document(source, password)
         try:
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-            text_content = ""
-            
+            page_texts = []
+            ocr_page_numbers = []
             for page_num in range(len(doc)):
                 page = doc[page_num]
-                # Increase resolution for better OCR results
-                mat = fitz.Matrix(2.0, 2.0)  # 2x zoom
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
-                
-                img = Image.open(io.BytesIO(img_data))
+                page_text = self._extract_page_text(page)
+                page_texts.append(page_text)
                 
-                # Try different OCR configurations
-                ocr_configs = [
-                    '--psm 6',  # Uniform block of text
-                    '--psm 4',  # Single column of text
-                    '--psm 3',  # Fully automatic page segmentation
-                    '--psm 11', # Sparse text
-                    '--psm 12'  # Sparse text with OSD
-                ]
-                
-                page_text = ""
-                for config in ocr_configs:
-                    try:
-                        ocr_text = pytesseract.image_to_string(img, config=config)
-                        if ocr_text.strip() and len(ocr_text.strip()) > len(page_text.strip()):
-                            page_text = ocr_text
-                    except:
-                        continue
-                
-                if not page_text.strip() and CV2_AVAILABLE:
-                    # Try with image preprocessing
-                    try:
-                        # Convert PIL image to OpenCV format
-                        img_cv = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-                        
-                        # Apply preprocessing
-                        gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-                        thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
-                        
-                        # Convert back to PIL
-                        processed_img = Image.fromarray(thresh)
-                        
-                        try:
-                            page_text = pytesseract.image_to_string(processed_img, config='--psm 6')
-                        except:
-                            pass
-                    except Exception:
-                        # OpenCV processing failed, skip preprocessing
-                        pass
-                
-                text_content += page_text + "\n"
-            
+                if len(page_text.strip()) < self.min_text_layer_chars and page.get_images():
+                    ocr_page_numbers.append(page_num)
+        finally:
             doc.close()
-            return text_content
+        
+        ocr_results = {}
+        if ocr_page_numbers:
+            print(f"DEBUG - OCR needed for pages {[n + 1 for n in ocr_page_numbers]} of {len(page_texts)}")
+            try:
+                ocr_results = self.ocr_engine.ocr_pages(source, ocr_page_numbers, password=password)
+            except Exception as e:
+                print(f"WARNING - OCR failed: {e}")
+        
+        text_content = ""
+        page_extraction = []
+        for page_num, page_text in enumerate(page_texts):
+            page_info = {'page': page_num + 1}
+            ocr_result = ocr_results.get(page_num)
+            
+            if ocr_result and ocr_result['text'].strip():
+                page_text = ocr_result['text']
+                page_info['method'] = 'ocr'
+                page_info['ocr_confidence'] = round(ocr_result['confidence'], 1)
+            elif page_text.strip():
+                page_info['method'] = 'text_layer'
+            else:
+                page_info['method'] = 'empty'
+                if ocr_result:
+                    # OCR ran on the page and read nothing
+                    page_info['ocr_confidence'] = round(ocr_result['confidence'], 1)
+            
+            page_info['characters'] = len(page_text.strip())
+            page_extraction.append(page_info)
+            text_content += page_text + "\n"
+        
+        return text_content, page_extraction
+    
+    def extract_text_with_ocr(self, source: PDFSource) -> str:
+        try:
+            return self.ocr_engine.extract_text(source)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Failed to perform OCR on PDF: {str(e)}")
     
@@ -423,38 +447,85 @@ activate = 1
         if file.content_type != "application/pdf":
             raise HTTPException(status_code=400, detail="File must be a PDF")
         
-        content = await file.read()
-        
+        # Stream the upload to disk; every extraction attempt then opens the same file
+        upload = await SpooledUpload.from_upload(file)
         try:
-            # First try normal text extraction
-            text_content = self.extract_text_with_pymupdf(content)
+            if self.parse_executor is None:
+                return self.parse_pdf_source(upload.path, customer, cache_key=upload.sha256)
             
-            # If we got some text, process it
-            if text_content.strip():
-                return self.process_extracted_text(text_content)
+            # Load the customer's cards here so the worker thread never lazy-loads through the request session
+            list(getattr(customer, 'credit_cards', []))
+            return await self.parse_executor.run(
+                self.parse_pdf_source, upload.path, customer, cache_key=upload.sha256
+            )
+        finally:
+            upload.close()
+    
+    def parse_pdf_bytes(self, content: bytes, customer: Customer) -> Dict:
+        return self.parse_pdf_source(content, customer)
+    
+    def parse_pdf_source(self, source: PDFSource, customer: Customer, cache_key: Optional[str] = None) -> Dict:
+        """Parse a statement, serving repeat uploads of the same bytes from the parse cache"""
+        customer_id = getattr(customer, 'id', None)
+        
+        if self.parse_cache is not None:
+            cache_key = cache_key or source_digest(source)
+            cached = self.parse_cache.get(cache_key, customer_id)
+            if cached is not None:
+                print(f"DEBUG - Parse cache hit for {cache_key[:12]}")
+                return cached
+        
+        text_content, page_extraction, needed_password = self.extract_text(source, customer)
+        result = self.process_extracted_text(text_content, page_extraction)
+        
+        if self.parse_cache is not None:
+            # Text recovered with this customer's password must not be served to others
+            self.parse_cache.put(cache_key, text_content, result, customer_id if needed_password else None)
+        
+        return result
+    
+    def extract_text(self, source: PDFSource, customer: Customer) -> Tuple[str, List[Dict], bool]:
+        """
+        Extract statement text page by page. Returns the text, the per-page
+        extraction methods and whether a password was needed.
+        """
+        ocr_attempted = False
+        try:
+            # Text layer where there is one, OCR for image-only pages
+            text_content, page_extraction = self.extract_text_hybrid(source)
+            ocr_attempted = any('ocr_confidence' in page for page in page_extraction)
             
-            # If no text found, try OCR
-            text_content = self.extract_text_with_ocr(content)
             if text_content.strip():
-                return self.process_extracted_text(text_content)
+                return text_content, page_extraction, False
             
             # If still no text, file might be password protected
             raise Exception("No text could be extracted")
         
         except Exception as e:
             # Try password-protected PDF extraction
-            password_content = self.try_password_protected_pdf(content, customer)
+            unlocked = self.unlock_password_protected_pdf(source, customer)
             
-            if password_content:
-                return self.process_extracted_text(password_content)
+            if unlocked and unlocked[0].strip():
+                return unlocked[0], unlocked[1], True
             
-            # Last resort: try OCR again with different settings
-            try:
-                text_content = self.extract_text_with_ocr(content)
-                if text_content.strip():
-                    return self.process_extracted_text(text_content)
-            except Exception as ocr_error:
-                pass
+            # Last resort: OCR every page, unless the hybrid pass already did
+            if not ocr_attempted:
+                try:
+                    ocr_results = self.ocr_engine.ocr_pages(source)
+                    text_content = ''.join(ocr_results[page_num]['text'] + "\n" for page_num in sorted(ocr_results))
+                    if text_content.strip():
+                        page_extraction = [
+                            {
+                                'page': page_num + 1,
+                                'method': 'ocr',
+                                'ocr_confidence': round(ocr_results[page_num]['confidence'], 1),
+                                'characters': len(ocr_results[page_num]['text'].strip())
+                            }
+                            for page_num in sorted(ocr_results)
+                        ]
+                        return text_content, page_extraction, False
+                except Exception as ocr_error:
+                    pass
                 
             raise HTTPException(
                 status_code=400, 
@@ -463,124 +534,15 @@ activate = 1
     
     def extract_detailed_transactions(self, text: str) -> List[dict]:
         """Extract detailed transaction information with AED/DHS amounts"""
-        transactions = []
-        lines = text.split('\n')
-        
-        # Look for transaction patterns
-        for i, line in enumerate(lines):
-            # Look for date patterns followed by merchant info and AED amounts
-            date_pattern = r'(\d{2}-\d{2}-\d{4})'
-            if re.search(date_pattern, line):
-                # Check next few lines for merchant and amount info
-                transaction_block = []
-                for j in range(i, min(i+5, len(lines))):
-                    if lines[j].strip():
-                        transaction_block.append(lines[j].strip())
-                
-                # Look for AED/DHS amounts in this block
-                full_block = ' '.join(transaction_block)
-                aed_pattern = r'(?:AED|DHS)\s*(\d+(?:,\d{3})*(?:\.\d{2})?)'
-                amount_pattern = r'(\d+(?:,\d{3})*(?:\.\d{2})?)\s*(?:AED|DHS)'
-                
-                amount_matches = re.findall(aed_pattern, full_block, re.IGNORECASE)
-                if not amount_matches:
-                    amount_matches = re.findall(amount_pattern, full_block, re.IGNORECASE)
-                
-                if amount_matches:
-                    # Extract merchant name (look for text between dates and amounts)
-                    merchant_pattern = r'\d{2}-\d{2}-\d{4}\s+([A-Z][A-Z0-9\s&\-\.]{3,40})\s+'
-                    merchant_match = re.search(merchant_pattern, full_block)
-                    merchant = merchant_match.group(1).strip() if merchant_match else "Unknown Merchant"
-                    
-                    # Extract transaction date
-                    date_match = re.search(date_pattern, line)
-                    transaction_date = date_match.group(1) if date_match else None
-                    
-                    for amount_str in amount_matches:
-                        try:
-                            amount = float(amount_str.replace(',', ''))
-                            transactions.append({
-                                'date': transaction_date,
-                                'merchant': merchant,
-                                'amount': amount,
-                                'currency': 'AED',
-                                'raw_text': full_block,
-                                'transaction_block': transaction_block
-                            })
-                        except ValueError:
-                            continue
-        
-        return transactions
+        return self.scanner.scan_transactions(text)
     
     def extract_summary_amounts(self, text: str) -> dict:
         """Extract key summary amounts from the statement"""
-        summary = {}
-        
-        # Key patterns to look for
-        patterns = {
-            'current_balance': r'Current Balance.*?(\d+(?:,\d{3})*(?:\.\d{2})?)',
-            'minimum_payment': r'Minimum Payment Due.*?(\d+(?:,\d{3})*(?:\.\d{2})?)',
-            'total_payment': r'Total Payment Due.*?(\d+(?:,\d{3})*(?:\.\d{2})?)',
-            'previous_balance': r'Previous Balance.*?(\d+(?:,\d{3})*(?:\.\d{2})?)',
-            'credit_limit': r'(?:Total\s+)?Credit Limit.*?(\d+(?:,\d{3})*(?:\.\d{2})?)',
-            'available_credit': r'Available Credit Limit.*?(\d+(?:,\d{3})*(?:\.\d{2})?)',
-            'statement_date': r'Statement Date.*?(\d{2}-\d{2}-\d{4})',
-            'due_date': r'Payment Due Date.*?(\d{2}-\d{2}-\d{4})'
-        }
-        
-        for key, pattern in patterns.items():
-            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-            if match:
-                value = match.group(1)
-                if key in ['statement_date', 'due_date']:
-                    summary[key] = value
-                else:
-                    try:
-                        summary[key] = float(value.replace(',', ''))
-                    except ValueError:
-                        summary[key] = value
-        
-        return summary
+        return self.scanner.scan_summary(text)
     
     def extract_aed_dhs_amounts(self, text: str) -> List[dict]:
         """Extract all AED/DHS amounts from the text"""
-        amounts = []
-        
-        # Patterns for AED/DHS amounts
-        patterns = [
-            r'AED\s*(\d+(?:,\d{3})*(?:\.\d{2})?)',
-            r'DHS\s*(\d+(?:,\d{3})*(?:\.\d{2})?)',
-            r'(\d+(?:,\d{3})*(?:\.\d{2})?)\s*AED',
-            r'(\d+(?:,\d{3})*(?:\.\d{2})?)\s*DHS', 
-            r'(?:AED|DHS)[\s:]*(\d+(?:,\d{3})*(?:\.\d{2})?)',
-            r'(\d+(?:,\d{3})*(?:\.\d{2})?)\s*(?:AED|DHS)',
-        ]
-        
-        for pattern in patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-            for match in matches:
-                amount_str = match.group(1)
-                try:
-                    amount = float(amount_str.replace(',', ''))
-                    amounts.append({
-                        'amount': amount,
-                        'currency': 'AED',
-                        'raw_match': match.group(0),
-                        'context': text[max(0, match.start()-50):match.end()+50]
-                    })
-                except ValueError:
-                    continue
-        
-        # Remove duplicates
-        unique_amounts = []
-        seen = set()
-        for amount_info in amounts:
-            key = (amount_info['amount'], amount_info['currency'])
-            if key not in seen:
-                seen.add(key)
-                unique_amounts.append(amount_info)
-        
-        return unique_amounts
+        return self.scanner.scan_currency_amounts(text)
     
     def format_currency(self, amount: float) -> str:
         """Format currency amount for display"""
@@ -612,14 +574,15 @@ activate = 1
         
         return cleaned_text
     
-    def process_extracted_text(self, text: str) -> Dict:
+    def process_extracted_text(self, text: str, page_extraction: Optional[List[Dict]] = None) -> Dict:
         """Process extracted text and return structured data"""
         cleaned_text = self.clean_extracted_text(text)
         
         # Extract detailed information
-        transactions = self.extract_detailed_transactions(text)
-        summary = self.extract_summary_amounts(text)
-        amounts = self.extract_aed_dhs_amounts(text)
+        scanned = self.scanner.scan(text)
+        transactions = scanned['transactions']
+        summary = scanned['summary']
+        amounts = scanned['aed_amounts']
         
         # Count total transactions
         total_transaction_amount = sum(t['amount'] for t in transactions)
@@ -636,7 +599,8 @@ activate = 1
                 'unique_amounts_found': len(amounts),
                 'currency': 'AED'
             },
-            'extraction_success': True
+            'extraction_success': True,
+            'page_extraction': page_extraction or []
         }
 
 
@@ -0,0 +1,198 @@
+import io
+import os
+import json
+import hashlib
+import tempfile
+from typing import Optional, Union
+from fastapi import UploadFile, HTTPException
+
+import fitz
+import pikepdf
+
+# A statement is either held in memory or, for uploads, the path of a spooled
+# file that every extraction attempt opens directly without copying it
+PDFSource = Union[bytes, str]
+
+DEFAULT_MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+# Request bodies may exceed the file limit by this much: multipart boundaries and headers
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+def open_pdf(source: PDFSource):
+    """Open a statement with PyMuPDF, file-backed when given a path"""
+    if isinstance(source, str):
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def open_pikepdf(source: PDFSource, password: str = ""):
+    """Open a statement with pikepdf, memory-mapped when given a path"""
+    if isinstance(source, str):
+        return pikepdf.open(source, password=password, access_mode=pikepdf.AccessMode.mmap)
+    return pikepdf.open(io.BytesIO(source), password=password)
+
+
+def source_digest(source: PDFSource) -> str:
+    """SHA-256 of the statement bytes, read in chunks for spooled files"""
+    if not isinstance(source, str):
+        return hashlib.sha256(source).hexdigest()
+
+    digest = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(SPOOL_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def max_upload_bytes() -> int:
+    return int(os.getenv("MAX_UPLOAD_BYTES", DEFAULT_MAX_UPLOAD_BYTES))
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File exceeds the maximum upload size of {max_bytes} bytes"
+    )
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware that enforces the upload size limit on the request body
+    itself, before Starlette's multipart parser has spooled the whole upload:
+    a declared Content-Length over the limit is rejected without reading the
+    body, and a body that streams in past the limit is cut off at the first
+    chunk over it. Either way the client gets a 413.
+    """
+
+    def __init__(self, app, max_bytes: Optional[int] = None):
+        self.app = app
+        self.max_bytes = max_bytes if max_bytes is not None else max_upload_bytes()
+        self.max_body_bytes = self.max_bytes + MULTIPART_OVERHEAD_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get('headers') or [])
+        try:
+            declared = int(headers.get(b'content-length', b''))
+        except ValueError:
+            declared = None
+        if declared is not None and declared > self.max_body_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_body_bytes:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # Whatever the app makes of the cut-off body, the client gets the 413
+            if exceeded and not response_started:
+                return
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await self._reject(send)
+
+    async def _reject(self, send):
+        body = json.dumps({'detail': _too_large(self.max_bytes).detail}, separators=(',', ':')).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': 413,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                        (b'connection', b'close')]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+class SpooledUpload:
+    """
+    An upload streamed to a temporary file in fixed-size chunks. The size
+    limit is checked again and the SHA-256 computed while the data is
+    copied, so the document is never held in memory as a whole. The limit
+    is enforced on the request stream itself by UploadSizeLimitMiddleware.
+    """
+
+    def __init__(self, path: str, size: int, sha256: str, filename: Optional[str] = None):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+
+    @classmethod
+    async def from_upload(cls, file: UploadFile, max_bytes: Optional[int] = None,
+                          spool_dir: Optional[str] = None) -> 'SpooledUpload':
+        if max_bytes is None:
+            max_bytes = max_upload_bytes()
+        if spool_dir is None:
+            spool_dir = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+        # Reject early when the client declared the size
+        if getattr(file, 'size', None) and file.size > max_bytes:
+            raise _too_large(max_bytes)
+
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=".upload", dir=spool_dir)
+
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as spool:
+                while True:
+                    chunk = await file.read(SPOOL_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise _too_large(max_bytes)
+                    digest.update(chunk)
+                    spool.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+
+        return cls(path, size, digest.hexdigest(), file.filename)
+
+    def read_bytes(self) -> bytes:
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def close(self):
+        """Delete the spooled file, unless it has been moved elsewhere"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,208 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, update, union_all
+from sqlalchemy.orm import Session
+
+from models import Transaction
+from services.merchant_memo import normalize_merchant
+
+# Named billing cycles, in days
+FREQUENCIES = [
+    ('weekly', 7.0),
+    ('biweekly', 14.0),
+    ('monthly', 30.44),
+    ('quarterly', 91.31),
+    ('semiannual', 182.62),
+    ('yearly', 365.25),
+]
+
+# Rows per UPDATE ... WHERE id IN (...), below SQLite's variable limit
+UPDATE_CHUNK_SIZE = 500
+
+HISTORY_COLUMNS = ['id', 'date', 'amount', 'merchant', 'is_recurring']
+
+
+class RecurringChargeDetector:
+    """
+    Finds recurring charges in a customer's history with columnar group-bys:
+    transactions are grouped by normalized merchant, and a series is
+    recurring when it has enough occurrences, a stable amount and regular
+    gaps between charges. The median gap gives the billing period and the
+    next expected charge date. After an ingest only the series of the new
+    batch's merchants, within lookback_days of its oldest row, are read.
+    """
+
+    def __init__(self, min_occurrences: int = 3, amount_tolerance: float = 0.1,
+                 period_tolerance: float = 0.25, min_period_days: float = 5.0,
+                 lookback_days: float = 1100.0):
+        self.min_occurrences = min_occurrences
+        # Maximum standard deviation of the amounts, relative to their mean
+        self.amount_tolerance = amount_tolerance
+        # Maximum median deviation of the gaps, relative to the period
+        self.period_tolerance = period_tolerance
+        self.min_period_days = min_period_days
+        # Enough for min_occurrences of a yearly charge, with slack
+        self.lookback_days = lookback_days
+
+    def detect(self, history: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+        """
+        Evaluate every merchant series in a frame with id, date, amount and
+        merchant columns. Returns one summary row per recurring series and
+        the ids of the transactions that belong to those series.
+        """
+        empty = pd.DataFrame(columns=[
+            'merchant', 'transaction_count', 'average_amount', 'amount_std', 'period_days',
+            'frequency', 'first_date', 'last_date', 'next_expected_date'
+        ])
+        if history.empty:
+            return empty, np.array([], dtype=np.int64)
+
+        df = history[['id', 'date', 'amount', 'merchant']].copy()
+        df['date'] = pd.to_datetime(df['date'], errors='coerce')
+        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+        df = df.dropna(subset=['date', 'amount'])
+
+        # Normalize each distinct merchant name once rather than once per row
+        merchants = df['merchant'].fillna('').astype(str)
+        keys = {merchant: normalize_merchant(merchant) for merchant in merchants.unique()}
+        df['merchant_key'] = merchants.map(keys)
+        df = df[df['merchant_key'] != '']
+        if df.empty:
+            return empty, np.array([], dtype=np.int64)
+
+        df = df.sort_values(['merchant_key', 'date'], kind='mergesort')
+        groups = df.groupby('merchant_key', sort=False)
+
+        series = groups.agg(
+            merchant=('merchant', 'last'),
+            transaction_count=('amount', 'size'),
+            average_amount=('amount', 'mean'),
+            amount_std=('amount', 'std'),
+            first_date=('date', 'min'),
+            last_date=('date', 'max')
+        )
+        series['amount_std'] = series['amount_std'].fillna(0.0)
+
+        # Gaps between consecutive charges; same-day repeats say nothing about the period
+        df['gap_days'] = groups['date'].diff().dt.total_seconds() / 86400.0
+        gaps = df.loc[df['gap_days'] >= 1.0, ['merchant_key', 'gap_days']]
+        gap_groups = gaps.groupby('merchant_key', sort=False)['gap_days']
+        series['period_days'] = gap_groups.median()
+        series['gap_count'] = gap_groups.size()
+        gaps = gaps.assign(deviation=(gaps['gap_days'] - gaps['merchant_key'].map(series['period_days'])).abs())
+        series['period_deviation'] = gaps.groupby('merchant_key', sort=False)['deviation'].median()
+
+        stable_amount = series['amount_std'] <= self.amount_tolerance * series['average_amount'].abs()
+        regular = series['period_deviation'] <= self.period_tolerance * series['period_days']
+        recurring = (
+            (series['transaction_count'] >= self.min_occurrences)
+            & (series['gap_count'] >= self.min_occurrences - 1)
+            & (series['period_days'] >= self.min_period_days)
+            & stable_amount
+            & regular
+        )
+        series = series[recurring.fillna(False)].copy()
+
+        series['frequency'] = self._frequency(series['period_days'].to_numpy())
+        series['next_expected_date'] = (
+            series['last_date'] + pd.to_timedelta(series['period_days'], unit='D')
+        ).dt.round('D')
+
+        recurring_ids = df.loc[df['merchant_key'].isin(series.index), 'id'].to_numpy()
+        return series[empty.columns].sort_values('next_expected_date'), recurring_ids
+
+    def _frequency(self, period_days: np.ndarray) -> np.ndarray:
+        """Name of the nearest billing cycle, or 'every N days' when none is close"""
+        if len(period_days) == 0:
+            return np.array([], dtype=object)
+
+        cycles = np.array([days for _, days in FREQUENCIES])
+        names = np.array([name for name, _ in FREQUENCIES], dtype=object)
+        relative_error = np.abs(period_days[:, None] - cycles[None, :]) / cycles[None, :]
+        nearest = relative_error.argmin(axis=1)
+        close = relative_error[np.arange(len(period_days)), nearest] <= self.period_tolerance
+        fallback = np.array([f"every {round(days)} days" for days in period_days], dtype=object)
+        return np.where(close, names[nearest], fallback)
+
+    def load_history(self, db: Session, customer_id: int, merchant_keys: Optional[Iterable[str]] = None,
+                     since: Optional[datetime] = None) -> pd.DataFrame:
+        """The customer's transactions, optionally only those of some normalized merchants and dates"""
+        query = (
+            select(Transaction.id, Transaction.date, Transaction.amount,
+                   Transaction.merchant, Transaction.is_recurring)
+            .where(Transaction.customer_id == customer_id)
+        )
+        if since is not None:
+            query = query.where(Transaction.date >= since)
+        if merchant_keys is not None:
+            # Two index lookups; rows stored without a merchant_key are read too, and normalized by the caller
+            query = union_all(
+                query.where(Transaction.merchant_key.in_(list(merchant_keys))),
+                query.where(Transaction.merchant_key.is_(None))
+            )
+        rows = db.execute(query).all()
+        return pd.DataFrame.from_records(rows, columns=HISTORY_COLUMNS)
+
+    def summarize(self, series: pd.DataFrame) -> list:
+        records = []
+        for row in series.itertuples():
+            records.append({
+                'merchant': row.merchant,
+                'transaction_count': int(row.transaction_count),
+                'average_amount': round(float(row.average_amount), 2),
+                'amount_std': round(float(row.amount_std), 2),
+                'period_days': round(float(row.period_days), 1),
+                'frequency': row.frequency,
+                'first_date': row.first_date.isoformat(),
+                'last_date': row.last_date.isoformat(),
+                'next_expected_date': row.next_expected_date.isoformat()
+            })
+        return records
+
+    def update_customer(self, db: Session, customer_id: int, merchants: Optional[Iterable[str]] = None,
+                        batch_start: Optional[datetime] = None, commit: bool = True) -> Dict:
+        """
+        Recompute is_recurring from the stored history. Given the merchants of
+        a newly ingested batch, only those merchants' series are read,
+        re-evaluated and written back; given the batch's oldest date as well,
+        only rows from lookback_days before it. Pending rows must be flushed
+        before calling this.
+        """
+        if merchants is None:
+            history = self.load_history(db, customer_id)
+        else:
+            keys = {normalize_merchant(merchant) for merchant in merchants} - {''}
+            since = batch_start - timedelta(days=self.lookback_days) if batch_start is not None else None
+            history = self.load_history(db, customer_id, merchant_keys=keys, since=since)
+            names = history['merchant'].fillna('').astype(str)
+            mapping = {name: normalize_merchant(name) for name in names.unique()}
+            history = history[names.map(mapping).isin(keys)]
+
+        series, recurring_ids = self.detect(history)
+
+        flagged = set(recurring_ids.tolist())
+        currently_flagged = set(history.loc[history['is_recurring'].fillna(False).astype(bool), 'id'].tolist())
+        to_set = sorted(flagged - currently_flagged)
+        to_clear = sorted(currently_flagged - flagged)
+
+        for ids, value in ((to_set, True), (to_clear, False)):
+            for start in range(0, len(ids), UPDATE_CHUNK_SIZE):
+                db.execute(
+                    update(Transaction)
+                    .where(Transaction.id.in_(ids[start:start + UPDATE_CHUNK_SIZE]))
+                    .values(is_recurring=value)
+                    .execution_options(synchronize_session=False)
+                )
+
+        if commit:
+            db.commit()
+
+        return {
+            'transactions_evaluated': len(history),
+            'recurring_series': len(series),
+            'flagged': len(to_set),
+            'cleared': len(to_clear)
+        }
@@ -0,0 +1,92 @@
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ServiceRegistry:
+    """
+    Process-wide service instances. Each service is built once, either by
+    warm_up() at startup or lazily on first use, and handed to endpoints
+    through FastAPI dependencies from provider(). Services marked as warm
+    must be loaded before the application reports itself ready.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._warm = []
+        self._instances = {}
+        self._load_seconds = {}
+        self._errors = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._warm_up_thread = None
+
+    def register(self, name: str, factory: Callable[[], Any], warm: bool = True):
+        with self._lock:
+            self._factories[name] = factory
+            self._locks[name] = threading.Lock()
+            if warm and name not in self._warm:
+                self._warm.append(name)
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        if name not in self._factories:
+            raise KeyError(f"Unknown service: {name}")
+
+        # One lock per service, so a slow model load does not block unrelated services
+        with self._locks[name]:
+            instance = self._instances.get(name)
+            if instance is None:
+                started = time.perf_counter()
+                try:
+                    instance = self._factories[name]()
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    raise
+                self._load_seconds[name] = time.perf_counter() - started
+                self._errors.pop(name, None)
+                self._instances[name] = instance
+                print(f"DEBUG - Loaded service {name} in {self._load_seconds[name]:.2f}s")
+        return instance
+
+    def loaded(self, name: str) -> Optional[Any]:
+        """The instance of a service if it has been built, without building it"""
+        return self._instances.get(name)
+
+    def provider(self, name: str) -> Callable[[], Any]:
+        """A FastAPI dependency returning the shared instance of a service"""
+        def dependency():
+            return self.get(name)
+        dependency.__name__ = f"get_{name}"
+        return dependency
+
+    def warm_up(self, names: Optional[List[str]] = None):
+        """Build the given services (all warm services by default) now"""
+        for name in names or list(self._warm):
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"WARNING - Could not warm up service {name}: {e}")
+
+    def warm_up_in_background(self) -> threading.Thread:
+        if self._warm_up_thread is None or not self._warm_up_thread.is_alive():
+            self._warm_up_thread = threading.Thread(target=self.warm_up, name="service-warm-up", daemon=True)
+            self._warm_up_thread.start()
+        return self._warm_up_thread
+
+    def is_ready(self) -> bool:
+        return all(name in self._instances for name in self._warm)
+
+    def status(self) -> Dict:
+        services = {}
+        for name in self._factories:
+            services[name] = {
+                'loaded': name in self._instances,
+                'warm': name in self._warm,
+                'load_seconds': round(self._load_seconds[name], 3) if name in self._load_seconds else None,
+                'error': self._errors.get(name)
+            }
+        return {'ready': self.is_ready(), 'services': services}
@@ -3,6 +3,8 @@ from typing import Dict, List, Optional, Union
 from datetime import datetime, timedelta
 import dateparser
 
+from services.keyword_matcher import KeywordMatcher
+
 class SMSParser:
     def __init__(self):
         self.date_patterns = [
@@ -72,6 +74,16 @@ class SMSParser:
             r'\*+(\d{4})',
             r'xxxx\s*(\d{4})',
         ]
+        
+        # Checked in priority order: the first type with a keyword in the SMS wins
+        self.sms_type_keywords = {
+            'payment_due': ['due', 'payment due', 'bill due', 'minimum payment'],
+            'payment_confirmation': ['payment successful', 'payment confirmed', 'paid', 'payment received'],
+            'statement_generated': ['statement', 'bill generated', 'monthly statement'],
+            'transaction_alert': ['transaction', 'purchase', 'spent'],
+            'balance_inquiry': ['balance', 'outstanding', 'current balance'],
+        }
+        self.sms_type_matcher = KeywordMatcher.from_table(self.sms_type_keywords)
 
     def parse_sms(self, sms_text: str) -> Dict:
         sms_text = sms_text.strip()
@@ -106,18 +118,7 @@ class SMSParser:
         return parsed_data
 
     def _classify_sms_type(self, sms_text: str) -> str:
-        if any(word in sms_text for word in ['due', 'payment due', 'bill due', 'minimum payment']):
-            return 'payment_due'
-        elif any(word in sms_text for word in ['payment successful', 'payment confirmed', 'paid', 'payment received']):
-            return 'payment_confirmation'
-        elif any(word in sms_text for word in ['statement', 'bill generated', 'monthly statement']):
-            return 'statement_generated'
-        elif any(word in sms_text for word in ['transaction', 'purchase', 'spent']):
-            return 'transaction_alert'
-        elif any(word in sms_text for word in ['balance', 'outstanding', 'current balance']):
-            return 'balance_inquiry'
-        else:
-            return 'unknown'
+        return self.sms_type_matcher.first_label(sms_text) or 'unknown'
 
     def _extract_due_date(self, sms_text: str) -> Optional[datetime]:
         for pattern in self.date_patterns:
@@ -0,0 +1,245 @@
+import json
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.sqlite import insert
+
+from models import Transaction, CreditCard
+from services.transaction_deduplicator import TransactionDeduplicator
+from services.incremental_deduplicator import IncrementalDeduplicator, transaction_fingerprint
+from services.transaction_extractor import TransactionExtractor
+from services.categorizer import TransactionCategorizer
+from services.recurring_detector import RecurringChargeDetector
+from services.merchant_memo import normalize_merchant
+from services.anomaly_model_store import AnomalyModelStore
+from services.baseline_store import OnlineBaselineStore
+
+
+def _no_progress(stage: str, progress: float):
+    pass
+
+
+class StatementIngestionService:
+    """
+    Persists parsed statements for a customer: deduplicates the extracted
+    transactions, skips rows already stored, saves the rest and updates the
+    card summary. Shared by the upload and SMS/email endpoints and the
+    ingestion job workers.
+    """
+
+    def __init__(self, deduplicator: Optional[TransactionDeduplicator] = None,
+                 transaction_extractor: Optional[TransactionExtractor] = None,
+                 recurring_detector: Optional[RecurringChargeDetector] = None,
+                 anomaly_models: Optional[AnomalyModelStore] = None,
+                 baselines: Optional[OnlineBaselineStore] = None):
+        self.deduplicator = deduplicator or TransactionDeduplicator()
+        self.incremental_deduplicator = IncrementalDeduplicator(self.deduplicator)
+        self.transaction_extractor = transaction_extractor or TransactionExtractor()
+        # Without a detector is_recurring is left to a later full pass (e.g. bulk ingestion)
+        self.recurring_detector = recurring_detector
+        # Without a model store new rows keep is_anomaly unset until the next model is trained
+        self.anomaly_models = anomaly_models
+        # Without a baseline store rows are not flagged on arrival
+        self.baselines = baselines
+
+    def save_pdf_statement(self, db: Session, customer_id: int, parsed_data: Dict,
+                           progress: Callable[[str, float], None] = _no_progress,
+                           commit: bool = True) -> Dict:
+        """Save a parsed PDF statement and add the deduplication info to parsed_data"""
+        progress('deduplicating', 0.6)
+
+        # Deduplicate within the statement and against the stored transactions
+        result = self.deduplicate(db, customer_id, parsed_data['transactions'])
+        deduplication_result = result['batch_result']
+
+        progress('saving', 0.8)
+
+        # Save deduplicated transactions to database
+        rows = []
+        for transaction_data in result['new_transactions']:
+            transaction_date = datetime.strptime(transaction_data['date'], '%d-%m-%Y') if transaction_data['date'] else datetime.now()
+
+            rows.append(self.transaction_row(customer_id, {
+                'date': transaction_date,
+                'description': f"{transaction_data['merchant']} - {transaction_data['currency']} {transaction_data['amount']}",
+                'amount': transaction_data['amount'],
+                'currency': transaction_data['currency'],
+                'category': 'purchase',
+                'subcategory': 'general',
+                'merchant': transaction_data['merchant'],
+                'confidence_score': 0.9,
+                'category_source': 'statement',
+                'raw_text': transaction_data['raw_text']
+            }))
+        self.score_anomalies(db, customer_id, rows)
+        flags = self.flag_arrivals(db, customer_id, rows)
+        inserted = self.insert_transactions(db, rows)
+        transactions_saved = len(inserted)
+        self.update_baseline(db, customer_id)
+
+        # Update customer's credit card info if summary data available
+        if parsed_data['summary']:
+            summary = parsed_data['summary']
+            credit_card = db.query(CreditCard).filter(CreditCard.customer_id == customer_id).first()
+            if credit_card:
+                if 'current_balance' in summary:
+                    credit_card.current_balance = summary['current_balance']
+                if 'minimum_payment' in summary:
+                    credit_card.minimum_payment = summary['minimum_payment']
+                if 'credit_limit' in summary:
+                    credit_card.credit_limit = summary['credit_limit']
+                if 'due_date' in summary:
+                    credit_card.due_date = summary['due_date']
+                if 'statement_date' in summary:
+                    credit_card.statement_date = summary['statement_date']
+
+        if transactions_saved:
+            self.update_recurring(db, customer_id, [rows[i] for i in inserted])
+
+        if commit:
+            db.commit()
+
+        # Add transaction count and deduplication info to response
+        parsed_data['transactions_saved'] = transactions_saved
+        parsed_data['duplicates_removed'] = deduplication_result['duplicates_removed']
+        parsed_data['already_stored'] = result['already_stored']
+        parsed_data['flagged_on_arrival'] = sum(1 for i in inserted if flags[i])
+        parsed_data['original_transaction_count'] = deduplication_result['original_count']
+        parsed_data['deduplicated_transaction_count'] = deduplication_result['deduplicated_count']
+        parsed_data['deduplication_report'] = self.deduplicator.generate_deduplication_report(deduplication_result)
+
+        return parsed_data
+
+    def extract_email_transactions(self, parsed_email: Dict,
+                                   categorizer: Optional[TransactionCategorizer] = None) -> List[Dict]:
+        """Extract and categorize the transactions of a parsed EML file"""
+        transactions = self.transaction_extractor.extract_transactions(parsed_email.get('body', ''))
+
+        if not transactions:
+            return []
+
+        categorizer = categorizer or TransactionCategorizer()
+        return categorizer.categorize_transactions(transactions)
+
+    def save_categorized_transactions(self, db: Session, customer_id: int, transactions: List[Dict],
+                                      commit: bool = True) -> int:
+        """Save categorized transactions that are not duplicates, returning how many were added"""
+        return len(self.store_categorized_transactions(db, customer_id, transactions, commit=commit))
+
+    def store_categorized_transactions(self, db: Session, customer_id: int, transactions: List[Dict],
+                                       commit: bool = False) -> List[Dict]:
+        """
+        Deduplicate and insert categorized transactions, committing only when
+        asked, and return the ones that were added with their 'anomaly_flags'.
+        Rows without a date are saved as of now.
+        """
+        new_transactions = self.deduplicate(db, customer_id, transactions)['new_transactions']
+        rows = [self.transaction_row(customer_id, transaction_data) for transaction_data in new_transactions]
+        self.score_anomalies(db, customer_id, rows)
+        flags = self.flag_arrivals(db, customer_id, rows)
+
+        inserted = self.insert_transactions(db, rows)
+        saved = []
+        for i in inserted:
+            new_transactions[i]['anomaly_flags'] = flags[i]
+            saved.append(new_transactions[i])
+        self.update_baseline(db, customer_id)
+
+        if saved:
+            self.update_recurring(db, customer_id, [rows[i] for i in inserted])
+
+        if commit:
+            db.commit()
+
+        return saved
+
+    def transaction_row(self, customer_id: int, transaction_data: Dict) -> Dict:
+        """Column values for a transactions row, fingerprint included"""
+        date = transaction_data.get('date') or datetime.now()
+        return {
+            'customer_id': customer_id,
+            'credit_card_id': transaction_data.get('credit_card_id'),
+            'date': date,
+            'description': transaction_data.get('description'),
+            'amount': transaction_data.get('amount'),
+            'category': transaction_data.get('category'),
+            'subcategory': transaction_data.get('subcategory'),
+            'merchant': transaction_data.get('merchant'),
+            'merchant_key': normalize_merchant(transaction_data.get('merchant')),
+            'is_recurring': transaction_data.get('is_recurring', False),
+            'is_anomaly': transaction_data.get('is_anomaly', False),
+            'anomaly_score': transaction_data.get('anomaly_score'),
+            'anomaly_flags': None,
+            'confidence_score': transaction_data.get('confidence_score'),
+            'category_source': transaction_data.get('category_source'),
+            'raw_text': transaction_data.get('raw_text'),
+            'fingerprint': transaction_fingerprint(
+                customer_id, date, transaction_data.get('amount'),
+                transaction_data.get('currency'), transaction_data.get('merchant')
+            )
+        }
+
+    def insert_transactions(self, db: Session, rows: List[Dict]) -> List[int]:
+        """
+        Bulk INSERT ... ON CONFLICT DO NOTHING: a row whose fingerprint the
+        customer already has is rejected by the unique index in the same
+        statement. Returns the positions of the rows that were inserted.
+        """
+        if not rows:
+            return []
+
+        statement = insert(Transaction).on_conflict_do_nothing(
+            index_elements=['customer_id', 'fingerprint']
+        ).returning(Transaction.fingerprint)
+        inserted = {fingerprint for fingerprint, in db.execute(statement, rows)}
+
+        positions = []
+        for position, row in enumerate(rows):
+            if row['fingerprint'] in inserted:
+                # A repeated fingerprint within the batch is inserted once
+                inserted.discard(row['fingerprint'])
+                positions.append(position)
+        return positions
+
+    def score_anomalies(self, db: Session, customer_id: int, rows: List[Dict]):
+        """Flag rows about to be inserted against the customer's anomaly model, if there is one"""
+        if self.anomaly_models is None or not rows:
+            return
+        try:
+            self.anomaly_models.score_rows(db, customer_id, rows)
+        except Exception as e:
+            # A broken model must not stop transactions from being saved
+            print(f"WARNING - Could not score transactions for customer {customer_id}: {e}")
+
+    def flag_arrivals(self, db: Session, customer_id: int, rows: List[Dict]) -> List[List[Dict]]:
+        """Judge rows about to be inserted against the customer's baseline, storing the flags on each row"""
+        if self.baselines is None or not rows:
+            return [[] for _ in rows]
+
+        flags = self.baselines.flag(db, customer_id, rows)
+        for row, row_flags in zip(rows, flags):
+            row['anomaly_flags'] = json.dumps(row_flags) if row_flags else None
+        return flags
+
+    def update_baseline(self, db: Session, customer_id: int):
+        """Fold the rows just inserted into the customer's baseline"""
+        if self.baselines is not None:
+            self.baselines.catch_up(db, customer_id)
+
+    def deduplicate(self, db: Session, customer_id: int, transactions: List[Dict]) -> Dict:
+        """
+        Drop duplicates within the batch and rows the customer already has
+        stored; 'new_transactions' holds what is left to save.
+        """
+        return self.incremental_deduplicator.deduplicate(db, customer_id, transactions)
+
+    def update_recurring(self, db: Session, customer_id: int, rows: List[Dict]):
+        """Re-evaluate the recurring series of the merchants in a newly inserted batch of rows"""
+        if self.recurring_detector is None:
+            return
+
+        # The detector reads the history from the database, including this batch
+        db.flush()
+        merchants = {row['merchant'] for row in rows if row.get('merchant')}
+        self.recurring_detector.update_customer(db, customer_id, merchants=merchants,
+                                                batch_start=min(row['date'] for row in rows), commit=False)
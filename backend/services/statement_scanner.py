@@ -0,0 +1,192 @@
+import re
+from typing import Dict, List, Optional
+
+NUMBER = r'\d+(?:,\d{3})*(?:\.\d{2})?'
+DATE = r'\d{2}-\d{2}-\d{4}'
+
+DATE_RE = re.compile(DATE)
+NUMBER_RE = re.compile(NUMBER)
+BLOCK_PREFIX_AMOUNT_RE = re.compile(r'(?:AED|DHS)\s*(' + NUMBER + r')', re.IGNORECASE)
+BLOCK_SUFFIX_AMOUNT_RE = re.compile(r'(' + NUMBER + r')\s*(?:AED|DHS)', re.IGNORECASE)
+MERCHANT_RE = re.compile(DATE + r'\s+([A-Z][A-Z0-9\s&\-\.]{3,40})\s+')
+
+# Every currency token, including overlapping ones such as the DHS in "AEDHS"
+CURRENCY_TOKEN_RE = re.compile(r'(?=(AED|DHS))', re.IGNORECASE)
+WHITESPACE_AMOUNT_RE = re.compile(r'\s*(' + NUMBER + r')')
+SEPARATOR_AMOUNT_RE = re.compile(r'[\s:]*(' + NUMBER + r')')
+NUMBER_FULL_RE = re.compile(NUMBER + r'\Z')
+NUMBER_CHAR_RE = re.compile(r'[\d,.]')
+
+SUMMARY_LABELS = {
+    'current_balance': 'Current Balance',
+    'minimum_payment': 'Minimum Payment Due',
+    'total_payment': 'Total Payment Due',
+    'previous_balance': 'Previous Balance',
+    # "Total Credit Limit" ends in the same "Credit Limit", so the optional prefix never changes the value
+    'credit_limit': 'Credit Limit',
+    'available_credit': 'Available Credit Limit',
+    'statement_date': 'Statement Date',
+    'due_date': 'Payment Due Date'
+}
+DATE_SUMMARY_KEYS = ('statement_date', 'due_date')
+SUMMARY_LABEL_RE = re.compile(
+    '(?=' + '|'.join(f'(?P<{key}>{re.escape(label)})' for key, label in SUMMARY_LABELS.items()) + ')',
+    re.IGNORECASE
+)
+
+
+class StatementScanner:
+    """
+    Single-pass extraction of transactions, summary amounts and AED/DHS amounts
+    from statement text. Lines are stripped and tagged once, currency tokens
+    and summary labels are each found in one scan, and every pattern is
+    precompiled. Results are identical to the original per-pattern extraction.
+    """
+
+    def scan(self, text: str) -> Dict:
+        return {
+            'transactions': self.scan_transactions(text),
+            'summary': self.scan_summary(text),
+            'aed_amounts': self.scan_currency_amounts(text)
+        }
+
+    def scan_transactions(self, text: str) -> List[dict]:
+        """Transactions from every dated line and the non-empty lines of its 5-line window"""
+        lines = text.split('\n')
+        stripped = [line.strip() for line in lines]
+        has_currency = [CURRENCY_TOKEN_RE.search(line) is not None for line in stripped]
+
+        transactions = []
+        for i, line in enumerate(lines):
+            date_match = DATE_RE.search(line)
+            if not date_match:
+                continue
+
+            window = range(i, min(i + 5, len(lines)))
+            transaction_block = [stripped[j] for j in window if stripped[j]]
+
+            # A currency token cannot span the joined lines, so blocks without one have no amounts
+            if not any(has_currency[j] for j in window):
+                continue
+
+            full_block = ' '.join(transaction_block)
+            amount_matches = BLOCK_PREFIX_AMOUNT_RE.findall(full_block)
+            if not amount_matches:
+                amount_matches = BLOCK_SUFFIX_AMOUNT_RE.findall(full_block)
+
+            if not amount_matches:
+                continue
+
+            merchant_match = MERCHANT_RE.search(full_block)
+            merchant = merchant_match.group(1).strip() if merchant_match else "Unknown Merchant"
+            transaction_date = date_match.group(0)
+
+            for amount_str in amount_matches:
+                try:
+                    amount = float(amount_str.replace(',', ''))
+                    transactions.append({
+                        'date': transaction_date,
+                        'merchant': merchant,
+                        'amount': amount,
+                        'currency': 'AED',
+                        'raw_text': full_block,
+                        'transaction_block': transaction_block
+                    })
+                except ValueError:
+                    continue
+
+        return transactions
+
+    def scan_summary(self, text: str) -> dict:
+        """Value following the first occurrence of each summary label"""
+        label_ends = {}
+        for match in SUMMARY_LABEL_RE.finditer(text):
+            key = match.lastgroup
+            if key not in label_ends:
+                label_ends[key] = match.end(key)
+                if len(label_ends) == len(SUMMARY_LABELS):
+                    break
+
+        summary = {}
+        for key in SUMMARY_LABELS:
+            if key not in label_ends:
+                continue
+            value_re = DATE_RE if key in DATE_SUMMARY_KEYS else NUMBER_RE
+            match = value_re.search(text, label_ends[key])
+            if not match:
+                continue
+
+            value = match.group(0)
+            if key in DATE_SUMMARY_KEYS:
+                summary[key] = value
+            else:
+                try:
+                    summary[key] = float(value.replace(',', ''))
+                except ValueError:
+                    summary[key] = value
+
+        return summary
+
+    def scan_currency_amounts(self, text: str) -> List[dict]:
+        """Unique AED/DHS amounts, each with the first match that produced it"""
+        # Matches grouped the way the original pattern list reported them:
+        # AED n, DHS n, n AED, n DHS, AED/DHS[:] n, n AED/DHS
+        groups = [[], [], [], [], [], []]
+
+        for token in CURRENCY_TOKEN_RE.finditer(text):
+            start = token.start()
+            end = start + len(token.group(1))
+            is_dhs = token.group(1)[0] in 'dD'
+
+            forward = WHITESPACE_AMOUNT_RE.match(text, end)
+            if forward:
+                groups[1 if is_dhs else 0].append((start, forward.end(), forward.group(1)))
+
+            separated = SEPARATOR_AMOUNT_RE.match(text, end)
+            if separated:
+                groups[4].append((start, separated.end(), separated.group(1)))
+
+            backward = self._amount_before(text, start)
+            if backward:
+                groups[3 if is_dhs else 2].append((backward[0], end, backward[1]))
+                groups[5].append((backward[0], end, backward[1]))
+
+        unique_amounts = []
+        seen = set()
+        for group in groups:
+            for match_start, match_end, amount_str in group:
+                try:
+                    amount = float(amount_str.replace(',', ''))
+                except ValueError:
+                    continue
+                key = (amount, 'AED')
+                if key in seen:
+                    continue
+                seen.add(key)
+                unique_amounts.append({
+                    'amount': amount,
+                    'currency': 'AED',
+                    'raw_match': text[match_start:match_end],
+                    'context': text[max(0, match_start-50):match_end+50]
+                })
+
+        return unique_amounts
+
+    def _amount_before(self, text: str, token_start: int) -> Optional[tuple]:
+        """
+        The leftmost number that ends just before the whitespace preceding a
+        currency token, as a left-to-right regex scan would report it.
+        """
+        number_end = token_start
+        while number_end > 0 and text[number_end - 1].isspace():
+            number_end -= 1
+
+        run_start = number_end
+        while run_start > 0 and NUMBER_CHAR_RE.match(text, run_start - 1):
+            run_start -= 1
+
+        for number_start in range(run_start, number_end):
+            if NUMBER_FULL_RE.match(text[number_start:number_end]):
+                return number_start, text[number_start:number_end]
+
+        return None
@@ -0,0 +1,111 @@
+import math
+from bisect import bisect_right, insort
+from typing import Dict, List, Optional
+
+
+class RunningStats:
+    """Count, mean and variance of a stream of values with Welford's algorithm"""
+
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = count
+        self.mean = mean
+        # Sum of squared deviations from the running mean
+        self.m2 = m2
+
+    def push(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def std(self, sample: bool = False) -> float:
+        """Population standard deviation, or the sample one (ddof=1) when sample is set"""
+        denominator = self.count - 1 if sample else self.count
+        return math.sqrt(self.m2 / denominator) if denominator > 0 else 0.0
+
+    def copy(self) -> 'RunningStats':
+        return RunningStats(self.count, self.mean, self.m2)
+
+
+class P2Quantile:
+    """
+    Streaming estimate of one quantile with the P-square algorithm (Jain and
+    Chlamtac): five markers whose heights track the minimum, p/2, p, (1+p)/2
+    quantiles and the maximum, adjusted with a piecewise-parabolic formula.
+    Constant memory and O(1) work per value. Until five values have been
+    seen the quantile is computed exactly from them.
+    """
+
+    def __init__(self, p: float, heights: Optional[List[float]] = None,
+                 positions: Optional[List[float]] = None, desired: Optional[List[float]] = None):
+        self.p = p
+        self.heights = list(heights or [])
+        self.positions = list(positions or [1, 2, 3, 4, 5])
+        self.desired = list(desired or [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5])
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    @property
+    def count(self) -> int:
+        return len(self.heights) if len(self.heights) < 5 else int(self.positions[4])
+
+    def push(self, value: float):
+        q = self.heights
+        if len(q) < 5:
+            insort(q, value)
+            return
+
+        n = self.positions
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = bisect_right(q, value) - 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self) -> Optional[float]:
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:
+            # Linear interpolation between the closest ranks, like np.percentile
+            rank = self.p * (len(q) - 1)
+            lower = int(math.floor(rank))
+            upper = min(lower + 1, len(q) - 1)
+            return q[lower] + (q[upper] - q[lower]) * (rank - lower)
+        return q[2]
+
+    def to_dict(self) -> Dict:
+        return {'p': self.p, 'heights': self.heights, 'positions': self.positions, 'desired': self.desired}
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> 'P2Quantile':
+        return cls(state['p'], state['heights'], state['positions'], state['desired'])
+
+    def copy(self) -> 'P2Quantile':
+        return P2Quantile.from_dict(self.to_dict())
@@ -4,6 +4,7 @@ import hashlib
 import json
 from dataclasses import dataclass
 from collections import defaultdict
+from bisect import bisect_left, bisect_right
 
 
 @dataclass
@@ -15,6 +16,139 @@ class TransactionMatch:
     match_criteria: List[str]
 
 
+def _freeze(value):
+    """Hashable stand-in for a field value, equal exactly when the values are equal"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+class DuplicateBlockingIndex:
+    """
+    Candidate index for duplicate detection. Two transactions can only be
+    duplicates when they share the exact (date, amount, currency, merchant)
+    key, the same raw text, the same transaction block, or the same amount
+    and currency with dates at most 7 days apart; transactions are bucketed
+    on those keys so every other pair is never looked at.
+    """
+    
+    # Widest date window of any duplicate rule
+    MAX_DATE_WINDOW_DAYS = 7
+    
+    def __init__(self, transactions: List[Dict[str, Any]], normalize_merchant):
+        count = len(transactions)
+        self.amounts = [t.get('amount') for t in transactions]
+        self.currencies = [t.get('currency') for t in transactions]
+        self.dates = [t.get('date') for t in transactions]
+        self.exact_keys = [_freeze((t.get('date'), t.get('amount'), t.get('currency'), t.get('merchant')))
+                           for t in transactions]
+        self.raw_texts = [_freeze(t.get('raw_text')) for t in transactions]
+        self.blocks = [_freeze(t.get('transaction_block')) for t in transactions]
+        
+        # Normalized merchant, or None when there is no merchant to compare
+        normalized = {}
+        self.merchants = []
+        for t in transactions:
+            merchant = t.get('merchant')
+            if not merchant:
+                self.merchants.append(None)
+                continue
+            if merchant not in normalized:
+                normalized[merchant] = normalize_merchant(merchant)
+            self.merchants.append(normalized[merchant])
+        
+        # Day number of each DD-MM-YYYY date; None when missing or unparseable
+        parsed = {}
+        self.days = []
+        for date in self.dates:
+            if date and isinstance(date, str):
+                if date not in parsed:
+                    try:
+                        parsed[date] = datetime.strptime(date, '%d-%m-%Y').toordinal()
+                    except ValueError:
+                        parsed[date] = None
+                self.days.append(parsed[date])
+            else:
+                self.days.append(None)
+        
+        self.buckets = defaultdict(list)
+        self.dated_buckets = defaultdict(list)
+        for i in range(count):
+            self.buckets[('exact', self.exact_keys[i])].append(i)
+            if self.raw_texts[i]:
+                self.buckets[('raw_text', self.raw_texts[i])].append(i)
+            if self.blocks[i]:
+                self.buckets[('block', self.blocks[i])].append(i)
+            if self.merchants[i] is not None and self.dates[i]:
+                amount_key = (_freeze(self.amounts[i]), _freeze(self.currencies[i]))
+                if self.days[i] is not None:
+                    self.dated_buckets[amount_key].append((self.days[i], i))
+                else:
+                    # Dates that do not parse only match the identical string
+                    self.buckets[('undated', amount_key, _freeze(self.dates[i]))].append(i)
+        
+        self._bucket_keys = defaultdict(list)
+        for key, members in self.buckets.items():
+            if len(members) > 1:
+                for i in members:
+                    self._bucket_keys[i].append(key)
+        
+        self._windows = {}
+        self._amount_keys = {}
+        for amount_key, members in self.dated_buckets.items():
+            if len(members) > 1:
+                members.sort()
+                days = [day for day, _ in members]
+                for i in (i for _, i in members):
+                    self._amount_keys[i] = amount_key
+                self._windows[amount_key] = (days, [i for _, i in members])
+    
+    def candidates(self, i: int) -> List[int]:
+        """Later transactions sharing at least one blocking key with transaction i, in order"""
+        found = set()
+        for key in self._bucket_keys.get(i, ()):
+            members = self.buckets[key]
+            found.update(members[bisect_right(members, i):])
+        
+        amount_key = self._amount_keys.get(i)
+        if amount_key is not None:
+            days, members = self._windows[amount_key]
+            day = self.days[i]
+            low = bisect_left(days, day - self.MAX_DATE_WINDOW_DAYS)
+            high = bisect_right(days, day + self.MAX_DATE_WINDOW_DAYS)
+            found.update(j for j in members[low:high] if j > i)
+        
+        return sorted(found)
+    
+    def matches(self, i: int, j: int) -> bool:
+        """Same decision as TransactionDeduplicator._are_transactions_duplicates, on the parsed fields"""
+        # Exact match on date, amount, currency and merchant
+        if self.exact_keys[i] == self.exact_keys[j]:
+            return True
+        
+        # Same raw_text or transaction_block
+        if self.raw_texts[i] and self.raw_texts[i] == self.raw_texts[j]:
+            return True
+        if self.blocks[i] and self.blocks[i] == self.blocks[j]:
+            return True
+        
+        # Same amount and currency, similar merchant, dates within 7 days (covers the 2-day fuzzy rule)
+        if self.amounts[i] != self.amounts[j] or self.currencies[i] != self.currencies[j]:
+            return False
+        
+        m1, m2 = self.merchants[i], self.merchants[j]
+        if m1 is None or m2 is None or not (m1 == m2 or m1 in m2 or m2 in m1):
+            return False
+        
+        if not self.dates[i] or not self.dates[j]:
+            return False
+        if self.days[i] is None or self.days[j] is None:
+            return self.dates[i] == self.dates[j]
+        return abs(self.days[i] - self.days[j]) <= self.MAX_DATE_WINDOW_DAYS
+
+
 class TransactionDeduplicator:
     """
     Advanced transaction deduplication service that identifies and removes duplicate transactions
@@ -78,29 +212,30 @@ class TransactionDeduplicator:
         }
     
     def _find_duplicate_groups(self, transactions: List[Dict[str, Any]]) -> List[List[int]]:
-        """Find groups of duplicate transactions"""
+        """
+        Find groups of duplicate transactions. Each transaction not yet grouped
+        claims, in order, every later ungrouped transaction it matches. Only
+        candidates sharing a blocking key are compared, using dates and
+        merchant names parsed once per transaction.
+        """
+        index = DuplicateBlockingIndex(transactions, self._normalize_merchant_name)
         duplicate_groups = []
-        processed_indices = set()
+        processed = [False] * len(transactions)
         
-        for i, transaction in enumerate(transactions):
-            if i in processed_indices:
+        for i in range(len(transactions)):
+            if processed[i]:
                 continue
-                
-            # Find all transactions that match this one
-            current_group = [i]
             
-            for j in range(i + 1, len(transactions)):
-                if j in processed_indices:
-                    continue
-                    
-                if self._are_transactions_duplicates(transaction, transactions[j]):
+            current_group = [i]
+            for j in index.candidates(i):
+                if not processed[j] and index.matches(i, j):
                     current_group.append(j)
-                    processed_indices.add(j)
+                    processed[j] = True
             
             # Only add groups with more than one transaction
             if len(current_group) > 1:
                 duplicate_groups.append(current_group)
-                processed_indices.update(current_group)
+                processed[i] = True
         
         return duplicate_groups
     
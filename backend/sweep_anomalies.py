@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Nightly anomaly sweep over every customer.
+
+Runs AnomalyDetector for all customers across a pool of worker processes
+and stores what it finds in the anomalies table, replacing each customer's
+results from the previous sweep. Progress is checkpointed after every
+chunk of customers, so an interrupted sweep resumes where it stopped. The
+database is switched to WAL mode first, so the API keeps reading and
+writing while the sweep runs.
+
+Usage:
+    python sweep_anomalies.py [--workers 4] [--chunk-size 100]
+        [--checkpoint path] [--restart]
+"""
+import os
+import sys
+import argparse
+
+from database import engine
+from migrations import run_migrations
+from services.anomaly_sweep import AnomalySweep
+
+
+def enable_wal():
+    """Readers and the single writer no longer block each other; the mode persists in the file"""
+    if engine.dialect.name != 'sqlite':
+        return None
+    with engine.connect() as connection:
+        return connection.exec_driver_sql("PRAGMA journal_mode=WAL").scalar()
+
+
+def print_summary(stats):
+    elapsed = stats['elapsed']
+    customers = stats['customers']
+    print("\n" + "=" * 50)
+    print("Anomaly Sweep Summary")
+    print("=" * 50)
+    print(f"Sweep: {stats['sweep_id']}" + (f" (resumed after customer {stats['resumed_after']})"
+                                          if stats['resumed_after'] else ""))
+    print(f"Customers swept: {customers}")
+    print(f"Customers failed: {stats['customers_failed']}")
+    if stats['failed_customer_ids']:
+        failed = stats['failed_customer_ids']
+        print(f"  still failing: {', '.join(map(str, failed[:20]))}" + (" ..." if len(failed) > 20 else ""))
+    print(f"Transactions analyzed: {stats['transactions']}")
+    print(f"Anomalies stored: {stats['anomalies']}")
+    for anomaly_type, count in stats['by_type'].most_common():
+        print(f"  {anomaly_type:<18} {count}")
+    print(f"Elapsed: {elapsed:.2f}s")
+    if elapsed > 0:
+        print(f"Throughput: {customers / elapsed:.2f} customers/s, "
+              f"{stats['transactions'] / elapsed:.1f} transactions/s")
+
+    print("\nStage timings (total seconds, detection summed across processes):")
+    for stage, seconds in stats['timings'].items():
+        average = seconds / customers if customers else 0.0
+        print(f"  {stage:<8} {seconds:8.2f}s  ({average * 1000:.1f} ms/customer)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect and store anomalies for every customer")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Detection processes; 0 detects in this process (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=100,
+                        help="Customers read and checkpointed at a time (default: 100)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file (default: ANOMALY_SWEEP_CHECKPOINT or .anomaly_sweep_checkpoint.json)")
+    parser.add_argument("--restart", action="store_true", help="Start a new sweep even if the last one was interrupted")
+    args = parser.parse_args()
+
+    run_migrations(engine)
+    journal_mode = enable_wal()
+    if journal_mode is not None:
+        print(f"DEBUG - SQLite journal mode: {journal_mode}")
+
+    sweep = AnomalySweep(workers=max(0, args.workers), chunk_size=max(1, args.chunk_size),
+                         checkpoint_path=args.checkpoint)
+    checkpoint = None if args.restart else sweep.load_checkpoint()
+    if checkpoint and not checkpoint.get('finished_at'):
+        print(f"Resuming sweep {checkpoint['sweep_id']} after customer {checkpoint['last_customer_id']}")
+
+    try:
+        stats = sweep.run(restart=args.restart)
+    except KeyboardInterrupt:
+        checkpoint = sweep.load_checkpoint() or {}
+        print(f"\nInterrupted, the sweep resumes after customer {checkpoint.get('last_customer_id', 0)}")
+        return 130
+
+    print_summary(stats)
+    return 0 if not stats['failed_customer_ids'] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test script for the vectorized anomaly detectors and the cached transaction frames
+"""
+
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Transaction
+from services.anomaly_detector import AnomalyDetector
+
+
+def memory_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def history():
+    start = datetime(2024, 3, 1, 12, 0)
+    rows = [
+        {'id': i + 1, 'date': start + timedelta(days=i), 'amount': 40.0 + i % 5,
+         'merchant': 'CARREFOUR' if i % 2 else 'TALABAT', 'category': 'Groceries', 'description': ''}
+        for i in range(30)
+    ]
+    rows.append({'id': 31, 'date': datetime(2024, 4, 2, 3, 15), 'amount': 4200.0,
+                 'merchant': 'GOLD SOUK', 'category': 'Shopping', 'description': ''})
+    return rows
+
+
+def test_detects_outliers_once_per_transaction():
+    detector = AnomalyDetector()
+    anomalies = detector.detect_anomalies(history())
+
+    flagged = [a['transaction_id'] for a in anomalies]
+    assert 31 in flagged
+    assert len(flagged) == len(set(flagged))
+    scores = [a['score'] for a in anomalies]
+    assert scores == sorted(scores, reverse=True)
+
+    assert detector.detect_anomalies(history()[:5]) == []
+
+
+def test_pages_follow_the_full_report():
+    detector = AnomalyDetector()
+    frame = detector._prepare_dataframe(history())
+    anomalies = detector.detect_anomalies_frame(frame)
+    assert len(anomalies) > 2
+
+    pages = [detector.detect_anomalies_page(frame, limit=2, offset=offset) for offset in range(0, len(anomalies), 2)]
+    assert {page['total_anomalies'] for page in pages} == {len(anomalies)}
+    assert [a for page in pages for a in page['anomalies']] == anomalies
+    assert detector.detect_anomalies_page(frame, offset=len(anomalies))['anomalies'] == []
+
+
+def test_orm_rows_and_cached_frames_agree():
+    db = memory_session()
+    for row in history():
+        db.add(Transaction(customer_id=1, **row))
+    db.commit()
+
+    detector = AnomalyDetector()
+    orm_rows = db.query(Transaction).filter(Transaction.customer_id == 1).all()
+    expected = [(a['transaction_id'], a['anomaly_type']) for a in detector.detect_anomalies(orm_rows)]
+
+    frame = detector.load_transactions(db, 1)
+    assert detector.load_transactions(db, 1) is frame
+    anomalies = detector.detect_anomalies_frame(frame)
+    assert [(a['transaction_id'], a['anomaly_type']) for a in anomalies] == expected
+    assert anomalies[0]['transaction']['merchant'] == 'GOLD SOUK'
+
+    # Rows added later are read on their own and appended to the cached frame
+    db.add(Transaction(customer_id=1, date=datetime(2024, 4, 3, 12, 0), amount=41.0,
+                       merchant='TALABAT', category='Groceries'))
+    db.add(Transaction(customer_id=1, date=datetime(2024, 4, 3, 13, 0), amount=12.0,
+                       merchant='ZOOM', category=None))
+    db.commit()
+    updated = detector.load_transactions(db, 1)
+    assert len(updated) == len(frame) + 2
+    assert updated['id'].tolist() == sorted(updated['id'].tolist())
+    # The appended rows continue the cached codes, as coding the whole frame would
+    for column in ('merchant', 'category'):
+        assert updated[f'{column}_code'].tolist() == pd.factorize(updated[column])[0].tolist()
+    assert detector.load_transactions(db, 2).empty
+
+
+if __name__ == "__main__":
+    test_detects_outliers_once_per_transaction()
+    test_pages_follow_the_full_report()
+    test_orm_rows_and_cached_frames_agree()
+    print("Anomaly detector tests passed")
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Test script for persisted per-customer anomaly models
+"""
+
+import os
+import tempfile
+
+import joblib
+import numpy as np
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Transaction, AnomalyModelVersion
+from services.anomaly_detector import AnomalyDetector
+from services.anomaly_features import TransactionFeatureEncoder
+from services.anomaly_model_store import AnomalyModelStore
+from services.statement_ingestion import StatementIngestionService
+
+
+def memory_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def add_history(db, customer_id=1, days=60):
+    start = datetime(2024, 1, 1, 12, 0)
+    for i in range(days):
+        db.add(Transaction(customer_id=customer_id, date=start + timedelta(days=i, minutes=i % 7),
+                           amount=30.0 + i % 6, merchant='CARREFOUR' if i % 2 else 'TALABAT',
+                           category='Groceries' if i % 2 else 'Food & Dining'))
+        if i % 20 == 19:
+            # A rare large purchase at night
+            db.add(Transaction(customer_id=customer_id, date=start + timedelta(days=i, hours=-9),
+                               amount=2000.0 + i, merchant='GOLD SOUK', category='Shopping'))
+    db.commit()
+
+
+def test_train_rescores_and_versions():
+    db = memory_session()
+    add_history(db)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        store = AnomalyModelStore(model_dir=model_dir, training_workers=0, versions_kept=2)
+        assert store.training_status(db, 1)['retrain_reason'] == 'no_model'
+        assert store.retrain_if_due(db, 1)['training'] is False
+
+        first = store.train(db, 1)
+        assert first.version == 1 and first.training_rows == 63
+        assert os.path.exists(first.path)
+        assert db.query(Transaction).filter(Transaction.anomaly_score.is_(None)).count() == 0
+        assert len(store.stored_scores(db, 1)) == db.query(Transaction).filter(Transaction.is_anomaly == True).count()
+        assert store.training_status(db, 1)['retrain_reason'] is None
+
+        for expected in (2, 3):
+            assert store.train(db, 1).version == expected
+        # Only the newest versions and their artifacts are kept
+        versions = [v for v, in db.query(AnomalyModelVersion.version).order_by(AnomalyModelVersion.version)]
+        assert versions == [2, 3]
+        assert not os.path.exists(first.path)
+
+        # Too few transactions: no model
+        assert store.train(db, 2) is None
+
+
+def test_ingest_scores_new_transactions():
+    db = memory_session()
+    add_history(db)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        store = AnomalyModelStore(model_dir=model_dir, training_workers=0)
+        store.train(db, 1)
+        ingestion = StatementIngestionService(anomaly_models=store)
+
+        saved = ingestion.store_categorized_transactions(db, 1, [
+            {'date': datetime(2024, 4, 10, 12, 0), 'merchant': 'CARREFOUR', 'amount': 32.5, 'category': 'Groceries'},
+            {'date': datetime(2024, 2, 25, 3, 30), 'merchant': 'GOLD SOUK', 'amount': 2050.0, 'category': 'Shopping'},
+        ])
+        db.commit()
+        assert len(saved) == 2
+
+        rows = {t.merchant: t for t in db.query(Transaction).filter(Transaction.id > 63)}
+        assert rows['GOLD SOUK'].is_anomaly and not rows['CARREFOUR'].is_anomaly
+        assert rows['GOLD SOUK'].anomaly_score < rows['CARREFOUR'].anomaly_score
+
+        # The endpoint reports the stored flag instead of refitting
+        detector = AnomalyDetector()
+        anomalies = detector.detect_anomalies_frame(detector.load_transactions(db, 1),
+                                                    stored_scores=store.stored_scores(db, 1))
+        assert rows['GOLD SOUK'].id in {a['transaction_id'] for a in anomalies}
+        assert 'ml_anomaly' in {a['anomaly_type'] for a in anomalies}
+
+
+def test_retrain_thresholds():
+    db = memory_session()
+    add_history(db)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        store = AnomalyModelStore(model_dir=model_dir, training_workers=0, min_rows=21, retrain_fraction=0.5)
+        store.train(db, 1)
+
+        # Unscored rows count towards the row threshold: 32 new rows for 63 trained
+        add_history(db, days=29)
+        assert store.training_status(db, 1)['retrain_reason'] is None
+        add_history(db, days=2)
+        assert store.training_status(db, 1)['retrain_reason'] == 'row_count'
+
+        # New rows the model flags far more often than in training
+        store.train(db, 1)
+        for i in range(20):
+            db.add(Transaction(customer_id=1, date=datetime(2024, 5, 1), amount=5000.0 + i,
+                               merchant='UNKNOWN', is_anomaly=True, anomaly_score=-0.7))
+        db.commit()
+        assert store.training_status(db, 1)['retrain_reason'] == 'drift'
+
+
+def test_claimed_version_is_not_trained_twice():
+    db = memory_session()
+    add_history(db)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        store = AnomalyModelStore(model_dir=model_dir, training_workers=0)
+        first = store.train(db, 1)
+        add_history(db)
+
+        # Another trainer has claimed v2 and is still rescoring with it
+        other = AnomalyModelStore(model_dir=model_dir, training_workers=0)
+        claim = other._claim(db, 1)
+        assert claim.version == 2 and claim.status == 'training'
+        status = store.retrain_if_due(db, 1)
+        assert status['training'] is True and status['retrain_reason'] is None
+        assert store.active_version(db, 1).version == first.version
+
+        # A second trainer neither takes the version nor writes its artifact
+        assert store.train(db, 1) is None
+        assert os.listdir(os.path.join(model_dir, "customer_1")) == ["v1.joblib"]
+        assert db.query(AnomalyModelVersion).count() == 2
+
+        # A claim left behind by a trainer that died is released after the timeout
+        expired = AnomalyModelStore(model_dir=model_dir, training_workers=0, training_timeout=0)
+        assert expired.training_status(db, 1)['retrain_reason'] == 'row_count'
+        record = expired.train(db, 1)
+        assert record.version == 3 and record.status == 'active'
+        assert store.active_version(db, 1).version == 3
+        assert [v for v, in db.query(AnomalyModelVersion.version).order_by(AnomalyModelVersion.version)] == [1, 3]
+
+
+def test_failed_training_releases_its_claim():
+    db = memory_session()
+    add_history(db)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        store = AnomalyModelStore(model_dir=model_dir, training_workers=0)
+
+        def fail(db, customer_id, model):
+            raise RuntimeError("rescore failed")
+
+        store.rescore = fail
+        try:
+            store.train(db, 1)
+            assert False, "the failed rescore was not raised"
+        except RuntimeError:
+            pass
+        assert db.query(AnomalyModelVersion).count() == 0
+        assert store.training_status(db, 1)['retrain_reason'] == 'no_model'
+
+        del store.rescore
+        assert store.train(db, 1).version == 1
+
+
+def test_feature_width_is_bounded():
+    encoder = TransactionFeatureEncoder(top_merchants=4, merchant_buckets=8, top_categories=2, category_buckets=2)
+    merchants = [f'SHOP {i % 5000}' for i in range(20000)] + ['CARREFOUR'] * 10 + [None]
+    categories = ['Groceries'] * len(merchants)
+    features = encoder.fit_transform(np.ones((len(merchants), 5)), merchants, categories)
+
+    assert features.shape == (len(merchants), encoder.n_features) == (len(merchants), 21)
+    # Five numeric values plus one merchant and one category column per row
+    assert features.nnz == 7 * len(merchants) - 1
+    assert encoder.merchants[0] == 'CARREFOUR' and len(encoder.merchants) == 4
+
+    # Unseen merchants land in the same hashed bucket after a round trip
+    restored = TransactionFeatureEncoder.from_dict(encoder.to_dict())
+    unseen = encoder.transform(np.ones((1, 5)), ['NEW SHOP'], ['Travel'])
+    assert (restored.transform(np.ones((1, 5)), ['NEW SHOP'], ['Travel']) != unseen).nnz == 0
+
+
+def test_unreadable_model_is_retrained():
+    db = memory_session()
+    add_history(db)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        store = AnomalyModelStore(model_dir=model_dir, training_workers=0)
+        record = store.train(db, 1)
+        artifact = joblib.load(record.path)
+        artifact['format_version'] = 1
+        joblib.dump(artifact, record.path)
+
+        assert AnomalyModelStore(model_dir=model_dir, training_workers=0) \
+            .training_status(db, 1)['retrain_reason'] == 'unreadable'
+
+
+if __name__ == "__main__":
+    test_train_rescores_and_versions()
+    test_ingest_scores_new_transactions()
+    test_retrain_thresholds()
+    test_claimed_version_is_not_trained_twice()
+    test_failed_training_releases_its_claim()
+    test_feature_width_is_bounded()
+    test_unreadable_model_is_retrained()
+    print("Anomaly model tests passed")
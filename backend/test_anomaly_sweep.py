@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Test script for the fleet-wide anomaly sweep
+"""
+
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Customer, Transaction, Anomaly
+from services import anomaly_sweep
+from services.anomaly_sweep import AnomalySweep
+
+
+def memory_session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def add_customers(session_factory, count=3):
+    db = session_factory()
+    start = datetime(2024, 3, 1, 12, 0)
+    for c in range(count):
+        customer = Customer(name=f"Customer {c}", email=f"customer{c}@example.com")
+        db.add(customer)
+        db.flush()
+        for i in range(30):
+            db.add(Transaction(customer_id=customer.id, date=start + timedelta(days=i), amount=40.0 + i % 5,
+                               merchant='CARREFOUR' if i % 2 else 'TALABAT', category='Groceries'))
+        db.add(Transaction(customer_id=customer.id, date=datetime(2024, 4, 2, 3, 15), amount=4200.0,
+                           merchant='GOLD SOUK', category='Shopping'))
+    # Too little history to judge
+    db.add(Customer(name="New Customer", email="new@example.com"))
+    db.commit()
+    db.close()
+
+
+def test_sweep_stores_anomalies_per_customer():
+    session_factory = memory_session_factory()
+    add_customers(session_factory)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sweep = AnomalySweep(session_factory=session_factory, workers=0, chunk_size=2,
+                             checkpoint_path=os.path.join(tmp, "sweep.json"))
+        stats = sweep.run()
+        assert stats['finished'] and stats['customers'] == 4 and stats['customers_failed'] == 0
+        assert sweep.load_checkpoint()['last_customer_id'] == 4
+
+        db = session_factory()
+        anomalies = db.query(Anomaly).all()
+        assert len(anomalies) == stats['anomalies'] > 0
+        assert {a.sweep_id for a in anomalies} == {stats['sweep_id']}
+        outliers = db.query(Anomaly).join(Transaction, Anomaly.transaction_id == Transaction.id) \
+            .filter(Transaction.merchant == 'GOLD SOUK').all()
+        assert sorted(a.customer_id for a in outliers) == [1, 2, 3]
+        assert all(a.description and a.score > 0 for a in outliers)
+        db.close()
+
+        # The next sweep replaces the results instead of adding to them
+        again = sweep.run()
+        assert again['sweep_id'] != stats['sweep_id'] and again['anomalies'] == stats['anomalies']
+        db = session_factory()
+        assert db.query(Anomaly).count() == stats['anomalies']
+        assert {a.sweep_id for a in db.query(Anomaly)} == {again['sweep_id']}
+        db.close()
+
+
+def test_interrupted_sweep_resumes_after_checkpoint():
+    session_factory = memory_session_factory()
+    add_customers(session_factory)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sweep = AnomalySweep(session_factory=session_factory, workers=0, chunk_size=2,
+                             checkpoint_path=os.path.join(tmp, "sweep.json"))
+        sweep.save_checkpoint({'sweep_id': 'interrupted', 'started_at': datetime.utcnow().isoformat(),
+                               'last_customer_id': 2, 'finished_at': None})
+
+        stats = sweep.run()
+        assert stats['sweep_id'] == 'interrupted' and stats['resumed_after'] == 2
+        assert stats['customers'] == 2
+
+        db = session_factory()
+        assert {a.customer_id for a in db.query(Anomaly)} == {3}
+        db.close()
+
+        assert sweep.run(restart=True)['customers'] == 4
+
+
+def test_failed_customers_are_retried_on_resume():
+    session_factory = memory_session_factory()
+    add_customers(session_factory)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sweep = AnomalySweep(session_factory=session_factory, workers=0, chunk_size=2,
+                             checkpoint_path=os.path.join(tmp, "sweep.json"))
+        previous = sweep.run()
+        detect_customer = sweep.detect_customer
+        calls = []
+
+        def flaky(customer_id):
+            calls.append(customer_id)
+            if customer_id == 2 and calls.count(2) == 1:
+                return {'customer_id': 2, 'transactions': 0, 'anomalies': [], 'seconds': 0.0, 'error': 'locked'}
+            if customer_id == 3 and calls.count(3) == 1:
+                raise KeyboardInterrupt()
+            return detect_customer(customer_id)
+
+        sweep.detect_customer = flaky
+        try:
+            sweep.run(restart=True)
+            assert False, "the sweep was not interrupted"
+        except KeyboardInterrupt:
+            pass
+        checkpoint = sweep.load_checkpoint()
+        assert checkpoint['last_customer_id'] == 2 and checkpoint['failed_customer_ids'] == [2]
+
+        # Customer 2 still has the anomalies of the previous sweep until the retry replaces them
+        db = session_factory()
+        assert {a.sweep_id for a in db.query(Anomaly).filter(Anomaly.customer_id == 2)} == {previous['sweep_id']}
+        db.close()
+
+        stats = sweep.run()
+        assert stats['finished'] and stats['failed_customer_ids'] == []
+        assert calls[-3:] == [2, 3, 4] and stats['customers'] == 3
+        db = session_factory()
+        assert {a.sweep_id for a in db.query(Anomaly)} == {checkpoint['sweep_id']}
+        db.close()
+
+
+def _dying_sweep_customer(customer_id):
+    # Customer 2 kills its worker on the first attempt, customer 4 on every attempt
+    marker = os.path.join(os.environ['SWEEP_TEST_DIR'], f"died-{customer_id}")
+    if customer_id == 4 or (customer_id == 2 and not os.path.exists(marker)):
+        open(marker, 'w').close()
+        os._exit(1)
+    return {'customer_id': customer_id, 'transactions': 1, 'anomalies': [], 'seconds': 0.0, 'error': None}
+
+
+def test_customers_pending_when_the_pool_breaks_are_retried():
+    session_factory = memory_session_factory()
+    add_customers(session_factory)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['SWEEP_TEST_DIR'] = tmp
+        original = anomaly_sweep._sweep_customer
+        anomaly_sweep._sweep_customer = _dying_sweep_customer
+        try:
+            sweep = AnomalySweep(session_factory=session_factory, workers=1, chunk_size=4,
+                                 checkpoint_path=os.path.join(tmp, "sweep.json"))
+            stats = sweep.run()
+        finally:
+            anomaly_sweep._sweep_customer = original
+            os.environ.pop('SWEEP_TEST_DIR')
+
+        # Only the customer that kills every worker fails; the rest are saved on a fresh pool
+        assert stats['customers'] == 3 and stats['customers_failed'] == 1
+        assert stats['failed_customer_ids'] == [4]
+        assert sweep.load_checkpoint()['failed_customer_ids'] == [4]
+
+
+if __name__ == "__main__":
+    test_sweep_stores_anomalies_per_customer()
+    test_interrupted_sweep_resumes_after_checkpoint()
+    test_failed_customers_are_retried_on_resume()
+    test_customers_pending_when_the_pool_breaks_are_retried()
+    print("Anomaly sweep tests passed")
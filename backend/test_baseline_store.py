@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Test script for the streaming per-customer baselines used to flag transactions on arrival
+"""
+
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Transaction, CustomerBaseline, CategoryBaseline, MerchantSighting
+from services.baseline_store import OnlineBaselineStore
+from services.statement_ingestion import StatementIngestionService
+from services.streaming_stats import RunningStats, P2Quantile
+
+
+def memory_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def test_streaming_stats_track_numpy():
+    values = np.random.default_rng(7).lognormal(3.5, 0.8, 5000)
+    stats = RunningStats()
+    quantiles = {p: P2Quantile(p) for p in (0.25, 0.5, 0.75, 0.9)}
+    for value in values.tolist():
+        stats.push(value)
+        for quantile in quantiles.values():
+            quantile.push(value)
+
+    assert abs(stats.mean - values.mean()) < 1e-9
+    assert abs(stats.std() - values.std()) < 1e-9
+    assert abs(stats.std(sample=True) - values.std(ddof=1)) < 1e-9
+    for p, quantile in quantiles.items():
+        assert abs(quantile.value() - np.quantile(values, p)) / np.quantile(values, p) < 0.03
+
+    # Exact below five values, and the state survives a round trip
+    few = P2Quantile(0.75)
+    for value in (5.0, 1.0, 3.0):
+        few.push(value)
+    assert few.value() == np.quantile([5.0, 1.0, 3.0], 0.75)
+    assert P2Quantile.from_dict(quantiles[0.5].to_dict()).value() == quantiles[0.5].value()
+
+
+def test_catch_up_folds_each_row_once():
+    db = memory_session()
+    start = datetime(2024, 1, 1, 12, 0)
+    amounts = [20.0 + i % 9 for i in range(40)]
+    for i, amount in enumerate(amounts):
+        db.add(Transaction(customer_id=1, date=start + timedelta(days=i), amount=amount,
+                           merchant='CARREFOUR #12' if i % 2 else 'TALABAT', category='Groceries'))
+    db.commit()
+
+    store = OnlineBaselineStore()
+    store.catch_up(db, 1)
+    store.catch_up(db, 1)
+    db.commit()
+
+    baseline = db.query(CustomerBaseline).filter(CustomerBaseline.customer_id == 1).one()
+    assert baseline.transaction_count == 40
+    assert abs(baseline.amount_mean - np.mean(amounts)) < 1e-9
+    groceries = db.query(CategoryBaseline).filter(CategoryBaseline.category == 'Groceries').one()
+    assert groceries.transaction_count == 40
+    sightings = {s.merchant_key: s.transaction_count for s in db.query(MerchantSighting)}
+    assert sightings == {'carrefour': 20, 'talabat': 20}
+
+    db.add(Transaction(customer_id=1, date=start, amount=25.0, merchant='TALABAT', category='Groceries'))
+    db.commit()
+    store.catch_up(db, 1)
+    db.commit()
+    assert db.query(MerchantSighting).filter(MerchantSighting.merchant_key == 'talabat').one().transaction_count == 21
+    assert db.query(CustomerBaseline).one().transaction_count == 41
+
+
+def test_transactions_flagged_on_arrival():
+    db = memory_session()
+    ingestion = StatementIngestionService(baselines=OnlineBaselineStore())
+    start = datetime(2024, 1, 1, 12, 0)
+
+    history = [
+        {'date': start + timedelta(days=i), 'amount': 40.0 + i % 7, 'merchant': f'SHOP {i % 3}',
+         'category': 'Groceries', 'raw_text': f'purchase {i}'}
+        for i in range(30)
+    ]
+    saved = ingestion.store_categorized_transactions(db, 1, history)
+    db.commit()
+    assert len(saved) == 30 and not any(t['anomaly_flags'] for t in saved)
+
+    arrivals = ingestion.store_categorized_transactions(db, 1, [
+        {'date': start + timedelta(days=40), 'amount': 43.0, 'merchant': 'SHOP 1', 'category': 'Groceries'},
+        {'date': start + timedelta(days=41), 'amount': 2400.0, 'merchant': 'GOLD SOUK', 'category': 'Groceries'},
+    ])
+    db.commit()
+    assert arrivals[0]['anomaly_flags'] == []
+    assert {f['anomaly_type'] for f in arrivals[1]['anomaly_flags']} == \
+        {'amount_outlier', 'merchant_anomaly', 'category_anomaly'}
+
+    stored = db.query(Transaction).filter(Transaction.merchant == 'GOLD SOUK').one()
+    assert json.loads(stored.anomaly_flags)[0]['anomaly_type'] == 'amount_outlier'
+    assert db.query(CustomerBaseline).one().last_transaction_id == stored.id
+
+
+if __name__ == "__main__":
+    test_streaming_stats_track_numpy()
+    test_catch_up_folds_each_row_once()
+    test_transactions_flagged_on_arrival()
+    print("Baseline store tests passed")
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Test script for the categorizer's category index and matching cascade
+"""
+
+import threading
+from types import SimpleNamespace
+
+from services.categorizer import TransactionCategorizer
+
+CATEGORY_TABLE = {
+    'Groceries': {'keywords': ['carrefour', 'lulu', 'spinneys'], 'patterns': [r'.*hypermarket.*'],
+                  'subcategories': ['Hypermarket']},
+    'Transportation': {'keywords': ['careem', 'salik', 'rta'], 'patterns': [r'.*metro.*'],
+                       'subcategories': ['Ride Sharing']},
+    'Other': {'keywords': [], 'patterns': [], 'subcategories': ['Miscellaneous']}
+}
+
+
+class StubNLP:
+    """Tags every word in entity_words as an entity and records the texts it is given"""
+
+    def __init__(self, entity_words):
+        self.entity_words = set(entity_words)
+        self.texts = []
+
+    def __call__(self, text):
+        self.texts.append(text)
+        return SimpleNamespace(ents=[SimpleNamespace(text=word) for word in text.split()
+                                     if word in self.entity_words])
+
+    def pipe(self, texts, batch_size=None, n_process=None):
+        for text in texts:
+            yield self(text)
+
+
+def stubbed_categorizer():
+    categorizer = TransactionCategorizer()
+    categorizer.categories = {category: {key: list(values) for key, values in data.items()}
+                              for category, data in CATEGORY_TABLE.items()}
+    categorizer.nlp = StubNLP(['careem', 'lulu', 'salik', 'dubai'])
+    return categorizer
+
+
+def test_index_built_once_and_rebuilt_after_custom_rule():
+    categorizer = TransactionCategorizer()
+    index = categorizer._ensure_category_index()
+    assert categorizer._ensure_category_index() is index
+    assert 'Groceries' not in index.category_names
+
+    categorizer.add_custom_rule(r'carrefour', 'Groceries', 'Hypermarket')
+    rebuilt = categorizer._ensure_category_index()
+    assert rebuilt is not index and rebuilt.vectorizer is not index.vectorizer
+    assert rebuilt.category_names[-1] == 'Groceries'
+    assert rebuilt.category_vectors.shape[0] == index.category_vectors.shape[0] + 1
+    assert categorizer._pattern_matching('carrefour city centre') == ('Groceries', 'Hypermarket', 0.85)
+
+    # An index taken before the rule was added still matches consistently against itself
+    assert 'Groceries' not in index.categories
+    assert categorizer._pattern_matching('carrefour city centre', index)[0] == 'Other'
+    assert categorizer._ml_matching_batch(['netflix spotify youtube'], index)[0][0] == 'Entertainment'
+
+
+def test_index_follows_the_table_version():
+    categorizer = TransactionCategorizer()
+    index = categorizer._ensure_category_index()
+
+    # An edit in place is picked up once the index is invalidated
+    categorizer.categories['Shopping']['keywords'].append('dragonmart')
+    assert categorizer._ensure_category_index() is index
+    categorizer.invalidate_category_index()
+    rebuilt = categorizer._ensure_category_index()
+    assert rebuilt.version > index.version and 'dragonmart' in rebuilt.categories['Shopping']['keywords']
+    assert categorizer._keyword_matching('dragonmart')[0] == 'Shopping'
+
+    # Replacing the table moves the version by itself
+    categorizer.categories = {category: {key: list(values) for key, values in data.items()}
+                              for category, data in CATEGORY_TABLE.items()}
+    replaced = categorizer._ensure_category_index()
+    assert replaced is not rebuilt and set(replaced.categories) == set(CATEGORY_TABLE)
+    assert categorizer._ensure_category_index() is replaced
+
+
+def test_matching_while_rules_are_added():
+    categorizer = TransactionCategorizer()
+    texts = ['netflix spotify youtube', 'hotel flight airbnb'] * 50
+    expected = [match[0] for match in categorizer._ml_matching_batch(texts)]
+    assert expected[:2] == ['Entertainment', 'Travel']
+
+    failures = []
+    done = threading.Event()
+
+    def match():
+        while not done.is_set():
+            result = [m[0] for m in categorizer._ml_matching_batch(texts)]
+            if result != expected:
+                failures.append(result)
+
+    readers = [threading.Thread(target=match) for _ in range(3)]
+    for reader in readers:
+        reader.start()
+    # Every rule adds a category, so each rebuild changes the vocabulary and the vector count
+    for n in range(30):
+        categorizer.add_custom_rule(rf'store{n}', f'Custom {n}', 'General')
+        categorizer._ensure_category_index()
+    done.set()
+    for reader in readers:
+        reader.join()
+
+    assert failures == []
+    assert len(categorizer._ensure_category_index().category_names) == len(categorizer.categories) - 1
+
+
+def test_batch_matches_single_transactions():
+    transactions = [
+        # Keyword stage: every keyword of the category
+        {'merchant': 'CARREFOUR LULU SPINNEYS'},
+        {'merchant': 'CAREEM', 'description': 'salik rta'},
+        # Too few keywords, resolved by a pattern
+        {'merchant': 'LULU HYPERMARKET'},
+        {'merchant': 'DUBAI METRO', 'description': 'careem'},
+        # No pattern either; the only entity names a category
+        {'merchant': 'RIDE WITH CAREEM'},
+        # Entities split between categories, too weak for the NLP stage
+        {'merchant': 'CAREEM TO LULU', 'description': 'dubai'},
+        {'merchant': 'UNKNOWN MERCHANT'},
+        {'description': ''}
+    ]
+
+    single_categorizer = stubbed_categorizer()
+    single = [single_categorizer.categorize_single_transaction(dict(t)) for t in transactions]
+
+    batch_categorizer = stubbed_categorizer()
+    batch = [(t['category'], t['subcategory'], t['confidence_score'])
+             for t in batch_categorizer.categorize_transactions([dict(t) for t in transactions])]
+
+    assert batch == single
+    assert batch[:5] == [
+        ('Groceries', 'Hypermarket', 1.0),
+        ('Transportation', 'Ride Sharing', 1.0),
+        ('Groceries', 'Hypermarket', 0.85),
+        ('Transportation', 'Ride Sharing', 0.85),
+        ('Transportation', 'Ride Sharing', 0.9)
+    ]
+    assert [category for category, _, _ in batch[5:]] == ['Other', 'Other', 'Other']
+    # Only the rows the keyword and pattern stages left unresolved reach the NLP stage, in order
+    unresolved = ['ride with careem', 'careem to lulu dubai', 'unknown merchant', '']
+    assert batch_categorizer.nlp.texts == single_categorizer.nlp.texts == unresolved
+
+
+if __name__ == "__main__":
+    test_index_built_once_and_rebuilt_after_custom_rule()
+    test_index_follows_the_table_version()
+    test_matching_while_rules_are_added()
+    test_batch_matches_single_transactions()
+    print("Categorizer tests passed")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test script for the trained category classifier and the categorizer's model stage
+"""
+
+import os
+import tempfile
+from services.category_model import CategoryModel, load_category_model
+from services.categorizer import TransactionCategorizer
+from train_category_model import split_examples, fit_model, evaluate
+
+TRAINING_DATA = [
+    ("talabat order", "Food & Dining", "Delivery"),
+    ("deliveroo order", "Food & Dining", "Delivery"),
+    ("zomato order", "Food & Dining", "Delivery"),
+    ("adnoc station", "Transportation", "Fuel"),
+    ("enoc station", "Transportation", "Fuel"),
+    ("eppco station", "Transportation", "Fuel"),
+    ("du mobile bill", "Bills & Utilities", "Phone"),
+    ("etisalat mobile bill", "Bills & Utilities", "Phone"),
+    ("virgin mobile bill", "Bills & Utilities", "Phone"),
+] * 5
+
+
+def train():
+    texts, categories, subcategories = zip(*TRAINING_DATA)
+    return CategoryModel().fit(list(texts), list(categories), list(subcategories))
+
+
+def test_save_and_load():
+    model = train()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "category_model.joblib")
+        model.save(path)
+        loaded = load_category_model(path)
+        assert load_category_model(os.path.join(tmp, "missing.joblib")) is None
+
+    texts = ["talabat order", "adnoc station", "etisalat mobile bill"]
+    assert loaded.predict(texts) == model.predict(texts)
+    assert [p[:2] for p in loaded.predict(texts)] == [
+        ("Food & Dining", "Delivery"), ("Transportation", "Fuel"), ("Bills & Utilities", "Phone")
+    ]
+
+
+def test_categorizer_model_stage():
+    transactions = [{'merchant': 'TALABAT ORDER'}, {'merchant': 'ENOC STATION'}, {'merchant': 'UBER'}]
+
+    plain = TransactionCategorizer().categorize_transactions([dict(t) for t in transactions])
+    assert plain[0]['category'] == 'Other'
+
+    categorizer = TransactionCategorizer(model=train(), model_threshold=0.5)
+    result = categorizer.categorize_transactions([dict(t) for t in transactions])
+    assert [t['category'] for t in result] == ['Food & Dining', 'Transportation', 'Transportation']
+    assert result[0]['subcategory'] == 'Delivery'
+    # Rows resolved by the keyword and pattern stages never reach the model
+    assert result[2]['confidence_score'] == plain[2]['confidence_score']
+
+    single = categorizer.categorize_single_transaction({'merchant': 'TALABAT ORDER'})
+    assert single[:2] == ('Food & Dining', 'Delivery')
+
+
+def test_holdout_comparison_without_labels():
+    examples = [({'merchant': text.upper()}, category, subcategory) for text, category, subcategory in TRAINING_DATA]
+    train_rows, test_rows = split_examples(examples, 0.2, seed=7)
+    assert len(test_rows) == 9 and len(train_rows) == 36
+    assert split_examples(examples, 0.2, seed=7) == (train_rows, test_rows)
+    # Even a tiny share holds out one row and trains on the rest
+    assert [len(part) for part in split_examples(examples[:2], 0.01, seed=7)] == [1, 1]
+
+    categorizer = TransactionCategorizer()
+    report = evaluate(fit_model(categorizer, train_rows), categorizer, test_rows, threshold=0.5)
+    assert report['rows'] == 9 and report['model_accuracy'] == 1.0
+    assert report['model_ms_per_1k'] > 0 and report['cascade_ms_per_1k'] > 0
+
+
+if __name__ == "__main__":
+    test_save_and_load()
+    test_categorizer_model_stage()
+    test_holdout_comparison_without_labels()
+    print("Category model tests passed")
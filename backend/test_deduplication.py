@@ -5,6 +5,7 @@ Test script for transaction deduplication
 
 from services.transaction_deduplicator import TransactionDeduplicator
 import json
+import random
 
 # Sample data from your example
 sample_transactions = [
@@ -109,5 +110,50 @@ def test_deduplication():
     
     return result
 
+def pairwise_duplicate_groups(deduplicator, transactions):
+    """Reference grouping: compare every transaction with every later one"""
+    groups = []
+    processed = set()
+    for i in range(len(transactions)):
+        if i in processed:
+            continue
+        group = [i]
+        for j in range(i + 1, len(transactions)):
+            if j not in processed and deduplicator._are_transactions_duplicates(transactions[i], transactions[j]):
+                group.append(j)
+                processed.add(j)
+        if len(group) > 1:
+            groups.append(group)
+            processed.update(group)
+    return groups
+
+def test_blocking_index_matches_pairwise():
+    deduplicator = TransactionDeduplicator()
+    rng = random.Random(7)
+    merchants = ['CARREFOUR', 'CARREFOUR ABU DHABI', 'carrefour store', 'STORE', 'LULU', 'LULU HYPER', '', None]
+    dates = ['01-01-2024', '02-01-2024', '04-01-2024', '08-01-2024', '09-01-2024', '31-02-2024', 'bad', None]
+
+    assert deduplicator._find_duplicate_groups(sample_transactions) == \
+        pairwise_duplicate_groups(deduplicator, sample_transactions)
+
+    for _ in range(1000):
+        transactions = []
+        for _ in range(rng.randint(0, 25)):
+            transaction = {
+                'date': rng.choice(dates),
+                'amount': rng.choice([10.0, 10, 25.5, None]),
+                'currency': rng.choice(['AED', 'USD', None]),
+                'merchant': rng.choice(merchants)
+            }
+            if rng.random() < 0.3:
+                transaction['raw_text'] = rng.choice(['a', 'b', '', None])
+            if rng.random() < 0.3:
+                transaction['transaction_block'] = rng.choice([['x', 'y'], ['x'], [], None])
+            transactions.append(transaction)
+
+        assert deduplicator._find_duplicate_groups(transactions) == \
+            pairwise_duplicate_groups(deduplicator, transactions), transactions
+
 if __name__ == "__main__":
-    test_deduplication()
\ No newline at end of file
+    test_deduplication()
+    test_blocking_index_matches_pairwise()
\ No newline at end of file
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Test script for deduplicating incoming batches against stored transactions
+"""
+
+import os
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Transaction
+import migrations
+from migrations import run_migrations
+from services.incremental_deduplicator import transaction_fingerprint
+from services.statement_ingestion import StatementIngestionService
+
+
+def memory_engine():
+    return create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+
+def memory_session():
+    engine = memory_engine()
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def statement(rows):
+    return {
+        'transactions': [
+            {'date': date, 'merchant': merchant, 'amount': amount, 'currency': 'AED',
+             'raw_text': f"{date} {merchant} AED {amount}"}
+            for date, merchant, amount in rows
+        ],
+        'summary': {}
+    }
+
+
+def test_pdf_statements_across_uploads():
+    db = memory_session()
+    ingestion = StatementIngestionService()
+
+    first = ingestion.save_pdf_statement(db, 1, statement([
+        ('01-03-2024', 'CARREFOUR CITY CENTRE', 250.0),
+        ('01-03-2024', 'CARREFOUR CITY CENTRE', 250.0),
+        ('03-03-2024', 'NETFLIX.COM', 39.0),
+    ]))
+    assert (first['transactions_saved'], first['duplicates_removed'], first['already_stored']) == (2, 1, 0)
+
+    # The next statement overlaps the first: the same Netflix charge, and
+    # Carrefour posted two days later under a longer name
+    second = ingestion.save_pdf_statement(db, 1, statement([
+        ('03-03-2024', 'NETFLIX.COM', 39.0),
+        ('03-03-2024', 'CARREFOUR CITY CENTRE DUBAI', 250.0),
+        ('20-03-2024', 'CARREFOUR CITY CENTRE', 250.0),
+        ('03-03-2024', 'ADNOC 55', 39.0),
+    ]))
+    assert (second['transactions_saved'], second['already_stored']) == (2, 2)
+
+    # Another customer's rows never count as stored duplicates
+    other = ingestion.save_pdf_statement(db, 2, statement([('03-03-2024', 'NETFLIX.COM', 39.0)]))
+    assert other['transactions_saved'] == 1
+
+    assert db.query(Transaction).filter(Transaction.customer_id == 1).count() == 4
+
+
+def test_categorized_transactions_with_datetimes():
+    db = memory_session()
+    ingestion = StatementIngestionService()
+    transactions = [
+        {'date': datetime(2024, 3, 5, 14, 30), 'merchant': 'TALABAT', 'amount': 45.5, 'raw_text': 'talabat order'},
+        {'date': datetime(2024, 3, 5, 14, 30), 'merchant': 'TALABAT', 'amount': 45.5, 'raw_text': 'talabat order'},
+        {'date': datetime(2024, 3, 6, 9, 0), 'merchant': 'UBER', 'amount': '23.10'},
+    ]
+
+    assert ingestion.save_categorized_transactions(db, 1, [dict(t) for t in transactions]) == 2
+    assert ingestion.save_categorized_transactions(db, 1, [dict(t) for t in transactions]) == 0
+
+    result = ingestion.deduplicate(db, 1, [{'merchant': 'TALABAT', 'amount': 45.5, 'raw_text': 'new order'}])
+    # Undated rows are compared as dated today, far from the stored order
+    assert result['new_transactions'] and result['stored_rows_checked'] == 0
+
+
+def test_fingerprint_rejects_exact_duplicates():
+    assert transaction_fingerprint(1, '05-03-2024', 45.5, 'AED', 'TALABAT #12 DUBAI') == \
+        transaction_fingerprint(1, datetime(2024, 3, 5, 23, 59), '45.50', None, 'talabat')
+    assert transaction_fingerprint(1, '05-03-2024', 45.5, 'AED', 'TALABAT') != \
+        transaction_fingerprint(2, '05-03-2024', 45.5, 'AED', 'TALABAT')
+
+    db = memory_session()
+    ingestion = StatementIngestionService()
+    rows = [
+        ingestion.transaction_row(1, {'date': datetime(2024, 3, 5, 9, 0), 'merchant': 'TALABAT', 'amount': 45.5}),
+        ingestion.transaction_row(1, {'date': datetime(2024, 3, 5, 21, 0), 'merchant': 'TALABAT DUBAI', 'amount': 45.5}),
+        ingestion.transaction_row(1, {'date': datetime(2024, 3, 5, 9, 0), 'merchant': 'UBER', 'amount': 45.5}),
+    ]
+    assert ingestion.insert_transactions(db, rows) == [0, 2]
+    assert ingestion.insert_transactions(db, rows) == []
+    db.commit()
+    assert db.query(Transaction).count() == 2
+
+
+def create_legacy_table(engine):
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE transactions (id INTEGER PRIMARY KEY, customer_id INTEGER, date DATETIME, "
+            "amount FLOAT, merchant VARCHAR)"
+        ))
+        for row_id, merchant in [(1, 'TALABAT'), (2, 'NETFLIX'), (3, 'TALABAT DUBAI')]:
+            connection.execute(text(
+                "INSERT INTO transactions VALUES (:id, 1, '2024-03-05 10:00:00.000000', 45.5, :merchant)"
+            ), {'id': row_id, 'merchant': merchant})
+
+
+def test_migration_backfills_legacy_table():
+    chunk_size = migrations.BACKFILL_CHUNK_SIZE
+    # In one chunk, and a chunk of two so the duplicate is found in an earlier chunk
+    for size in (chunk_size, 2):
+        migrations.BACKFILL_CHUNK_SIZE = size
+        try:
+            engine = memory_engine()
+            create_legacy_table(engine)
+            run_migrations(engine)
+            run_migrations(engine)
+        finally:
+            migrations.BACKFILL_CHUNK_SIZE = chunk_size
+
+        with engine.connect() as connection:
+            fingerprints = dict(connection.execute(text("SELECT id, fingerprint FROM transactions")).all())
+        talabat = transaction_fingerprint(1, datetime(2024, 3, 5), 45.5, None, 'TALABAT')
+        assert fingerprints[1] == talabat
+        assert fingerprints[3] == f"{talabat}:3"
+        indexes = {index['name'] for index in inspect(engine).get_indexes('transactions')}
+        assert 'ix_transactions_fingerprint_backfill' not in indexes
+
+        # Merchants are normalized in the same pass for recurring detection
+        with engine.connect() as connection:
+            merchant_keys = dict(connection.execute(text("SELECT id, merchant_key FROM transactions")).all())
+        assert merchant_keys == {1: 'talabat', 2: 'netflix', 3: 'talabat'}
+        assert 'ix_transactions_customer_merchant_key' in indexes
+
+        rejected = False
+        with engine.connect() as connection:
+            try:
+                connection.execute(text(
+                    "INSERT INTO transactions (customer_id, fingerprint) VALUES (1, :fingerprint)"
+                ), {'fingerprint': talabat})
+            except IntegrityError:
+                rejected = True
+        assert rejected
+
+
+def migrate_file(path):
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        run_migrations(engine)
+        return sorted(column['name'] for column in inspect(engine).get_columns('transactions'))
+    finally:
+        engine.dispose()
+
+
+def test_concurrent_migrations():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "legacy.db")
+        engine = create_engine(f"sqlite:///{path}")
+        create_legacy_table(engine)
+        engine.dispose()
+
+        # Workers starting together on a legacy file all come up on the same schema
+        with multiprocessing.get_context('fork').Pool(4) as pool:
+            columns = pool.map(migrate_file, [path] * 4)
+        assert all(c == columns[0] for c in columns)
+        assert {'fingerprint', 'is_anomaly', 'category_source', 'merchant_key'} <= set(columns[0])
+
+
+if __name__ == "__main__":
+    test_pdf_statements_across_uploads()
+    test_categorized_transactions_with_datetimes()
+    test_fingerprint_rejects_exact_duplicates()
+    test_migration_backfills_legacy_table()
+    test_concurrent_migrations()
+    print("Incremental deduplication tests passed")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Test script for the bulk statement ingestion CLI, with the PDF parser stubbed out
+"""
+
+import os
+import json
+import tempfile
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+import ingest_statements
+from models import Customer, Transaction
+from services.statement_ingestion import StatementIngestionService
+
+FILES = 5
+TRANSACTIONS_PER_FILE = 3
+
+
+class FakeParser:
+    """Reads statements written by write_statements instead of parsing PDFs"""
+
+    def __init__(self, password_store=None):
+        self.ocr_engine = None
+        self.password_search = None
+
+    def extract_text(self, path, customer):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read(), None, None
+
+    def process_extracted_text(self, text_content, page_extraction):
+        return json.loads(text_content)
+
+
+class InterruptedIngestion(StatementIngestionService):
+    """Raises KeyboardInterrupt when asked to save the given statement"""
+
+    interrupt_at = None
+
+    def __init__(self):
+        super().__init__()
+        self.saves = 0
+
+    def save_pdf_statement(self, db, customer_id, parsed_data, progress=None, commit=True):
+        self.saves += 1
+        if self.saves == self.interrupt_at:
+            raise KeyboardInterrupt
+        return super().save_pdf_statement(db, customer_id, parsed_data, commit=commit)
+
+
+def write_statements(directory):
+    for n in range(FILES):
+        transactions = [{
+            'date': f"{day + 1:02d}-{n + 1:02d}-2024",
+            'merchant': f"MERCHANT {n} {day}",
+            'amount': 10.0 * (n + 1) + day,
+            'currency': 'AED',
+            'raw_text': f"statement {n} line {day}"
+        } for day in range(TRANSACTIONS_PER_FILE)]
+        with open(os.path.join(directory, f"statement_{n}.pdf"), 'w', encoding='utf-8') as f:
+            json.dump({'transactions': transactions, 'summary': {}}, f)
+
+
+def setup(tmp):
+    """Point the CLI at a database file in tmp, with one customer"""
+    engine = create_engine(f"sqlite:///{os.path.join(tmp, 'ingest.db')}",
+                           connect_args={"check_same_thread": False})
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    ingest_statements.engine = engine
+    ingest_statements.SessionLocal = session_factory
+    ingest_statements.PDFParser = FakeParser
+    ingest_statements.StatementIngestionService = InterruptedIngestion
+
+    ingest_statements.run_migrations(engine)
+    db = session_factory()
+    db.add(Customer(name="Backfill Customer", email="backfill@example.com"))
+    db.commit()
+    db.close()
+    return session_factory
+
+
+def stored_transactions(session_factory):
+    db = session_factory()
+    try:
+        return [(t.date, t.merchant, t.amount) for t in db.query(Transaction).all()]
+    finally:
+        db.close()
+
+
+def test_interrupted_run_resumes_from_checkpoint():
+    with tempfile.TemporaryDirectory() as tmp:
+        statements = os.path.join(tmp, 'statements')
+        os.makedirs(statements)
+        write_statements(statements)
+        checkpoint_path = os.path.join(tmp, 'checkpoint.json')
+        session_factory = setup(tmp)
+
+        # Two statements fill a batch; the run stops while saving the fourth,
+        # after the third was flushed but before its batch committed
+        InterruptedIngestion.interrupt_at = 4
+        ingest_statements.ingest(statements, 1, workers=1, batch_size=2 * TRANSACTIONS_PER_FILE,
+                                 checkpoint_path=checkpoint_path)
+
+        checkpoint = ingest_statements.load_checkpoint(checkpoint_path)
+        assert [os.path.basename(path) for path in checkpoint['completed']] == ['statement_0.pdf', 'statement_1.pdf']
+        assert len(stored_transactions(session_factory)) == 2 * TRANSACTIONS_PER_FILE
+
+        # The resumed run only parses the statements that were not committed
+        InterruptedIngestion.interrupt_at = None
+        parsed = []
+        save = InterruptedIngestion.save_pdf_statement
+
+        def counting_save(self, db, customer_id, parsed_data, progress=None, commit=True):
+            parsed.append(parsed_data['transactions'][0]['merchant'])
+            return save(self, db, customer_id, parsed_data, progress, commit)
+
+        InterruptedIngestion.save_pdf_statement = counting_save
+        try:
+            assert ingest_statements.ingest(statements, 1, workers=1, batch_size=2 * TRANSACTIONS_PER_FILE,
+                                            checkpoint_path=checkpoint_path) == 0
+        finally:
+            InterruptedIngestion.save_pdf_statement = save
+        assert sorted(parsed) == ['MERCHANT 2 0', 'MERCHANT 3 0', 'MERCHANT 4 0']
+
+        rows = stored_transactions(session_factory)
+        assert len(rows) == len(set(rows)) == FILES * TRANSACTIONS_PER_FILE
+        assert {merchant for _, merchant, _ in rows} == {
+            f"MERCHANT {n} {day}" for n in range(FILES) for day in range(TRANSACTIONS_PER_FILE)
+        }
+        assert len(ingest_statements.load_checkpoint(checkpoint_path)['completed']) == FILES
+
+        db = session_factory()
+        try:
+            assert db.query(func.count(Transaction.fingerprint.distinct())).scalar() == FILES * TRANSACTIONS_PER_FILE
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    test_interrupted_run_resumes_from_checkpoint()
+    print("Ingest statements tests passed")
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Test script for the durable statement-ingestion job queue
+"""
+
+import os
+import time
+import asyncio
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Customer, Transaction, IngestionJob
+from services import ingestion_jobs
+from services.ingestion_jobs import IngestionJobQueue, _process_job
+from services.registry import ServiceRegistry
+
+
+class FakeParser:
+    def parse_pdf_source(self, path, customer, cache_key=None):
+        return {'transactions': [{'amount': 42.0, 'merchant': 'CARREFOUR'}]}
+
+
+class FakeIngestion:
+    """Saves one transaction per statement; fails in the ways a test asks it to"""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+
+    def save_pdf_statement(self, db, customer_id, parsed_data, progress=None, commit=True):
+        progress('saving', 0.5)
+        db.add(Transaction(customer_id=customer_id, date=datetime(2024, 1, 1), amount=42.0, merchant='CARREFOUR'))
+        db.flush()
+        failure = self.failures.pop(0) if self.failures else None
+        if failure is not None:
+            raise failure
+        return {'transactions_saved': 1}
+
+
+def setup(tmp, failures=(), **queue_settings):
+    """A queue on an in-memory database, with the worker functions pointed at it"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    ingestion_jobs.SessionLocal = session_factory
+
+    services = ServiceRegistry()
+    services.register('pdf_parser', FakeParser)
+    services.register('statement_ingestion', lambda: FakeIngestion(failures))
+    ingestion_jobs._worker_services = services
+
+    db = session_factory()
+    db.add(Customer(name="Job Customer", email="jobs@example.com"))
+    db.commit()
+    db.close()
+    return IngestionJobQueue(spool_dir=tmp, session_factory=session_factory, **queue_settings), session_factory
+
+
+def add_job(session_factory, tmp, name, status='queued'):
+    path = os.path.join(tmp, f"{name}.pdf")
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4 statement")
+    db = session_factory()
+    job = IngestionJob(id=name, customer_id=1, kind='pdf', filename=f"{name}.pdf", content_sha256=name,
+                       file_path=path, status=status, stage=status, progress=0.0, attempts=0,
+                       created_at=datetime.utcnow(), updated_at=datetime.utcnow())
+    db.add(job)
+    db.commit()
+    db.close()
+    return path
+
+
+def job_row(session_factory, job_id):
+    db = session_factory()
+    try:
+        return db.query(IngestionJob).filter(IngestionJob.id == job_id).one()
+    finally:
+        db.close()
+
+
+def test_claims_each_job_once():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue, session_factory = setup(tmp)
+        other = IngestionJobQueue(spool_dir=tmp, session_factory=session_factory)
+        add_job(session_factory, tmp, 'first')
+        add_job(session_factory, tmp, 'second')
+
+        claimed = [queue._claim_next(), other._claim_next(), queue._claim_next()]
+        assert claimed == ['first', 'second', None]
+        assert job_row(session_factory, 'first').status == 'running'
+        assert job_row(session_factory, 'first').attempts == 1
+
+
+def test_crashed_job_reruns_without_duplicates():
+    with tempfile.TemporaryDirectory() as tmp:
+        # The worker dies after inserting its rows but before the commit
+        queue, session_factory = setup(tmp, failures=[KeyboardInterrupt()])
+        path = add_job(session_factory, tmp, 'statement')
+        assert queue._claim_next() == 'statement'
+        try:
+            _process_job('statement')
+        except KeyboardInterrupt:
+            pass
+        assert job_row(session_factory, 'statement').status == 'running'
+
+        # On restart the job is requeued and runs again from the spooled file
+        queue._recover()
+        assert job_row(session_factory, 'statement').status == 'queued'
+        assert queue._claim_next() == 'statement'
+        assert _process_job('statement') == 'succeeded'
+
+        db = session_factory()
+        assert db.query(Transaction).count() == 1
+        db.close()
+        job = job_row(session_factory, 'statement')
+        assert (job.status, job.attempts, job.progress) == ('succeeded', 2, 1.0)
+        assert not os.path.exists(path)
+
+
+def test_locked_database_is_retried_with_backoff():
+    with tempfile.TemporaryDirectory() as tmp:
+        locked = OperationalError("INSERT INTO transactions", {}, Exception("database is locked"))
+        queue, session_factory = setup(tmp, failures=[locked], max_attempts=3, retry_backoff=0.3)
+        path = add_job(session_factory, tmp, 'statement')
+
+        assert queue._claim_next() == 'statement'
+        assert _process_job('statement', queue.max_attempts, queue.retry_backoff) == 'queued'
+        job = job_row(session_factory, 'statement')
+        assert job.status == 'queued' and 'database is locked' in job.error
+        # The upload is kept for the retry, which waits for its backoff
+        assert os.path.exists(path)
+        assert queue._claim_next() is None
+        time.sleep(0.35)
+
+        assert queue._claim_next() == 'statement'
+        assert _process_job('statement', queue.max_attempts, queue.retry_backoff) == 'succeeded'
+        assert job_row(session_factory, 'statement').attempts == 2
+        assert not os.path.exists(path)
+
+
+def test_out_of_attempts_fails_for_good():
+    with tempfile.TemporaryDirectory() as tmp:
+        locked = OperationalError("INSERT INTO transactions", {}, Exception("database is locked"))
+        queue, session_factory = setup(tmp, failures=[locked, locked], max_attempts=2, retry_backoff=0.0)
+        path = add_job(session_factory, tmp, 'statement')
+
+        statuses = []
+        while queue._claim_next() == 'statement':
+            statuses.append(_process_job('statement', queue.max_attempts, queue.retry_backoff))
+        assert statuses == ['queued', 'failed']
+        assert job_row(session_factory, 'statement').status == 'failed'
+        assert not os.path.exists(path)
+
+        # Errors that a retry cannot fix fail on the first attempt
+        queue, session_factory = setup(tmp, failures=[ValueError("not a statement")], max_attempts=3)
+        add_job(session_factory, tmp, 'broken')
+        queue._claim_next()
+        assert _process_job('broken', queue.max_attempts, queue.retry_backoff) == 'failed'
+
+
+def test_events_follow_job_progress():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue, session_factory = setup(tmp)
+        add_job(session_factory, tmp, 'statement')
+
+        async def collect():
+            events = queue.events('statement', interval=0.01)
+            received = [await events.__anext__()]
+            queue._claim_next()
+            ingestion_jobs._update_job('statement', stage='parsing', progress=0.1)
+            received.append(await events.__anext__())
+            _process_job('statement')
+            received.append(await events.__anext__())
+            # The stream ends once the job is finished
+            received.extend([event async for event in events])
+            return received
+
+        received = asyncio.run(collect())
+        assert [event.split('\n')[0] for event in received] == \
+            ['event: queued', 'event: running', 'event: succeeded']
+        assert '"progress": 0.1' in received[1]
+
+
+if __name__ == "__main__":
+    test_claims_each_job_once()
+    test_crashed_job_reruns_without_duplicates()
+    test_locked_database_is_retried_with_backoff()
+    test_out_of_attempts_fails_for_good()
+    test_events_follow_job_progress()
+    print("Ingestion job tests passed")
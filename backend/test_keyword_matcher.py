@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test script checking the Aho-Corasick keyword matcher against plain
+substring and regex searches, and the classifiers built on it
+"""
+
+import re
+import random
+from services.keyword_matcher import KeywordMatcher, literal_from_pattern
+from services.sms_parser import SMSParser
+from services.email_parser import EmailParser
+
+
+def naive_hit_counts(table, text):
+    counts = {}
+    for label, keywords in table.items():
+        matches = sum(1 for keyword in keywords if keyword in text)
+        if matches:
+            counts[label] = matches
+    return counts
+
+
+def test_random_tables():
+    rng = random.Random(42)
+    alphabet = "abc "
+    for _ in range(500):
+        table = {}
+        for label in ['first', 'second', 'third']:
+            table[label] = [
+                ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4)))
+                for _ in range(rng.randint(0, 6))
+            ]
+        matcher = KeywordMatcher.from_table(table)
+        for _ in range(10):
+            text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+            assert matcher.hit_counts(text) == naive_hit_counts(table, text), (table, text)
+
+
+def test_patterns():
+    assert literal_from_pattern(r'.*restaurant.*') == 'restaurant'
+    assert literal_from_pattern(r'payment due') == 'payment due'
+    assert literal_from_pattern(r'carrefour|lulu') is None
+    assert literal_from_pattern(r'.*fee\.*') is None
+
+    table = {'Shopping': [r'.*AMAZON.*', r'carrefour|lulu'], 'Fuel': [r'.*adnoc.*', r'\bgas\b']}
+    matcher = KeywordMatcher.from_table(table, ignore_case=True, patterns=True)
+    texts = ["Amazon marketplace", "LULU HYPERMARKET", "adnoc station", "gas", "gasoline", "nothing"]
+    for text in texts:
+        expected = {}
+        for label, patterns in table.items():
+            matches = sum(1 for pattern in patterns if re.search(pattern, text, re.IGNORECASE))
+            if matches:
+                expected[label] = matches
+        assert matcher.hit_counts(text) == expected, text
+
+
+def test_classifiers():
+    sms_parser = SMSParser()
+    assert sms_parser._classify_sms_type("payment received, balance overdue") == 'payment_due'
+    assert sms_parser._classify_sms_type("payment received, thank you") == 'payment_confirmation'
+    assert sms_parser._classify_sms_type("aed 120 spent at carrefour") == 'transaction_alert'
+    assert sms_parser._classify_sms_type("hello") == 'unknown'
+
+    email_parser = EmailParser()
+    assert email_parser.classify_email_type("Your Monthly Statement", "") == 'statement'
+    assert email_parser.classify_email_type("Spending alert", "current balance") == 'transaction'
+    assert email_parser.classify_email_type("Hi", "Your credit limit changed") == 'balance'
+    assert email_parser.classify_email_type("Hi", "there") == 'unknown'
+
+
+if __name__ == "__main__":
+    test_random_tables()
+    test_patterns()
+    test_classifiers()
+    print("Keyword matcher output matches substring and regex search")
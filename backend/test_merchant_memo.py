@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Test script for the merchant-to-category memo in front of the categorizer
+"""
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import MerchantCategory
+from services.merchant_memo import MerchantCategoryMemo, normalize_merchant
+from services.categorizer import TransactionCategorizer
+
+
+def memory_session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def test_normalize_merchant():
+    assert normalize_merchant("CARREFOUR #1234 DUBAI AE") == "carrefour"
+    assert normalize_merchant("TALABAT.COM") == "talabat"
+    assert normalize_merchant("12345") == ""
+    assert normalize_merchant(None) == ""
+
+
+def test_memo_matches_cascade_and_persists():
+    session_factory = memory_session_factory()
+    transactions = [
+        {'merchant': merchant, 'description': f"{merchant} purchase"}
+        for merchant in ['UBER TRIP 1', 'UBER TRIP 2', 'NETFLIX.COM', 'ADNOC 55', ''] * 20
+    ]
+
+    expected = TransactionCategorizer().categorize_transactions([dict(t) for t in transactions])
+
+    memo = MerchantCategoryMemo(session_factory=session_factory)
+    categorizer = TransactionCategorizer(memo=memo)
+    for _ in range(2):
+        result = categorizer.categorize_transactions([dict(t) for t in transactions])
+        assert [t['category'] for t in result] == [t['category'] for t in expected]
+
+    stats = memo.stats()
+    print(f"Stats: {stats}")
+    assert (stats['misses'], stats['writes'], stats['hits']) == (3, 3, 3)
+
+    # A new process finds the decisions in the table, except the 'Other' fallback
+    fresh = MerchantCategoryMemo(session_factory=session_factory)
+    found = fresh.lookup_many(['uber trip', 'netflix', 'adnoc'])
+    assert found['netflix'][0] == 'Entertainment'
+    decided = {normalize_merchant(t['merchant']) for t in expected if t['merchant'] and t['category'] != 'Other'}
+    assert found.keys() == decided and 0 < fresh.stats()['table_hits'] < 3
+
+
+def test_rules_take_precedence():
+    session_factory = memory_session_factory()
+    memo = MerchantCategoryMemo(session_factory=session_factory)
+    categorizer = TransactionCategorizer(memo=memo)
+    transactions = [{'merchant': 'CARREFOUR CITY CENTRE', 'description': 'purchase'}]
+
+    assert categorizer.categorize_transactions([dict(t) for t in transactions])[0]['category'] == 'Other'
+
+    db = session_factory()
+    memo.add_rule(db, r'carrefour', 'Groceries', 'Hypermarket', 0.95)
+    db.close()
+
+    result = categorizer.categorize_transactions([dict(t) for t in transactions])[0]
+    assert (result['category'], result['subcategory'], result['confidence_score']) == ('Groceries', 'Hypermarket', 0.95)
+    assert memo.stats()['rule_hits'] == 1
+    # Rule decisions alone, as the category model's training holds them out
+    assert memo.match_rules(['carrefour city centre', 'uber', '']) == \
+        {'carrefour city centre': ('Groceries', 'Hypermarket', 0.95)}
+
+
+def test_custom_rule_only_invalidates_matching_merchants():
+    session_factory = memory_session_factory()
+    memo = MerchantCategoryMemo(session_factory=session_factory)
+    categorizer = TransactionCategorizer(memo=memo)
+    transactions = [{'merchant': merchant} for merchant in ['CARREFOUR CITY CENTRE', 'UBER TRIP', 'NETFLIX.COM']]
+    # Seeded entries are kept unless the pattern matches them
+    memo.store_many({'spinneys': ('Groceries', 'Supermarket', 0.95),
+                     'carrefour market': ('Other', 'Miscellaneous', 0.3)})
+
+    before = categorizer.categorize_transactions([dict(t) for t in transactions])
+    assert before[0]['category'] == 'Other'
+
+    categorizer.add_custom_rule(r'carrefour', 'Groceries', 'Hypermarket')
+
+    db = session_factory()
+    assert sorted(row.merchant_key for row in db.query(MerchantCategory)) == ['netflix', 'spinneys', 'uber trip']
+    db.close()
+    assert memo.lookup_many(['carrefour city centre', 'uber trip']).keys() == {'uber trip'}
+
+    after = categorizer.categorize_transactions([dict(t) for t in transactions])
+    assert (after[0]['category'], after[0]['subcategory']) == ('Groceries', 'Hypermarket')
+    assert [t['category'] for t in after[1:]] == [t['category'] for t in before[1:]]
+
+
+def test_custom_rule_matches_the_categorized_text():
+    session_factory = memory_session_factory()
+    memo = MerchantCategoryMemo(session_factory=session_factory)
+    categorizer = TransactionCategorizer(memo=memo)
+    # The merchant key is 'pos', but the description names the shop
+    transactions = [{'merchant': 'POS 4471', 'description': 'MALL OF THE EMIRATES KIOSK'},
+                    {'merchant': 'ADNOC 55', 'description': 'fuel station'}]
+
+    before = categorizer.categorize_transactions([dict(t) for t in transactions])
+    assert before[0]['category'] == 'Other'
+    db = session_factory()
+    # Only the decided merchant is persisted, with the text it was decided on
+    assert [(row.merchant_key, row.text) for row in db.query(MerchantCategory)] == [('adnoc', 'adnoc 55 fuel station')]
+    db.close()
+
+    categorizer.add_custom_rule(r'emirates kiosk', 'Malls', 'Kiosk')
+    assert memo.lookup_many(['pos']) == {}
+    after = categorizer.categorize_transactions([dict(t) for t in transactions])
+    assert (after[0]['category'], after[0]['subcategory']) == ('Malls', 'Kiosk')
+
+    # A rule matching only a persisted decision's text removes it from the table too
+    categorizer.add_custom_rule(r'fuel station', 'Transportation', 'Petrol')
+    db = session_factory()
+    assert db.query(MerchantCategory).filter(MerchantCategory.merchant_key == 'adnoc').count() == 0
+    db.close()
+
+
+if __name__ == "__main__":
+    test_normalize_merchant()
+    test_memo_matches_cascade_and_persists()
+    test_rules_take_precedence()
+    test_custom_rule_only_invalidates_matching_merchants()
+    test_custom_rule_matches_the_categorized_text()
+    print("Merchant memo tests passed")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Test script for the page-parallel OCR engine, with Tesseract mocked out
+"""
+
+import re
+import time
+
+import fitz
+import pytesseract
+
+from services import ocr_engine
+from services.ocr_engine import OCREngine, FAST_CONFIG
+
+
+def fake_data(words):
+    """image_to_data output for (block, paragraph, line, word, confidence[, left]) tuples
+
+    Glyphs are 10px wide; words without a left edge follow the previous word
+    on their line after a one-character gap.
+    """
+    data = {key: [] for key in ('block_num', 'par_num', 'line_num', 'text', 'conf', 'left', 'width')}
+    line_end = {}
+    for w in words:
+        block, par, line, text, conf = w[:5]
+        width = 10 * len(text)
+        left = w[5] if len(w) > 5 else line_end.get((block, par, line), -10) + 10
+        if text.strip():
+            line_end[(block, par, line)] = left + width
+        for key, value in zip(data, (block, par, line, text, conf, left, width)):
+            data[key].append(value)
+    return data
+
+
+def statement_pdf(pages):
+    # Page n is 300 + 10n points wide, so the fake OCR can tell the pages apart
+    doc = fitz.open()
+    for page_num in range(pages):
+        doc.new_page(width=300 + 10 * page_num, height=400)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def page_of(img, zoom=1.0):
+    return round((img.width / zoom - 300) / 10)
+
+
+def with_image_to_data(fake, test):
+    original = pytesseract.image_to_data
+    pytesseract.image_to_data = fake
+    try:
+        return test()
+    finally:
+        pytesseract.image_to_data = original
+
+
+def test_lines_rebuilt_from_word_boxes():
+    data = fake_data([
+        (2, 1, 1, 'AED', '88'),
+        (1, 1, 2, 'Statement', 91),
+        (1, 1, 1, 'ADCB', '95.5'),
+        (1, 1, 1, 'Bank', 90),
+        (1, 1, 2, '', '-1'),
+        (1, 1, 2, 'Date', 'n/a'),
+        (2, 1, 1, '1,250.00', 70),
+        (1, 2, 1, '   ', -1),
+    ])
+    text, confidence = with_image_to_data(lambda img, config, output_type: data,
+                                          lambda: ocr_engine._ocr_image(None, FAST_CONFIG))
+
+    # Words grouped by block, paragraph and line, in reading order, with a
+    # blank line between paragraphs as image_to_string does
+    assert text == "ADCB Bank\nStatement Date\n\nAED 1,250.00"
+    # Unparseable and negative confidences are left out of the mean
+    assert abs(confidence - (88 + 91 + 95.5 + 90 + 70) / 5) < 1e-9
+
+
+def test_column_gaps_are_kept():
+    data = fake_data([
+        (1, 1, 1, '250.00', 90, 400),
+        (1, 1, 1, '01/02/2024', 90, 0),
+        (1, 1, 1, 'CARREFOUR', 90, 120),
+        (1, 1, 1, 'DUBAI', 90, 220),
+    ])
+    text, _ = with_image_to_data(lambda img, config, output_type: data,
+                                 lambda: ocr_engine._ocr_image(None, FAST_CONFIG))
+
+    # Words sorted by their left edge; a column gap stays wider than a word gap
+    assert text == "01/02/2024  CARREFOUR DUBAI" + " " * 13 + "250.00"
+    assert re.split(r'\s{2,}', text) == ['01/02/2024', 'CARREFOUR DUBAI', '250.00']
+
+
+def test_low_confidence_pages_escalate():
+    confidences = {'--psm 6': 35, '--psm 4': 52, '--psm 3': 81, '--psm 11': 99}
+    calls = []
+
+    def fake(img, config, output_type):
+        calls.append(config)
+        return fake_data([(1, 1, 1, config, confidences[config])])
+
+    pages = with_image_to_data(fake, lambda: OCREngine(max_workers=1, confidence_threshold=60)
+                               .ocr_pages(statement_pdf(1)))
+
+    # Stops at the first mode over the threshold and keeps its text
+    assert calls == ['--psm 6', '--psm 4', '--psm 3']
+    assert pages[0] == {'text': '--psm 3', 'confidence': 81}
+
+    calls.clear()
+    confidences['--psm 6'] = 75
+    with_image_to_data(fake, lambda: OCREngine(max_workers=1).ocr_pages(statement_pdf(1)))
+    assert calls == ['--psm 6']
+
+
+def test_pool_keeps_page_order():
+    def fake(img, config, output_type):
+        page_num = page_of(img, zoom=2.0)
+        # Earlier pages finish last
+        time.sleep(0.05 * (4 - page_num))
+        return fake_data([(1, 1, 1, f'PAGE{page_num}', 90)])
+
+    engine = OCREngine(zoom=2.0)
+    # Force the pool even on a single-CPU machine; the mock is inherited by the forked workers
+    engine.max_workers = 3
+    pdf = statement_pdf(5)
+
+    pages = with_image_to_data(fake, lambda: engine.ocr_pages(pdf))
+    assert sorted(pages) == [0, 1, 2, 3, 4]
+    assert all(pages[n]['text'] == f'PAGE{n}' for n in pages)
+
+    text = with_image_to_data(fake, lambda: engine.extract_text(pdf))
+    assert text == ''.join(f'PAGE{n}\n' for n in range(5))
+
+    subset = with_image_to_data(fake, lambda: engine.ocr_pages(pdf, page_numbers=[4, 1]))
+    assert {n: page['text'] for n, page in subset.items()} == {4: 'PAGE4', 1: 'PAGE1'}
+
+
+if __name__ == "__main__":
+    test_lines_rebuilt_from_word_boxes()
+    test_column_gaps_are_kept()
+    test_low_confidence_pages_escalate()
+    test_pool_keeps_page_order()
+    print("OCR engine tests passed")
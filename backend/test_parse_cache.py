@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Test script for the content-hash keyed parse cache
+"""
+
+import os
+import time
+import tempfile
+from services.parse_cache import ParseCache
+
+
+def test_lru_eviction_and_counters():
+    cache = ParseCache(max_entries=2)
+    keys = [cache.key_for(f"statement {i}".encode()) for i in range(3)]
+
+    for i, key in enumerate(keys):
+        cache.put(key, f"text {i}", {'statement': i})
+
+    assert cache.get(keys[0]) is None          # evicted
+    assert cache.get(keys[2]) == {'statement': 2}
+
+    # Callers may mutate what they get back without corrupting the cache
+    result = cache.get(keys[1])
+    result['transactions_saved'] = 10
+    assert cache.get(keys[1]) == {'statement': 1}
+
+    stats = cache.stats()
+    print(f"Stats: {stats}")
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (3, 1, 1)
+
+
+def test_disk_tier_and_password_scoping():
+    with tempfile.TemporaryDirectory() as tmp:
+        key = ParseCache.key_for(b"plain statement")
+        ParseCache(disk_dir=tmp).put(key, "text", {'statement': 'plain'})
+        path = os.path.join(tmp, key[:2], f"{key}.json")
+        assert os.stat(path).st_mode & 0o777 == 0o600
+
+        # A fresh process-level cache finds the entry on disk
+        cache = ParseCache(disk_dir=tmp)
+        assert cache.get(key) == {'statement': 'plain'}
+        assert cache.stats()['disk_hits'] == 1
+
+        # Results unlocked with a customer's password never reach the disk
+        locked = ParseCache.key_for(b"encrypted statement")
+        cache.put(locked, "decrypted text", {'statement': 'unlocked'}, customer_id=7)
+        assert cache.get(locked, customer_id=8) is None
+        assert cache.get(locked, customer_id=7) == {'statement': 'unlocked'}
+        assert not os.path.exists(os.path.join(tmp, locked[:2]))
+        assert ParseCache(disk_dir=tmp).get(locked, customer_id=7) is None
+
+
+def test_disk_entries_expire():
+    with tempfile.TemporaryDirectory() as tmp:
+        key = ParseCache.key_for(b"old statement")
+        ParseCache(disk_dir=tmp).put(key, "text", {'statement': 'old'})
+        path = os.path.join(tmp, key[:2], f"{key}.json")
+        week_ago = time.time() - 7 * 86400
+        os.utime(path, (week_ago, week_ago))
+
+        assert ParseCache(disk_dir=tmp, ttl_days=30).get(key) == {'statement': 'old'}
+        assert ParseCache(disk_dir=tmp, ttl_days=1).get(key) is None
+        assert not os.path.exists(path)
+
+
+if __name__ == "__main__":
+    test_lru_eviction_and_counters()
+    test_disk_tier_and_password_scoping()
+    test_disk_entries_expire()
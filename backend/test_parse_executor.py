@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test script for the bounded parse executor
+"""
+
+import asyncio
+import threading
+
+from fastapi import HTTPException
+
+from services.parse_executor import ParseExecutor
+
+
+def test_full_queue_is_rejected():
+    executor = ParseExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(executor.run(release.wait))
+        queued = asyncio.ensure_future(executor.run(lambda: 'queued'))
+        await asyncio.sleep(0.05)
+        assert (executor.running, executor.queued) == (1, 1)
+
+        try:
+            await executor.run(lambda: 'rejected')
+            assert False, "work past the queue limit was accepted"
+        except HTTPException as e:
+            assert e.status_code == 503
+
+        release.set()
+        return await running, await queued
+
+    try:
+        assert asyncio.run(scenario()) == (True, 'queued')
+        stats = executor.stats()
+        assert (stats['completed'], stats['rejected'], stats['running'], stats['queue_depth']) == (2, 1, 0, 0)
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+def test_cancelled_requests_leave_the_queue():
+    executor = ParseExecutor(max_workers=1, max_queue=2)
+    release = threading.Event()
+    ran = []
+
+    async def scenario():
+        running = asyncio.ensure_future(executor.run(release.wait))
+        waiting = [asyncio.ensure_future(executor.run(ran.append, n)) for n in range(2)]
+        await asyncio.sleep(0.05)
+        assert executor.queued == 2
+
+        # Both clients disconnect while their work is still queued
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        assert executor.queued == 0
+
+        # The freed slots take new work instead of answering 503
+        again = [asyncio.ensure_future(executor.run(ran.append, n)) for n in (2, 3)]
+        await asyncio.sleep(0.05)
+        release.set()
+        await running
+        await asyncio.gather(*again)
+
+    try:
+        asyncio.run(scenario())
+        stats = executor.stats()
+        assert ran == [2, 3]
+        assert (stats['cancelled'], stats['rejected'], stats['completed']) == (2, 0, 3)
+        assert (stats['running'], stats['queue_depth']) == (0, 0)
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+if __name__ == "__main__":
+    test_full_queue_is_rejected()
+    test_cancelled_requests_leave_the_queue()
+    print("Parse executor tests passed")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Test script for the parallel password search on encrypted statements
+"""
+
+import io
+import os
+import time
+import tempfile
+import threading
+import fitz
+import pikepdf
+from fastapi import HTTPException
+from cryptography.fernet import Fernet
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base
+from models import LearnedPassword, PasswordTemplateStat
+from services.password_search import PasswordSearchEngine
+from services.password_store import PasswordStore
+from services.pdf_parser import PDFParser
+
+SAMPLE_PDF = "Email Credit Card Statement_unlocked.pdf"
+PASSWORD = "19804567"
+
+
+class MockCustomer:
+    def __init__(self):
+        self.id = 1
+        self.name = "John Doe"
+        self.phone_number = "050 123 4567"
+        self.date_of_birth = "15/03/1980"
+        self.credit_cards = []
+
+
+def encrypt_sample(password=PASSWORD):
+    with pikepdf.open(SAMPLE_PDF) as pdf:
+        buffer = io.BytesIO()
+        pdf.save(buffer, encryption=pikepdf.Encryption(owner="owner", user=password, R=6))
+    return buffer.getvalue()
+
+
+def store_in(tmp):
+    engine = create_engine(f"sqlite:///{os.path.join(tmp, 'store.db')}")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    return PasswordStore(session_factory=session_factory, key=Fernet.generate_key()), session_factory
+
+
+def blank_pdf():
+    doc = fitz.open()
+    doc.new_page()
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_password_search():
+    pdf_bytes = encrypt_sample()
+    candidates = [f"wrong{i}" for i in range(60)] + [PASSWORD] + [f"later{i}" for i in range(20)]
+
+    for name, engine in [
+        ("serial", PasswordSearchEngine(max_workers=1)),
+        ("parallel", PasswordSearchEngine(max_workers=4)),
+    ]:
+        start = time.time()
+        found = engine.search(pdf_bytes, candidates)
+        print(f"{name}: found {found!r} in {time.time() - start:.2f}s")
+        assert found == PASSWORD
+
+    missing = PasswordSearchEngine(max_workers=4).search(pdf_bytes, candidates[:60])
+    assert missing is None
+
+    budgeted = PasswordSearchEngine(max_workers=1, time_budget=0.01).search(pdf_bytes, candidates)
+    print(f"with 10ms budget: {budgeted!r}")
+    assert budgeted is None
+
+
+def test_unencrypted_pdf_has_no_password():
+    pdf_bytes = blank_pdf()
+    candidates = [PASSWORD] + [f"wrong{i}" for i in range(40)]
+    assert PasswordSearchEngine(max_workers=1).search(pdf_bytes, candidates) is None
+    assert PasswordSearchEngine(max_workers=4).search(pdf_bytes, candidates) is None
+
+    # A blank statement is rejected without learning a password from it
+    with tempfile.TemporaryDirectory() as tmp:
+        store, session_factory = store_in(tmp)
+        try:
+            PDFParser(password_store=store).parse_pdf_source(pdf_bytes, MockCustomer())
+            assert False, "a blank statement was parsed"
+        except HTTPException as e:
+            assert e.status_code == 400
+        db = session_factory()
+        assert db.query(LearnedPassword).count() == 0
+        assert db.query(PasswordTemplateStat).count() == 0
+        db.close()
+
+
+def test_password_learned_only_from_extracted_text():
+    # Encrypted with the customer's usual password, but there is no text to recover
+    with pikepdf.open(io.BytesIO(blank_pdf())) as pdf:
+        buffer = io.BytesIO()
+        pdf.save(buffer, encryption=pikepdf.Encryption(owner="owner", user=PASSWORD, R=6))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store, session_factory = store_in(tmp)
+        parser = PDFParser(password_store=store)
+        assert parser.try_password_protected_pdf(buffer.getvalue(), MockCustomer()) is None
+        db = session_factory()
+        assert db.query(LearnedPassword).count() == 0
+        assert db.query(PasswordTemplateStat).count() == 0
+        db.close()
+
+        assert parser.try_password_protected_pdf(encrypt_sample(), MockCustomer())
+        db = session_factory()
+        assert db.query(LearnedPassword).count() == 1
+        db.close()
+
+
+def test_parser_unlocks_statement():
+    parser = PDFParser()
+    text = parser.try_password_protected_pdf(encrypt_sample(), MockCustomer())
+    assert text and "AED" in text
+    print(f"Unlocked statement text: {len(text)} characters")
+
+
+def test_learned_password_is_tried_first():
+    with tempfile.TemporaryDirectory() as tmp:
+        store, _ = store_in(tmp)
+        parser = PDFParser(password_store=store)
+        customer = MockCustomer()
+
+        # The bank uses "name + last 4 phone digits", which is far down the default list
+        password = "john4567"
+        pdf_bytes = encrypt_sample(password)
+        first_upload = parser.generate_password_candidates(customer)
+        print(f"First upload: password at position {first_upload.index(password) + 1}")
+
+        assert parser.try_password_protected_pdf(pdf_bytes, customer)
+        second_upload = parser.generate_password_candidates(customer)
+        print(f"Repeat upload: password at position {second_upload.index(password) + 1}")
+        assert second_upload[0] == password
+
+        # Another customer benefits from the global template statistics
+        other = MockCustomer()
+        other.id = 2
+        other.name = "Mary Major"
+        other.phone_number = "050 765 4321"
+        other_candidates = parser.generate_password_candidates(other)
+        assert other_candidates[0] == "mary4321"
+
+
+def test_key_file_created_once_by_concurrent_stores():
+    with tempfile.TemporaryDirectory() as tmp:
+        key_file = os.path.join(tmp, "store.key")
+        previous = os.environ.get("PASSWORD_STORE_KEY_FILE")
+        os.environ["PASSWORD_STORE_KEY_FILE"] = key_file
+        try:
+            stores, errors = [], []
+            start = threading.Barrier(8)
+
+            def create():
+                start.wait()
+                try:
+                    stores.append(PasswordStore())
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=create) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if previous is None:
+                os.environ.pop("PASSWORD_STORE_KEY_FILE")
+            else:
+                os.environ["PASSWORD_STORE_KEY_FILE"] = previous
+
+        assert not errors and len(stores) == 8
+        # Every store uses the one key on disk, and no temp files are left behind
+        token = stores[0]._encrypt("secret")
+        assert all(store._decrypt(token) == "secret" for store in stores)
+        assert os.listdir(tmp) == ["store.key"]
+        assert os.stat(key_file).st_mode & 0o777 == 0o600
+
+
+if __name__ == "__main__":
+    test_password_search()
+    test_unencrypted_pdf_has_no_password()
+    test_password_learned_only_from_extracted_text()
+    test_parser_unlocks_statement()
+    test_learned_password_is_tried_first()
+    test_key_file_created_once_by_concurrent_stores()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test script for the per-page text layer / OCR decision, with the OCR engine stubbed out
+"""
+
+import fitz
+from fastapi import HTTPException
+
+from services.pdf_parser import PDFParser
+
+STATEMENT_LINE = "Statement Date 01/02/2024  Total Amount Due AED 1,250.00"
+
+
+class StubOCR:
+    """Returns canned text per page and records which pages were OCR'd"""
+
+    def __init__(self, text_for_page=lambda page_num: f"OCR PAGE {page_num}"):
+        self.text_for_page = text_for_page
+        self.calls = []
+
+    def ocr_pages(self, source, page_numbers=None, password=None):
+        doc = fitz.open(stream=source, filetype="pdf")
+        page_count = len(doc)
+        doc.close()
+        if page_numbers is None:
+            page_numbers = list(range(page_count))
+        self.calls.append(page_numbers)
+        return {n: {'text': self.text_for_page(n), 'confidence': 87.25} for n in page_numbers}
+
+
+class MockCustomer:
+    def __init__(self):
+        self.id = 1
+        self.name = "John Doe"
+        self.phone_number = "050 123 4567"
+        self.date_of_birth = "15/03/1980"
+        self.credit_cards = []
+
+
+def scan_image():
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 40, 40), False)
+    pix.clear_with(200)
+    return pix.tobytes("png")
+
+
+def statement_pdf(pages):
+    """A PDF from page specs: ('text', str), ('scan', None), ('scan', caption) or ('blank', None)"""
+    doc = fitz.open()
+    for kind, text in pages:
+        page = doc.new_page()
+        if kind == 'scan':
+            page.insert_image(fitz.Rect(50, 50, 550, 750), stream=scan_image())
+        if text:
+            page.insert_text((72, 72), text)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def parser_with(ocr):
+    parser = PDFParser()
+    parser.ocr_engine = ocr
+    return parser
+
+
+def test_pages_decided_one_by_one():
+    pdf = statement_pdf([
+        ('text', STATEMENT_LINE),
+        ('scan', None),
+        ('scan', "Page 3 of 4"),
+        ('blank', None),
+    ])
+    ocr = StubOCR()
+    text, pages = parser_with(ocr).extract_text_hybrid(pdf)
+
+    # Only the image pages without a usable text layer are OCR'd, in one call
+    assert ocr.calls == [[1, 2]]
+    assert [page['method'] for page in pages] == ['text_layer', 'ocr', 'ocr', 'empty']
+    assert pages[1] == {'page': 2, 'method': 'ocr', 'ocr_confidence': 87.2, 'characters': len("OCR PAGE 1")}
+    assert 'ocr_confidence' not in pages[0] and 'ocr_confidence' not in pages[3]
+    assert text.split("\n")[:3] == [STATEMENT_LINE, "", "OCR PAGE 1"]
+
+
+def test_text_layer_threshold():
+    pdf = statement_pdf([('scan', "Page 3 of 4"), ('text', "Page 3 of 4")])
+
+    # An 11 character caption is under the default threshold on the scanned page;
+    # the page without images keeps its short text layer either way
+    ocr = StubOCR()
+    _, pages = parser_with(ocr).extract_text_hybrid(pdf)
+    assert ocr.calls == [[0]]
+    assert [page['method'] for page in pages] == ['ocr', 'text_layer']
+
+    ocr = StubOCR()
+    parser = parser_with(ocr)
+    parser.min_text_layer_chars = len("Page 3 of 4")
+    text, pages = parser.extract_text_hybrid(pdf)
+    assert ocr.calls == []
+    assert [page['method'] for page in pages] == ['text_layer', 'text_layer']
+    assert text.count("Page 3 of 4") == 2
+
+
+def test_last_resort_ocr_skipped_after_hybrid_ocr():
+    customer = MockCustomer()
+
+    # The hybrid pass already OCR'd the scanned page and read nothing: no second pass
+    ocr = StubOCR(lambda page_num: "")
+    pdf = statement_pdf([('scan', None), ('blank', None)])
+    try:
+        parser_with(ocr).extract_text(pdf, customer)
+        assert False, "a statement without text was parsed"
+    except HTTPException as e:
+        assert e.status_code == 400
+    assert ocr.calls == [[0]]
+    _, pages = parser_with(StubOCR(lambda page_num: "")).extract_text_hybrid(pdf)
+    assert pages[0] == {'page': 1, 'method': 'empty', 'characters': 0, 'ocr_confidence': 87.2}
+
+    # Nothing was OCR'd, so the last resort reads every page
+    ocr = StubOCR()
+    text, pages, needed_password = parser_with(ocr).extract_text(statement_pdf([('blank', None)] * 2), customer)
+    assert ocr.calls == [[0, 1]]
+    assert (text, needed_password) == ("OCR PAGE 0\nOCR PAGE 1\n", False)
+    assert [page['method'] for page in pages] == ['ocr', 'ocr']
+
+
+if __name__ == "__main__":
+    test_pages_decided_one_by_one()
+    test_text_layer_threshold()
+    test_last_resort_ocr_skipped_after_hybrid_ocr()
+    print("PDF parser tests passed")
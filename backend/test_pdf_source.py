@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script for spooled uploads and the streaming upload size limit
+"""
+
+import io
+import os
+import asyncio
+import hashlib
+import tempfile
+
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from starlette.datastructures import Headers
+
+from services.pdf_source import SpooledUpload, UploadSizeLimitMiddleware, MULTIPART_OVERHEAD_BYTES
+
+
+def upload_of(content, size=None):
+    headers = Headers({'content-type': 'application/pdf'})
+    return UploadFile(io.BytesIO(content), size=size, filename="statement.pdf", headers=headers)
+
+
+def test_spooled_upload_and_cleanup():
+    content = os.urandom(3 * 1024 * 1024 + 17)
+    with tempfile.TemporaryDirectory() as spool_dir:
+        upload = asyncio.run(SpooledUpload.from_upload(upload_of(content), max_bytes=len(content),
+                                                       spool_dir=spool_dir))
+        with upload:
+            assert (upload.size, upload.filename) == (len(content), "statement.pdf")
+            assert upload.sha256 == hashlib.sha256(content).hexdigest()
+            assert upload.read_bytes() == content
+            assert os.path.dirname(upload.path) == spool_dir
+        # Closing deletes the spooled file, and closing twice is harmless
+        assert os.listdir(spool_dir) == []
+        upload.close()
+
+
+def test_spooled_upload_over_limit():
+    content = b"x" * (2 * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as spool_dir:
+        for declared in (None, len(content)):
+            try:
+                asyncio.run(SpooledUpload.from_upload(upload_of(content, size=declared), max_bytes=1024 * 1024,
+                                                      spool_dir=spool_dir))
+                assert False, "an oversized upload was accepted"
+            except HTTPException as e:
+                assert e.status_code == 413
+            # The partial spool file is removed
+            assert os.listdir(spool_dir) == []
+
+
+def run_request(app, chunks, content_length=None):
+    """Send a request body in chunks through the app; return the status, the body and the chunks read"""
+    headers = [(b'content-type', b'multipart/form-data; boundary=limit')]
+    if content_length is not None:
+        headers.append((b'content-length', str(content_length).encode()))
+    scope = {'type': 'http', 'method': 'POST', 'path': '/upload', 'raw_path': b'/upload', 'query_string': b'',
+             'headers': headers, 'http_version': '1.1', 'scheme': 'http', 'server': ('test', 80),
+             'client': ('test', 1), 'root_path': ''}
+    pending = list(chunks)
+    read = 0
+    sent = []
+
+    async def receive():
+        nonlocal read
+        if not pending:
+            return {'type': 'http.disconnect'}
+        read += 1
+        chunk = pending.pop(0)
+        return {'type': 'http.request', 'body': chunk, 'more_body': bool(pending)}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    status = next(m['status'] for m in sent if m['type'] == 'http.response.start')
+    body = b''.join(m.get('body', b'') for m in sent if m['type'] == 'http.response.body')
+    return status, body, read
+
+
+def limited_app(max_bytes):
+    app = FastAPI()
+    calls = []
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        calls.append(file.filename)
+        return {"size": file.size}
+
+    return UploadSizeLimitMiddleware(app, max_bytes=max_bytes), calls
+
+
+def multipart(content):
+    return (b'--limit\r\nContent-Disposition: form-data; name="file"; filename="s.pdf"\r\n'
+            b'Content-Type: application/pdf\r\n\r\n' + content + b'\r\n--limit--\r\n')
+
+
+def test_declared_size_rejected_before_reading():
+    app, calls = limited_app(max_bytes=1024 * 1024)
+    status, body, read = run_request(app, [b'x' * 1024], content_length=10 * 1024 * 1024)
+    assert (status, read, calls) == (413, 0, [])
+    assert b'maximum upload size' in body
+
+
+def test_streamed_body_cut_off_at_limit():
+    app, calls = limited_app(max_bytes=1024 * 1024)
+    body = multipart(b'x' * (8 * 1024 * 1024))
+    chunks = [body[i:i + 256 * 1024] for i in range(0, len(body), 256 * 1024)]
+
+    status, _, read = run_request(app, chunks)
+    assert status == 413 and calls == []
+    # Reading stopped at the first chunk past the limit, not at the end of the upload
+    assert read == (1024 * 1024 + MULTIPART_OVERHEAD_BYTES) // (256 * 1024) + 1 < len(chunks)
+
+    # Uploads within the limit go through untouched
+    status, body, _ = run_request(app, [multipart(b'x' * 1000)])
+    assert (status, body, calls) == (200, b'{"size":1000}', ['s.pdf'])
+
+
+if __name__ == "__main__":
+    test_spooled_upload_and_cleanup()
+    test_spooled_upload_over_limit()
+    test_declared_size_rejected_before_reading()
+    test_streamed_body_cut_off_at_limit()
+    print("PDF source tests passed")
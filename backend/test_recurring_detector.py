@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test script for the vectorized recurring-charge detector
+"""
+
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Customer, Transaction
+from services.merchant_memo import normalize_merchant
+from services.recurring_detector import RecurringChargeDetector
+
+START = datetime(2024, 1, 5)
+
+
+def history_rows():
+    rows = []
+    # Monthly subscription with a slightly varying billing day
+    for i, jitter in enumerate([0, 1, -1, 0, 2, 0]):
+        rows.append(("NETFLIX.COM 8841 DUBAI", START + timedelta(days=30 * i + jitter), 56.0))
+    # Weekly gym fee
+    for i in range(5):
+        rows.append(("FITNESS FIRST JLT", START + timedelta(days=7 * i), 120.0))
+    # Same merchant every month but a different amount each time
+    for i, amount in enumerate([80.0, 410.5, 35.0, 220.0]):
+        rows.append(("CARREFOUR MOE", START + timedelta(days=30 * i), amount))
+    # Stable amount at irregular intervals
+    for days in [0, 3, 40, 41, 120]:
+        rows.append(("ADNOC 1123", START + timedelta(days=days), 100.0))
+    return rows
+
+
+def test_detect():
+    rows = history_rows()
+    history = pd.DataFrame({
+        'id': range(len(rows)),
+        'merchant': [merchant for merchant, _, _ in rows],
+        'date': [date for _, date, _ in rows],
+        'amount': [amount for _, _, amount in rows],
+    })
+
+    series, recurring_ids = RecurringChargeDetector().detect(history)
+    summary = {record['merchant']: record for record in RecurringChargeDetector().summarize(series)}
+    print(f"Recurring: {list(summary)}")
+
+    assert set(summary) == {"NETFLIX.COM 8841 DUBAI", "FITNESS FIRST JLT"}
+    assert summary["NETFLIX.COM 8841 DUBAI"]['frequency'] == 'monthly'
+    assert summary["FITNESS FIRST JLT"]['frequency'] == 'weekly'
+    assert summary["FITNESS FIRST JLT"]['next_expected_date'].startswith('2024-02-09')
+    assert sorted(recurring_ids.tolist()) == list(range(11))
+
+
+def test_update_customer_writes_back():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    db.add(Customer(id=1, name="Test", email="test@example.com", phone_number="1", date_of_birth="1990-01-01"))
+    for merchant, date, amount in history_rows():
+        db.add(Transaction(customer_id=1, merchant=merchant, date=date, amount=amount, is_recurring=False))
+    db.commit()
+
+    detector = RecurringChargeDetector()
+    assert detector.update_customer(db, 1)['flagged'] == 11
+
+    # An incremental run only touches the merchants of the new batch
+    db.add(Transaction(customer_id=1, merchant="ADNOC 1123", date=START + timedelta(days=121), amount=100.0))
+    db.flush()
+    result = detector.update_customer(db, 1, merchants=["ADNOC 1123"])
+    assert (result['transactions_evaluated'], result['flagged'], result['cleared']) == (6, 0, 0)
+
+    flagged = db.query(Transaction).filter(Transaction.is_recurring == True).count()
+    assert flagged == 11
+    db.close()
+
+
+def test_incremental_update_reads_only_the_batch_merchants():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    db.add(Customer(id=1, name="Test", email="test@example.com", phone_number="1", date_of_birth="1990-01-01"))
+    for merchant, date, amount in history_rows():
+        db.add(Transaction(customer_id=1, merchant=merchant, merchant_key=normalize_merchant(merchant),
+                           date=date, amount=amount))
+    # Years-old charges of the same merchant, and one row stored before merchant keys existed
+    for i in range(3):
+        db.add(Transaction(customer_id=1, merchant="NETFLIX.COM 17", merchant_key="netflix",
+                           date=START - timedelta(days=2000 + 30 * i), amount=40.0, is_recurring=True))
+    db.add(Transaction(customer_id=1, merchant="NETFLIX.COM 5", date=START + timedelta(days=180), amount=56.0))
+    db.commit()
+
+    detector = RecurringChargeDetector()
+    history = detector.load_history(db, 1, merchant_keys={'netflix'}, since=START - timedelta(days=30))
+    assert len(history) == 7 and set(history['merchant'].str[:7]) == {'NETFLIX'}
+
+    result = detector.update_customer(db, 1, merchants=["NETFLIX.COM 5"], batch_start=START + timedelta(days=180))
+    assert (result['transactions_evaluated'], result['recurring_series'], result['flagged']) == (7, 1, 7)
+    # Rows outside the lookback window are neither read nor cleared
+    assert db.query(Transaction).filter(Transaction.is_recurring == True).count() == 10
+    db.close()
+
+
+if __name__ == "__main__":
+    test_detect()
+    test_update_customer_writes_back()
+    test_incremental_update_reads_only_the_batch_merchants()
+    print("Recurring detector tests passed")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Test script for the service registry and the /ready and /stats endpoints
+"""
+
+import os
+import time
+import threading
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from services.ingestion_jobs import IngestionJobQueue
+from services.registry import ServiceRegistry
+
+
+class SlowService:
+    pass
+
+
+def test_concurrent_get_builds_once():
+    built = []
+
+    def factory():
+        built.append(threading.current_thread().name)
+        time.sleep(0.05)
+        return SlowService()
+
+    services = ServiceRegistry()
+    services.register('slow', factory)
+    assert services.loaded('slow') is None
+
+    barrier = threading.Barrier(8)
+    instances = []
+
+    def request():
+        barrier.wait()
+        instances.append(services.get('slow'))
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(built) == 1
+    assert len(instances) == 8 and all(instance is instances[0] for instance in instances)
+    assert services.loaded('slow') is instances[0]
+    assert services.status()['services']['slow']['loaded'] is True
+
+
+def test_failed_service_in_status():
+    failures = [RuntimeError("model file missing")]
+
+    def factory():
+        if failures:
+            raise failures.pop()
+        return SlowService()
+
+    services = ServiceRegistry()
+    services.register('model', factory)
+    services.register('lazy', SlowService, warm=False)
+
+    # warm_up reports the failure instead of raising it
+    services.warm_up()
+    status = services.status()
+    assert status['ready'] is False
+    assert status['services']['model'] == {'loaded': False, 'warm': True, 'load_seconds': None,
+                                           'error': "model file missing"}
+    # Services that are not warm never hold up readiness
+    assert status['services']['lazy']['loaded'] is False
+
+    # The next use builds it and clears the error
+    assert isinstance(services.get('model'), SlowService)
+    status = services.status()
+    assert status['ready'] is True
+    assert status['services']['model']['error'] is None
+    assert status['services']['model']['load_seconds'] is not None
+
+
+def test_ready_after_warm_up():
+    # Keep the import from migrating the local database
+    os.environ['RUN_MIGRATIONS_ON_STARTUP'] = '0'
+    import main
+
+    release = threading.Event()
+    services = ServiceRegistry()
+    services.register('model', lambda: release.wait() and SlowService())
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    jobs = IngestionJobQueue(session_factory=sessionmaker(bind=engine))
+
+    original = main.services, main.ingestion_jobs
+    main.services, main.ingestion_jobs = services, jobs
+    try:
+        # Without the context manager the startup hooks do not run, so the test drives warm-up
+        client = TestClient(main.app)
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()['services']['model']['loaded'] is False
+
+        thread = services.warm_up_in_background()
+        time.sleep(0.05)
+        assert thread.is_alive()
+        assert client.get("/ready").status_code == 503
+
+        release.set()
+        thread.join(timeout=5)
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()['ready'] is True
+        assert response.json()['models'] == {'spacy': False}
+
+        stats = client.get("/stats").json()
+        assert set(stats) == {'parse_cache', 'parse_queue', 'ingestion_jobs', 'merchant_memo', 'anomaly_models'}
+        assert stats['parse_queue']['queue_depth'] == 0
+        assert stats['ingestion_jobs']['jobs']['queued'] == 0
+        # Services that were never loaded are not built just to report on them
+        assert stats['merchant_memo'] is None and stats['anomaly_models'] is None
+    finally:
+        release.set()
+        main.services, main.ingestion_jobs = original
+
+
+if __name__ == "__main__":
+    test_concurrent_get_builds_once()
+    test_failed_service_in_status()
+    test_ready_after_warm_up()
+    print("Service registry tests passed")
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Train the lightweight category classifier from the transactions the
+categorizer has already decided and stored in the transactions table.
+
+Only rows the categorizer labelled with one of its own categories are
+trained on; placeholders written at ingestion (a statement's 'purchase',
+an SMS 'payment_due') are not categories. The model's accuracy and
+latency are always compared with the rule cascade on a held-out split of
+those decisions, and also on labels the cascade did not produce when there
+are any: stored rows whose merchant a user category rule matches, and an
+optional CSV of hand-labelled transactions (merchant, description,
+category, subcategory). Those rows are never trained on. The model saved
+is fitted on every decision, where the API loads it from
+(CATEGORY_MODEL_PATH, default category_model.joblib).
+
+Usage:
+    python train_category_model.py [--output path] [--min-confidence 0.5]
+        [--labels labels.csv] [--customer-id 1] [--threshold 0.7]
+        [--test-size 0.2] [--seed 42]
+"""
+import os
+import sys
+import csv
+import time
+import random
+import argparse
+
+from sqlalchemy import or_
+
+from database import SessionLocal, engine
+from migrations import run_migrations
+from models import Transaction
+from services.categorizer import TransactionCategorizer
+from services.category_model import CategoryModel, DEFAULT_MODEL_PATH
+from services.merchant_memo import MerchantCategoryMemo, normalize_merchant
+
+# Rows stored before provenance was recorded (NULL) are kept when their category is one of the categorizer's
+TRAINING_SOURCES = ('categorizer',)
+
+
+def load_examples(categories, customer_id=None, min_confidence=0.0):
+    """
+    (training examples, rule-labelled examples). A stored row whose merchant
+    a category rule matches is labelled with the rule's category instead and
+    held out; the rest are trained on when the categorizer decided them.
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(
+            Transaction.merchant, Transaction.description, Transaction.raw_text,
+            Transaction.category, Transaction.subcategory, Transaction.confidence_score
+        ).filter(
+            Transaction.category.in_(categories),
+            or_(Transaction.category_source.in_(TRAINING_SOURCES), Transaction.category_source.is_(None))
+        )
+        if customer_id is not None:
+            query = query.filter(Transaction.customer_id == customer_id)
+
+        rows = []
+        for merchant, description, raw_text, category, subcategory, confidence in query.yield_per(10000):
+            transaction = {
+                key: value for key, value in
+                (('merchant', merchant), ('description', description), ('raw_text', raw_text))
+                if value
+            }
+            rows.append((transaction, category, subcategory, confidence))
+    finally:
+        db.close()
+
+    rules = MerchantCategoryMemo().match_rules(normalize_merchant(t.get('merchant')) for t, _, _, _ in rows)
+    examples, labelled = [], []
+    for transaction, category, subcategory, confidence in rows:
+        rule = rules.get(normalize_merchant(transaction.get('merchant')))
+        if rule is not None:
+            if rule[0] in categories:
+                labelled.append((transaction, rule[0], rule[1]))
+        elif (confidence or 0.0) >= min_confidence:
+            examples.append((transaction, category, subcategory))
+    return examples, labelled
+
+
+def load_labels(path, categories):
+    """Hand-labelled transactions from a CSV with merchant, description, category and subcategory columns"""
+    labelled = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            category = (row.get('category') or '').strip()
+            if category not in categories:
+                continue
+            transaction = {key: row[key] for key in ('merchant', 'description') if row.get(key)}
+            labelled.append((transaction, category, (row.get('subcategory') or '').strip() or 'General'))
+    return labelled
+
+
+def split_examples(examples, test_size, seed):
+    """(train, test): a seeded random split of the stored decisions"""
+    shuffled = list(examples)
+    random.Random(seed).shuffle(shuffled)
+    cut = min(max(1, int(len(shuffled) * test_size)), len(shuffled) - 1)
+    return shuffled[cut:], shuffled[:cut]
+
+
+def fit_model(categorizer, examples):
+    return CategoryModel().fit(
+        [categorizer._extract_text_for_analysis(transaction) for transaction, _, _ in examples],
+        [category for _, category, _ in examples],
+        [subcategory for _, _, subcategory in examples]
+    )
+
+
+def evaluate(model, categorizer, test_examples, threshold):
+    texts = [categorizer._extract_text_for_analysis(transaction) for transaction, _, _ in test_examples]
+    labels = [category for _, category, _ in test_examples]
+
+    started = time.perf_counter()
+    predictions = model.predict(texts)
+    model_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    cascade = categorizer.categorize_transactions([dict(transaction) for transaction, _, _ in test_examples])
+    cascade_seconds = time.perf_counter() - started
+
+    confident = [(prediction, label) for prediction, label in zip(predictions, labels) if prediction[2] >= threshold]
+
+    # The rows the keyword and pattern stages leave to spaCy and TF-IDF, which the model replaces
+    ambiguous = [
+        text for text in texts
+        if categorizer._keyword_matching(text)[2] <= 0.8 and categorizer._pattern_matching(text)[2] <= 0.7
+    ]
+    ambiguous_model_seconds = ambiguous_cascade_seconds = 0.0
+    if ambiguous:
+        started = time.perf_counter()
+        model.predict(ambiguous)
+        ambiguous_model_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        categorizer.categorize_transactions([{'description': text} for text in ambiguous])
+        ambiguous_cascade_seconds = time.perf_counter() - started
+
+    return {
+        'rows': len(test_examples),
+        'model_accuracy': sum(p[0] == label for p, label in zip(predictions, labels)) / len(labels),
+        'model_coverage': len(confident) / len(labels),
+        'model_confident_accuracy': (sum(p[0] == label for p, label in confident) / len(confident)) if confident else 0.0,
+        'cascade_accuracy': sum(t['category'] == label for t, label in zip(cascade, labels)) / len(labels),
+        'model_ms_per_1k': model_seconds * 1000 / len(labels) * 1000,
+        'cascade_ms_per_1k': cascade_seconds * 1000 / len(labels) * 1000,
+        'ambiguous_rows': len(ambiguous),
+        'ambiguous_model_ms_per_1k': ambiguous_model_seconds * 1000 / len(ambiguous) * 1000 if ambiguous else 0.0,
+        'ambiguous_cascade_ms_per_1k': ambiguous_cascade_seconds * 1000 / len(ambiguous) * 1000 if ambiguous else 0.0
+    }
+
+
+def print_report(report, threshold, title, cascade_label="Cascade accuracy"):
+    print("\n" + "=" * 50)
+    print(title)
+    print("=" * 50)
+    print(f"Rows: {report['rows']}")
+    print(f"{cascade_label}: {report['cascade_accuracy']:.1%}")
+    print(f"Model accuracy: {report['model_accuracy']:.1%}")
+    print(f"Model coverage at p >= {threshold}: {report['model_coverage']:.1%} "
+          f"(accuracy {report['model_confident_accuracy']:.1%})")
+    print(f"Cascade latency: {report['cascade_ms_per_1k']:.1f} ms per 1k rows")
+    print(f"Model latency: {report['model_ms_per_1k']:.1f} ms per 1k rows")
+    if report['ambiguous_rows']:
+        print(f"Rows left to the NLP/TF-IDF stages: {report['ambiguous_rows']} "
+              f"(cascade {report['ambiguous_cascade_ms_per_1k']:.1f} ms, "
+              f"model {report['ambiguous_model_ms_per_1k']:.1f} ms per 1k rows)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the transaction category classifier")
+    parser.add_argument("--output", default=os.getenv("CATEGORY_MODEL_PATH") or DEFAULT_MODEL_PATH,
+                        help="Where to save the model (default: CATEGORY_MODEL_PATH or category_model.joblib)")
+    parser.add_argument("--customer-id", type=int, default=None, help="Only train on one customer's transactions")
+    parser.add_argument("--min-confidence", type=float, default=0.5,
+                        help="Skip rows categorized with lower confidence, e.g. the 0.3 'Other' fallback (default: 0.5)")
+    parser.add_argument("--labels", default=None,
+                        help="CSV of hand-labelled transactions to evaluate on (merchant, description, category, subcategory)")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("CATEGORY_MODEL_THRESHOLD", 0.7)),
+                        help="Probability threshold used by the categorizer (default: CATEGORY_MODEL_THRESHOLD or 0.7)")
+    parser.add_argument("--test-size", type=float, default=0.2,
+                        help="Share of the categorizer's decisions held out for the comparison (default: 0.2)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the held-out split (default: 42)")
+    args = parser.parse_args()
+
+    run_migrations(engine)
+
+    categorizer = TransactionCategorizer()
+    categories = set(categorizer.categories)
+
+    examples, labelled = load_examples(categories, args.customer_id, args.min_confidence)
+    if args.labels:
+        labelled.extend(load_labels(args.labels, categories))
+    trained_categories = {category for _, category, _ in examples}
+    print(f"Loaded {len(examples)} categorized transactions in {len(trained_categories)} categories, "
+          f"{len(labelled)} held-out labelled transactions")
+    if len(trained_categories) < 2:
+        print("Need transactions from at least two categories to train")
+        return 1
+
+    train, test = split_examples(examples, args.test_size, args.seed)
+    if len({category for _, category, _ in train}) < 2:
+        print("Need transactions from at least two categories outside the held-out split to train")
+        return 1
+    holdout_model = fit_model(categorizer, train)
+    # The labels are the cascade's own decisions, so its score is agreement with what it decided when stored
+    print_report(evaluate(holdout_model, categorizer, test, args.threshold), args.threshold,
+                 f"Held-out Categorizer Decisions (model trained on the other {len(train)})",
+                 cascade_label="Cascade agreement with stored decisions")
+
+    started = time.perf_counter()
+    model = fit_model(categorizer, examples)
+    print(f"\nModel trained on all {len(examples)} rows in {time.perf_counter() - started:.2f}s")
+
+    if labelled:
+        print_report(evaluate(model, categorizer, labelled, args.threshold), args.threshold,
+                     "Labels the Cascade Did Not Produce (category rules and --labels)")
+    else:
+        print("No labels the cascade did not produce (category rules or --labels); "
+              "the held-out decisions above are the only comparison")
+
+    model.save(args.output)
+    print(f"\nSaved to {args.output} ({os.path.getsize(args.output) / 1024:.0f} KB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())